@@ -2,6 +2,7 @@
 text classification task.
 """
 
+import argparse
 from functools import partial
 from typing import Generator
 
@@ -10,92 +11,71 @@ import pandas as pd
 import torch
 from iterstrat.ml_stratifiers import MultilabelStratifiedKFold
 from datasets import ClassLabel, Dataset, Features, Sequence, Value
-from sklearn.metrics import (
-    accuracy_score,
-    average_precision_score,
-    coverage_error,
-    f1_score,
-    label_ranking_average_precision_score,
-    label_ranking_loss,
-    multilabel_confusion_matrix,
-    precision_score,
-    recall_score,
-    roc_auc_score,
-)
 from sklearn.preprocessing import MultiLabelBinarizer
 from transformers import pipeline
 
+from dataset.artifacts import fingerprint
+from dataset.labels import LabelMatrix
 from dataset.textdataset import ArticleDataset
 from dataset.transformers_dataset import get_dict, load_data
-from metrics.auc import godbole_accuracy
+from metrics.multilabel import multilabel_metrics
+from metrics.results_store import ResultsStore
+from metrics.threshold import best_threshold
 
 LABELLED_CSV = "multi_label_dataset.csv"
 ARTICLES_DIR = "./articles"
 NUM_FOLDS = 5
+MODEL_PATH = "facebook/bart-large-mnli"
+MODEL_NAME = MODEL_PATH.rsplit("/", maxsplit=1)[-1]
+RESULTS_DIR = "results/bart"  # Store of the zero-shot predictions and metrics
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 DEVICE = "mps" if torch.backends.mps.is_available() else DEVICE
 
 
-def evaluate(y_true: np.ndarray, y_prob: np.ndarray):
+def evaluate(y_true: np.ndarray, y_prob: np.ndarray) -> dict:
     """Evaluate the model's performance on a multi-label classification task.
 
     :param y_true: True labels.
     :type y_true: np.ndarray
     :param y_prob: Predicted probabilities.
     :type y_prob: np.ndarray
+    :return: Metrics, predictions and labels.
+    :rtype: dict
     """
-    best_thresh = 0
-    max_f1 = 0.0
-    for thresh in sorted(y_prob.flatten()):
-        y_pred = (y_prob > thresh).astype(int)
-        f1 = f1_score(y_true, y_pred, average="samples")
-        if f1 > max_f1:
-            max_f1 = f1
-            best_thresh = thresh
+    best_thresh, _ = best_threshold(y_true, y_prob)
     y_pred = y_prob > best_thresh
-    acc = accuracy_score(y_true, y_pred)
-    godbole_acc = godbole_accuracy(y_true, y_pred, "macro")
-    godbole_chance_acc = godbole_accuracy(
-        y_true, np.ones_like(y_true) * np.mean(y_true), "macro"
-    )
-    cov_error = coverage_error(y_true, y_prob)
-    f1 = f1_score(y_true, y_pred, average="micro")
-    lrap = label_ranking_average_precision_score(y_true, y_prob)
-    lrap_chance = label_ranking_average_precision_score(
-        y_true, np.ones_like(y_true) * np.mean(y_true)
-    )
-    lrl = label_ranking_loss(y_true, y_prob)
-    prec = precision_score(y_true, y_pred, average="micro")
-    rec = recall_score(y_true, y_pred, average="micro")
-    y_test_inv = 1 - y_true
-    y_pred_inv = 1 - y_pred
-    spec = recall_score(y_test_inv, y_pred_inv, average="micro")
-    mlm = multilabel_confusion_matrix(y_true, y_pred)
-    auroc = roc_auc_score(y_true, y_prob, average="micro")
-    ap = average_precision_score(y_true, y_prob, average="micro")
-    ap_chance_level = average_precision_score(
-        y_true, np.ones_like(y_true) * np.mean(y_true), average="micro"
-    )
-    fill_rate_pred = np.sum(y_pred) / y_pred.size
+    metrics = multilabel_metrics(y_true, y_prob, y_pred)
+    # Constant scores at the label frequency, also used as all-positive predictions
+    chance_prob = np.ones_like(y_true) * np.mean(y_true)
+    chance = multilabel_metrics(y_true, chance_prob, chance_prob)
     fill_rate = np.sum(y_true) / y_true.size
 
     print(
-        f"acc: {acc:.4f}",
-        f"jaccard_index: {godbole_acc:.4f} / {godbole_chance_acc:.4f} (chance)",
-        f"lrap: {lrap:.4f} / {lrap_chance:.4f} (chance)",
-        f"f1: {f1:.4f}",
-        f"lrl: {lrl:.4f}",
-        f"rec: {rec:.4f}",
-        f"prec: {prec:.4f}",
-        f"spec: {spec: 4f}",
-        f"cov_err: {cov_error:.4f}",
-        f"auroc: {auroc:.4f}",
-        f"ap: {ap:.4f} / {ap_chance_level:.4f} (chance)",
-        f"fill_rate_pred: {fill_rate_pred:.4f} / {fill_rate:.4f} (true)",
+        f"acc: {metrics.acc:.4f}",
+        f"jaccard_index: {metrics.jaccard_index:.4f} / "
+        f"{chance.jaccard_index:.4f} (chance)",
+        f"lrap: {metrics.lrap:.4f} / {chance.lrap:.4f} (chance)",
+        f"f1: {metrics.f1:.4f}",
+        f"lrl: {metrics.lrl:.4f}",
+        f"rec: {metrics.rec:.4f}",
+        f"prec: {metrics.prec:.4f}",
+        f"spec: {metrics.spec: 4f}",
+        f"cov_err: {metrics.cov_err:.4f}",
+        f"auroc: {metrics.auroc:.4f}",
+        f"ap: {metrics.ap:.4f} / {chance.ap:.4f} (chance)",
+        f"fill_rate_pred: {metrics.fill_rate_preds:.4f} / {fill_rate:.4f} (true)",
         sep="\n",
         end="\n\n",
     )
 
+    return {
+        **metrics.as_dict(),
+        "y_pred": y_pred,
+        "y": y_true,
+        "y_prob": y_prob,
+        "mlm": metrics.mlm,
+    }
+
 
 def tokenize_text(instance, tokenizer):
     return tokenizer(instance["text"], truncation=True)
@@ -112,8 +92,15 @@ def get_scores(results: dict, mlb: MultiLabelBinarizer) -> Generator:
         yield scores
 
 
-def main():
+def main(from_store: bool = False):
     df = load_data(LABELLED_CSV, ARTICLES_DIR, use_original_text=True)
+    store = ResultsStore(RESULTS_DIR)
+    config = {"model_path": MODEL_PATH, "corpus": fingerprint(df["Text"], {})}
+    if from_store:
+        res = store.load_fold(MODEL_NAME, config, 0)
+        evaluate(res["y"], res["y_prob"])
+        return
+
     classes = [x.replace("-", " ") for x in df.columns[2:-1].to_list()]
     dataset = Dataset.from_dict(
         get_dict(df),
@@ -128,7 +115,7 @@ def main():
     )
     classifier = pipeline(
         "zero-shot-classification",
-        model="facebook/bart-large-mnli",
+        model=MODEL_PATH,
         dtype=torch.bfloat16,
         device=DEVICE,
         fp16=True,
@@ -146,9 +133,15 @@ def main():
 
     mlb.fit(sample_labels)
     y_scores = np.array(list(get_scores(results, mlb)))
-    y_true = np.array(dataset["binary_targets"])
-    evaluate(y_true, y_scores)
+    y_true = LabelMatrix.from_dataframe(df, df.columns[2:-1]).matrix
+    store.save_fold(MODEL_NAME, config, 0, evaluate(y_true, y_scores))
 
 
 if __name__ == "__main__":
-    main()
+    args = argparse.ArgumentParser()
+    args.add_argument(
+        "--from-store",
+        action="store_true",
+        help="Evaluate the stored zero-shot scores without running the model",
+    )
+    main(**vars(args.parse_args()))
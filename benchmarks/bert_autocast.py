@@ -0,0 +1,185 @@
+"""Benchmark full precision and bfloat16 autocast training of the BERT training loop.
+
+Both precisions train the same initial, randomly initialised small DistilBERT
+classifier on the same synthetic multi-label token data with
+:func:`bert_training.train_model`, and evaluate it with
+:func:`bert_training.test_model`. The epoch times are compared and the training
+losses and validation metrics of the two runs are checked for parity. No pretrained
+weights are downloaded. Run from the repository root with
+``python -m benchmarks.bert_autocast``.
+"""
+
+import argparse
+import contextlib
+import io
+import time
+import warnings
+
+import numpy as np
+import torch
+from torch import nn, optim
+from torch.utils.data import DataLoader, Dataset
+from transformers import AutoModel, DistilBertConfig
+
+from bert_training import DEVICE, test_model, train_model
+
+VOCAB_SIZE = 2000
+MAX_LENGTH = 128
+N_OUTPUTS = 8
+BATCH_SIZE = 8
+LR = 1e-4
+
+
+class TokenDataset(Dataset):
+    """Token ids whose labels depend on the presence of a few topic tokens, in the
+    ``(inputs, labels)`` format of :class:`dataset.textdataset.ArticleDataset`.
+
+    :param n_samples: Number of samples.
+    :type n_samples: int
+    :param generator: Random number generator of the tokens and topics.
+    :type generator: torch.Generator
+    """
+
+    def __init__(self, n_samples: int, generator: torch.Generator) -> None:
+        self.input_ids = torch.randint(
+            VOCAB_SIZE, (n_samples, MAX_LENGTH), generator=generator
+        )
+        # Every label is set by the occurrence of any of its topic tokens
+        topics = torch.randint(VOCAB_SIZE, (N_OUTPUTS, 20), generator=generator)
+        self.labels = torch.stack(
+            [torch.isin(self.input_ids, topic).any(dim=1) for topic in topics], dim=1
+        ).float()
+
+    def __len__(self) -> int:
+        return len(self.input_ids)
+
+    def __getitem__(self, idx: int) -> tuple[dict[str, torch.Tensor], torch.Tensor]:
+        inputs = {
+            "input_ids": self.input_ids[idx],
+            "attention_mask": torch.ones(MAX_LENGTH, dtype=torch.long),
+        }
+        return inputs, self.labels[idx]
+
+
+class SmallBertClassifier(nn.Module):
+    """Linear classifier on the flattened hidden states of a small DistilBERT, like
+    :class:`models.bert_classifier.BertWithLinearClassifier` without the download.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        config = DistilBertConfig(
+            vocab_size=VOCAB_SIZE,
+            max_position_embeddings=MAX_LENGTH,
+            n_layers=2,
+            n_heads=4,
+            dim=128,
+            hidden_dim=512,
+        )
+        self.bert = AutoModel.from_config(config)
+        self.net = nn.Sequential(
+            nn.Linear(MAX_LENGTH * config.dim, 64), nn.ReLU(), nn.Linear(64, N_OUTPUTS)
+        )
+
+    def forward(self, inputs):
+        last_hidden_state = self.bert(**inputs).last_hidden_state
+        return self.net(torch.flatten(last_hidden_state, 1))
+
+
+def train(
+    autocast_dtype: torch.dtype | None, num_epochs: int, n_samples: int, seed: int
+) -> dict[str, float | list[float]]:
+    """Train the classifier with the BERT training loop and evaluate it in full
+    precision.
+
+    :param autocast_dtype: Data type of the mixed precision training steps, None for
+        full precision.
+    :type autocast_dtype: torch.dtype | None
+    :param num_epochs: Number of training epochs.
+    :type num_epochs: int
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param seed: Seed of the model and data.
+    :type seed: int
+    :return: Time per epoch, training loss of every epoch, validation loss, F1 and
+        ROC AUC.
+    :rtype: dict[str, float | list[float]]
+    """
+    generator = torch.Generator().manual_seed(seed)
+    train_loader = DataLoader(
+        TokenDataset(n_samples, generator),
+        batch_size=BATCH_SIZE,
+        shuffle=True,
+        generator=generator,
+    )
+    valid_loader = DataLoader(
+        TokenDataset(n_samples, generator), batch_size=BATCH_SIZE * 2
+    )
+    torch.manual_seed(seed)
+    model = SmallBertClassifier().to(DEVICE)
+    criterion = nn.BCEWithLogitsLoss()
+    optimizer = optim.Adam(model.parameters(), lr=LR)
+    scheduler = optim.lr_scheduler.ReduceLROnPlateau(optimizer)
+    # Silence the progress bars
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(
+        io.StringIO()
+    ):
+        start = time.perf_counter()
+        train_losses = train_model(
+            model,
+            train_loader,
+            valid_loader,
+            criterion,
+            optimizer,
+            scheduler,
+            num_epochs,
+            autocast_dtype,
+        )
+        epoch_s = (time.perf_counter() - start) / num_epochs
+        res = test_model(model, valid_loader, criterion=criterion)
+    return {
+        "epoch_s": epoch_s,
+        "train_loss": train_losses,
+        "valid_loss": res["val_loss"],
+        "f1": res["f1"],
+        "auroc": res["auroc"],
+    }
+
+
+def main(num_epochs: int, n_samples: int, tol: float, seed: int):
+    """Compare the speed, the losses and the validation metrics of both precisions.
+
+    :param num_epochs: Number of training epochs.
+    :type num_epochs: int
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param tol: Largest accepted absolute difference of the losses and metrics.
+    :type tol: float
+    :param seed: Seed of the model and data.
+    :type seed: int
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        fp32 = train(None, num_epochs, n_samples, seed)
+        bf16 = train(torch.bfloat16, num_epochs, n_samples, seed)
+    print(
+        f"DistilBERT ({DEVICE}): fp32 {fp32['epoch_s']:.2f} s/epoch, "
+        f"bf16 {bf16['epoch_s']:.2f} s/epoch "
+        f"({fp32['epoch_s'] / bf16['epoch_s']:.2f}x)"
+    )
+    for key in ["train_loss", "valid_loss", "f1", "auroc"]:
+        diff = np.max(np.abs(np.subtract(fp32[key], bf16[key])))
+        status = "ok" if diff <= tol else "FAIL"
+        print(
+            f"{key:>12}: fp32 {np.ravel(fp32[key])[-1]:.4f}, "
+            f"bf16 {np.ravel(bf16[key])[-1]:.4f} (max abs diff {diff:.2e}) {status}"
+        )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--num-epochs", type=int, default=3)
+    args.add_argument("--n-samples", type=int, default=256)
+    args.add_argument("--tol", type=float, default=0.02)
+    args.add_argument("--seed", type=int, default=0)
+    main(**vars(args.parse_args()))
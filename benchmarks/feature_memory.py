@@ -0,0 +1,153 @@
+"""Benchmark the peak memory of the float64 and float32 tf-idf feature paths.
+
+Each path runs in a fresh process, so that its peak resident set size is not hidden
+by the other one. Run from the repository root with
+``python -m benchmarks.feature_memory``.
+"""
+
+import argparse
+import math
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy
+import torch
+
+from dataset.counts import TermCounts
+from dataset.transformers_dataset import load_data
+
+NUM_HEADS = 12
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of the current process.
+
+    On Linux ``ru_maxrss`` is inherited across ``exec`` and would report the peak of
+    the parent in a fresh worker, so the high-water mark in ``/proc`` is preferred.
+
+    :return: Peak RSS in MiB.
+    :rtype: float
+    """
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return max_rss / 2**20 if sys.platform == "darwin" else max_rss / 1024
+
+
+def float64_item(X: scipy.sparse.csr_matrix, idx: int, n_cols: int) -> torch.Tensor:
+    """Convert a row the way ``TfIdfDataset`` did before the float32 path.
+
+    :param X: float64 feature matrix.
+    :type X: scipy.sparse.csr_matrix
+    :param idx: Row index.
+    :type idx: int
+    :param n_cols: Padded number of columns.
+    :type n_cols: int
+    :return: Dense row of shape (1, n_cols).
+    :rtype: torch.Tensor
+    """
+    coo = X[idx].tocoo()
+    indices = np.vstack((coo.row, coo.col + n_cols - coo.shape[1]))
+    i = torch.LongTensor(indices)
+    v = torch.FloatTensor(coo.data)
+    return torch.sparse_coo_tensor(i, v, torch.Size([1, n_cols])).to_dense().float()
+
+
+def float32_item(X: scipy.sparse.csr_matrix, idx: int, n_cols: int) -> torch.Tensor:
+    """Convert a row the way ``TfIdfDataset`` does now.
+
+    :param X: float32 feature matrix.
+    :type X: scipy.sparse.csr_matrix
+    :param idx: Row index.
+    :type idx: int
+    :param n_cols: Padded number of columns.
+    :type n_cols: int
+    :return: Dense row of shape (1, n_cols).
+    :rtype: torch.Tensor
+    """
+    x = X[idx]
+    inputs = torch.zeros((1, n_cols))
+    inputs[0, torch.from_numpy(x.indices) + n_cols - x.shape[1]] = torch.from_numpy(
+        x.data
+    )
+    return inputs
+
+
+def measure(counts_pth: str, dtype: str) -> dict[str, float]:
+    """Build the features and load every row once in a worker process.
+
+    :param counts_pth: Path to the saved term counts.
+    :type counts_pth: str
+    :param dtype: "float64" for the previous path, "float32" for the current one.
+    :type dtype: str
+    :return: Feature size, peak RSS before and after, and the loading time.
+    :rtype: dict[str, float]
+    """
+    counts = TermCounts.load(counts_pth)
+    rss_before = peak_rss_mb()
+    if dtype == "float64":
+        counts.counts = counts.counts.astype(np.int64)
+        columns, transformer = counts.fit_tfidf(
+            stop_words="english", max_features=10000
+        )
+        X = transformer.transform(counts.counts[:, columns].astype(np.float64))
+        to_tensor = float64_item
+    else:
+        X, _ = counts.tfidf(stop_words="english", max_features=10000)
+        to_tensor = float32_item
+    n_cols = math.ceil(X.shape[1] / NUM_HEADS) * NUM_HEADS
+
+    start = time.perf_counter()
+    for idx in range(X.shape[0]):
+        to_tensor(X, idx, n_cols)
+    return {
+        "feature_mb": (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 2**20,
+        "rss_before_mb": rss_before,
+        "rss_peak_mb": peak_rss_mb(),
+        "epoch_s": time.perf_counter() - start,
+    }
+
+
+def main(labelled_csv: str, articles_dir: str):
+    """Compare the memory of the float64 and float32 feature paths.
+
+    :param labelled_csv: Path to the labelled CSV file.
+    :type labelled_csv: str
+    :param articles_dir: Directory containing the articles.
+    :type articles_dir: str
+    """
+    df = load_data(labelled_csv, articles_dir, False)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        counts_pth = os.path.join(tmp_dir, "counts.npz")
+        TermCounts.from_texts(df["Text"]).save(counts_pth)
+
+        baseline = None
+        for dtype in ["float64", "float32"]:
+            with ProcessPoolExecutor(
+                1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                res = executor.submit(measure, counts_pth, dtype).result()
+            growth = res["rss_peak_mb"] - res["rss_before_mb"]
+            baseline = baseline or res
+            print(
+                f"{dtype}: features {res['feature_mb']:8.2f} MiB "
+                f"({res['feature_mb'] / baseline['feature_mb']:.2f}x), "
+                f"peak RSS {res['rss_peak_mb']:8.1f} MiB (+{growth:.1f} MiB), "
+                f"per-item epoch {res['epoch_s']:.3f} s"
+            )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--labelled-csv", default="multi_label_dataset.csv")
+    args.add_argument("--articles-dir", default="articles")
+    main(**vars(args.parse_args()))
@@ -0,0 +1,160 @@
+"""Benchmark full precision and bfloat16 autocast training of the tf-idf models on
+CPU.
+
+Both precisions train the same initial model on the same synthetic multi-label data
+with the :class:`Learner`. The epoch times are compared and the validation loss and
+metrics of the two runs are checked for parity. Run from the repository root with
+``python -m benchmarks.learner_autocast``.
+"""
+
+import argparse
+import contextlib
+import io
+import time
+import warnings
+from typing import Callable
+
+import torch
+from torch import nn, optim
+from torch.utils.data import DataLoader, TensorDataset
+
+from metrics.multilabel import multilabel_metrics
+from models.learner import Learner
+from models.tfidf_attention import TfIdfAttention, TfIdfDense
+
+N_INPUTS = 1200
+N_OUTPUTS = 8
+BATCH_SIZE = 32
+THRESHOLD = 0.5
+LR = 3e-3
+
+
+def model_cases() -> dict[str, Callable]:
+    """Model factories with the layer sizes of the tf-idf training script.
+
+    :return: Model factory per model name.
+    :rtype: dict[str, Callable]
+    """
+    return {
+        "TfIdfDense": lambda: TfIdfDense(N_INPUTS, N_OUTPUTS, [32, 64, 32], 0.2),
+        "TfIdfAttention": lambda: TfIdfAttention(
+            N_INPUTS, N_OUTPUTS, 100, [32, 64, 32], 12, 0.2
+        ),
+    }
+
+
+def make_loaders(n_samples: int, seed: int) -> tuple[DataLoader, DataLoader]:
+    """Sparse non-negative features with labels from a sparse random projection.
+
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param seed: Seed of the data.
+    :type seed: int
+    :return: Training and validation loaders.
+    :rtype: tuple[DataLoader, DataLoader]
+    """
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.rand(2 * n_samples, N_INPUTS, generator=generator)
+    x = x * (torch.rand(x.shape, generator=generator) < 0.3)
+    # Every label depends on a few dozen features, like topic words
+    projection = torch.randn(N_INPUTS, N_OUTPUTS, generator=generator)
+    projection = projection * (torch.rand(projection.shape, generator=generator) < 0.02)
+    scores = x @ projection
+    y = (scores > scores.quantile(0.7, dim=0)).float()
+    train_ds = TensorDataset(x[:n_samples], y[:n_samples])
+    valid_ds = TensorDataset(x[n_samples:], y[n_samples:])
+    return (
+        DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=True, generator=generator),
+        DataLoader(valid_ds, batch_size=BATCH_SIZE),
+    )
+
+
+def train(
+    make_model: Callable,
+    autocast_dtype: torch.dtype | None,
+    num_epochs: int,
+    n_samples: int,
+    seed: int,
+) -> dict[str, float]:
+    """Train a model with the Learner and evaluate it in full precision.
+
+    :param make_model: Model factory.
+    :type make_model: Callable
+    :param autocast_dtype: Data type of the mixed precision training steps, None for
+        full precision.
+    :type autocast_dtype: torch.dtype | None
+    :param num_epochs: Number of training epochs.
+    :type num_epochs: int
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param seed: Seed of the model and data.
+    :type seed: int
+    :return: Time per epoch, validation loss, F1 and ROC AUC.
+    :rtype: dict[str, float]
+    """
+    train_loader, valid_loader = make_loaders(n_samples, seed)
+    torch.manual_seed(seed)
+    model = make_model()
+    optimizer = optim.AdamW(model.parameters(), lr=LR)
+    learner = Learner(
+        model,
+        nn.BCEWithLogitsLoss(),
+        torch.device("cpu"),
+        optimizer=optimizer,
+        autocast_dtype=autocast_dtype,
+    )
+    # Silence the progress bars
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        learner.fit(train_loader, valid_loader, num_epochs, lr=LR)
+        epoch_s = (time.perf_counter() - start) / num_epochs
+        valid_loss, outputs, labels = learner.evaluate(valid_loader)
+
+    y_prob = torch.sigmoid(torch.from_numpy(outputs)).numpy()
+    metrics = multilabel_metrics(labels, y_prob, y_prob > THRESHOLD)
+    return {
+        "epoch_s": epoch_s,
+        "valid_loss": float(valid_loss),
+        "f1": metrics.f1,
+        "auroc": metrics.auroc,
+    }
+
+
+def main(num_epochs: int, n_samples: int, tol: float, seed: int):
+    """Compare the speed and the validation metrics of both precisions.
+
+    :param num_epochs: Number of training epochs.
+    :type num_epochs: int
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param tol: Largest accepted absolute difference of the validation metrics.
+    :type tol: float
+    :param seed: Seed of the models and data.
+    :type seed: int
+    """
+    for name, make_model in model_cases().items():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            fp32 = train(make_model, None, num_epochs, n_samples, seed)
+            bf16 = train(make_model, torch.bfloat16, num_epochs, n_samples, seed)
+        print(
+            f"{name}: fp32 {fp32['epoch_s']:.2f} s/epoch, "
+            f"bf16 {bf16['epoch_s']:.2f} s/epoch "
+            f"({fp32['epoch_s'] / bf16['epoch_s']:.2f}x)"
+        )
+        for key in ["valid_loss", "f1", "auroc"]:
+            diff = abs(fp32[key] - bf16[key])
+            status = "ok" if diff <= tol else "FAIL"
+            print(
+                f"{key:>12}: fp32 {fp32[key]:.4f}, bf16 {bf16[key]:.4f} "
+                f"(abs diff {diff:.2e}) {status}"
+            )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--num-epochs", type=int, default=10)
+    args.add_argument("--n-samples", type=int, default=2000)
+    args.add_argument("--tol", type=float, default=0.02)
+    args.add_argument("--seed", type=int, default=0)
+    main(**vars(args.parse_args()))
@@ -0,0 +1,160 @@
+"""Benchmark eager and ``torch.compile`` execution of the small models on CPU.
+
+For every model the first training step, which includes the compilation, is timed
+separately from the steady-state training and inference steps. Run from the
+repository root with ``python -m benchmarks.learner_compile``.
+"""
+
+import argparse
+import time
+import warnings
+from typing import Callable
+
+import torch
+from torch import nn, optim
+
+from models.genreclassifier import AttentionGenreClassifier
+from models.learner import CompiledModule
+from models.tfidf_attention import TfIdfAttention, TfIdfDense
+
+N_INPUTS = 1200
+N_OUTPUTS = 8
+BATCH_SIZE = 32
+
+
+def model_cases() -> dict[str, tuple[Callable, torch.Tensor, torch.Tensor, nn.Module]]:
+    """Models with an input batch, a target and a loss like in their training
+    scripts.
+
+    :return: Model factory, inputs, targets and criterion per model name.
+    :rtype: dict[str, tuple[Callable, torch.Tensor, torch.Tensor, nn.Module]]
+    """
+    tfidf_inputs = torch.rand(BATCH_SIZE, N_INPUTS)
+    tfidf_targets = (torch.rand(BATCH_SIZE, N_OUTPUTS) < 0.3).float()
+    return {
+        "TfIdfDense": (
+            lambda: TfIdfDense(N_INPUTS, N_OUTPUTS, [32, 64, 32], 0.2),
+            tfidf_inputs,
+            tfidf_targets,
+            nn.BCEWithLogitsLoss(),
+        ),
+        "TfIdfAttention": (
+            lambda: TfIdfAttention(N_INPUTS, N_OUTPUTS, 100, [32, 64, 32], 12, 0.2),
+            tfidf_inputs,
+            tfidf_targets,
+            nn.BCEWithLogitsLoss(),
+        ),
+        # The genre classifier flattens its batch and classifies one embedding
+        "AttentionGenreClassifier": (
+            lambda: AttentionGenreClassifier(768, 10, [64, 128, 256], 3, 0.2, True),
+            torch.randn(1, 1, 768),
+            torch.tensor(3),
+            nn.CrossEntropyLoss(),
+        ),
+    }
+
+
+def time_steps(step: Callable, num_steps: int) -> float:
+    """Mean wall-clock time of a step.
+
+    :param step: Function without arguments.
+    :type step: Callable
+    :param num_steps: Number of timed calls.
+    :type num_steps: int
+    :return: Mean time per call in seconds.
+    :rtype: float
+    """
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        step()
+    return (time.perf_counter() - start) / num_steps
+
+
+def measure(
+    make_model: Callable,
+    inputs: torch.Tensor,
+    targets: torch.Tensor,
+    criterion: nn.Module,
+    compile_model: bool,
+    num_steps: int,
+) -> dict[str, float | bool]:
+    """Time the first, training and inference steps of a model.
+
+    :param make_model: Model factory.
+    :type make_model: Callable
+    :param inputs: Input batch.
+    :type inputs: torch.Tensor
+    :param targets: Targets of the batch.
+    :type targets: torch.Tensor
+    :param criterion: Loss function.
+    :type criterion: nn.Module
+    :param compile_model: Run the model through ``torch.compile``.
+    :type compile_model: bool
+    :param num_steps: Number of timed steady-state steps.
+    :type num_steps: int
+    :return: First step, training step and inference step times, and whether the
+        model ran compiled.
+    :rtype: dict[str, float | bool]
+    """
+    torch.manual_seed(0)
+    model = make_model()
+    forward_model = CompiledModule(model) if compile_model else model
+    optimizer = optim.AdamW(model.parameters(), lr=1e-3)
+
+    def train_step():
+        optimizer.zero_grad()
+        loss = criterion(forward_model(inputs), targets)
+        loss.backward()
+        optimizer.step()
+
+    def inference_step():
+        with torch.inference_mode():
+            forward_model(inputs)
+
+    forward_model.train()
+    first_s = time_steps(train_step, 1)
+    train_step()
+    train_s = time_steps(train_step, num_steps)
+    forward_model.eval()
+    inference_step()
+    inference_s = time_steps(inference_step, num_steps)
+    return {
+        "first_s": first_s,
+        "train_s": train_s,
+        "inference_s": inference_s,
+        "compiled": compile_model and forward_model.compiled is not None,
+    }
+
+
+def main(num_steps: int, num_threads: int | None):
+    """Compare the compile time with the steady-state step times of every model.
+
+    :param num_steps: Number of timed steady-state steps.
+    :type num_steps: int
+    :param num_threads: Number of intra-op CPU threads, defaults to torch's choice.
+    :type num_threads: int | None
+    """
+    if num_threads is not None:
+        torch.set_num_threads(num_threads)
+    for name, case in model_cases().items():
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            eager = measure(*case, compile_model=False, num_steps=num_steps)
+            compiled = measure(*case, compile_model=True, num_steps=num_steps)
+        mode = "compiled" if compiled["compiled"] else "eager fallback"
+        print(
+            f"{name}: eager train {eager['train_s'] * 1e3:.2f} ms, "
+            f"inference {eager['inference_s'] * 1e3:.2f} ms | {mode}: "
+            f"first step {compiled['first_s']:.2f} s, "
+            f"train {compiled['train_s'] * 1e3:.2f} ms "
+            f"({eager['train_s'] / compiled['train_s']:.2f}x), "
+            f"inference {compiled['inference_s'] * 1e3:.2f} ms "
+            f"({eager['inference_s'] / compiled['inference_s']:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--num-steps", type=int, default=200)
+    args.add_argument("--num-threads", type=int, default=None)
+    main(**vars(args.parse_args()))
@@ -0,0 +1,153 @@
+"""Check data-parallel training of the tf-idf dense model against a single process.
+
+The same initial model is trained on the same synthetic multi-label data, once in
+this process with a batch size of ``world_size * BATCH_SIZE`` and once with
+:func:`models.distributed.launch` over ``world_size`` processes with a batch size
+of ``BATCH_SIZE`` each. Without shuffling, the ``DistributedSampler`` deals every
+batch of the single process out to the ranks, so both runs take the same optimizer
+steps and their losses and metrics must match up to the order of the floating
+point sums. Run from the repository root with
+``python -m benchmarks.learner_distributed``.
+"""
+
+import argparse
+import contextlib
+import io
+import time
+import warnings
+
+import numpy as np
+import torch
+from torch import nn, optim
+from torch.utils.data import DataLoader, TensorDataset
+
+from metrics.multilabel import multilabel_metrics
+from models.distributed import launch
+from models.learner import Learner
+from models.tfidf_attention import TfIdfDense
+
+N_INPUTS = 1200
+N_OUTPUTS = 8
+BATCH_SIZE = 32
+THRESHOLD = 0.5
+LR = 3e-3
+
+
+def make_loaders(
+    n_samples: int, batch_size: int, seed: int
+) -> tuple[DataLoader, DataLoader]:
+    """Sparse non-negative features with labels from a sparse random projection.
+
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param batch_size: Training batch size.
+    :type batch_size: int
+    :param seed: Seed of the data.
+    :type seed: int
+    :return: Training and validation loaders, neither of them shuffled.
+    :rtype: tuple[DataLoader, DataLoader]
+    """
+    generator = torch.Generator().manual_seed(seed)
+    x = torch.rand(2 * n_samples, N_INPUTS, generator=generator)
+    x = x * (torch.rand(x.shape, generator=generator) < 0.3)
+    # Every label depends on a few dozen features, like topic words
+    projection = torch.randn(N_INPUTS, N_OUTPUTS, generator=generator)
+    projection = projection * (torch.rand(projection.shape, generator=generator) < 0.02)
+    scores = x @ projection
+    y = (scores > scores.quantile(0.7, dim=0)).float()
+    train_ds = TensorDataset(x[:n_samples], y[:n_samples])
+    valid_ds = TensorDataset(x[n_samples:], y[n_samples:])
+    return (
+        DataLoader(train_ds, batch_size=batch_size),
+        DataLoader(valid_ds, batch_size=BATCH_SIZE),
+    )
+
+
+def train(
+    batch_size: int, num_epochs: int, n_samples: int, seed: int
+) -> dict[str, float | list[float]]:
+    """Train the dense model with the Learner and evaluate it.
+
+    In a worker of :func:`launch`, the Learner trains on the shard of this process.
+    Dropout is disabled, as the ranks would draw different masks.
+
+    :param batch_size: Training batch size of this process.
+    :type batch_size: int
+    :param num_epochs: Number of training epochs.
+    :type num_epochs: int
+    :param n_samples: Number of training and of validation samples.
+    :type n_samples: int
+    :param seed: Seed of the model and data.
+    :type seed: int
+    :return: Time per epoch, training loss of every epoch, validation loss, F1 and
+        ROC AUC.
+    :rtype: dict[str, float | list[float]]
+    """
+    train_loader, valid_loader = make_loaders(n_samples, batch_size, seed)
+    torch.manual_seed(seed)
+    model = TfIdfDense(N_INPUTS, N_OUTPUTS, [32, 64, 32], 0.0)
+    optimizer = optim.AdamW(model.parameters(), lr=LR)
+    learner = Learner(
+        model, nn.BCEWithLogitsLoss(), torch.device("cpu"), optimizer=optimizer
+    )
+    # Silence the progress bars
+    with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        start = time.perf_counter()
+        learner.fit(train_loader, valid_loader, num_epochs, lr=LR)
+        epoch_s = (time.perf_counter() - start) / num_epochs
+        valid_loss, outputs, labels = learner.evaluate(valid_loader)
+        y_prob = torch.sigmoid(torch.from_numpy(outputs)).numpy()
+        metrics = multilabel_metrics(labels, y_prob, y_prob > THRESHOLD)
+    return {
+        "epoch_s": epoch_s,
+        "train_loss": [
+            float(loss) for loss in learner.state_dict["metrics"]["train_loss"]
+        ],
+        "valid_loss": float(valid_loss),
+        "f1": metrics.f1,
+        "auroc": metrics.auroc,
+    }
+
+
+def main(world_size: int, num_epochs: int, n_samples: int, tol: float, seed: int):
+    """Compare the losses and validation metrics of both runs.
+
+    :param world_size: Number of processes of the data-parallel run.
+    :type world_size: int
+    :param num_epochs: Number of training epochs.
+    :type num_epochs: int
+    :param n_samples: Number of training and of validation samples, a multiple of
+        the world size so that the shards are not padded.
+    :type n_samples: int
+    :param tol: Largest accepted absolute difference of the losses and metrics.
+    :type tol: float
+    :param seed: Seed of the model and data.
+    :type seed: int
+    """
+    if n_samples % world_size:
+        raise ValueError("n_samples must be a multiple of world_size")
+    single = train(world_size * BATCH_SIZE, num_epochs, n_samples, seed)
+    parallel = launch(train, world_size, BATCH_SIZE, num_epochs, n_samples, seed)
+    print(
+        f"TfIdfDense: 1 process {single['epoch_s']:.2f} s/epoch, "
+        f"{world_size} processes {parallel['epoch_s']:.2f} s/epoch"
+    )
+    for key in ["train_loss", "valid_loss", "f1", "auroc"]:
+        diff = np.max(np.abs(np.subtract(single[key], parallel[key])))
+        status = "ok" if diff <= tol else "FAIL"
+        print(
+            f"{key:>12}: 1 process {np.ravel(single[key])[-1]:.4f}, "
+            f"{world_size} processes {np.ravel(parallel[key])[-1]:.4f} "
+            f"(max abs diff {diff:.2e}) {status}"
+        )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--world-size", type=int, default=2)
+    args.add_argument("--num-epochs", type=int, default=5)
+    args.add_argument("--n-samples", type=int, default=2000)
+    args.add_argument("--tol", type=float, default=1e-4)
+    args.add_argument("--seed", type=int, default=0)
+    main(**vars(args.parse_args()))
@@ -0,0 +1,123 @@
+"""Benchmark the single-pass multi-label metrics against the sklearn metrics.
+
+Both paths are run on random scores and labels, the metrics are checked for
+equality and the time per evaluation is reported. Run from the repository root with
+``python -m benchmarks.multilabel_metrics``.
+"""
+
+import argparse
+import time
+import warnings
+
+import numpy as np
+from sklearn.metrics import (
+    accuracy_score,
+    average_precision_score,
+    coverage_error,
+    f1_score,
+    label_ranking_average_precision_score,
+    label_ranking_loss,
+    multilabel_confusion_matrix,
+    precision_score,
+    recall_score,
+    roc_auc_score,
+)
+
+from metrics.auc import godbole_accuracy
+from metrics.multilabel import multilabel_metrics
+
+
+def sklearn_metrics(y_true: np.ndarray, y_prob: np.ndarray, y_pred: np.ndarray):
+    """Compute the metrics with one sklearn call each, as the evaluation loops did.
+
+    :param y_true: Binary labels.
+    :type y_true: np.ndarray
+    :param y_prob: Predicted scores.
+    :type y_prob: np.ndarray
+    :param y_pred: Binary predictions.
+    :type y_pred: np.ndarray
+    :return: Scalar metrics and the multilabel confusion matrix.
+    :rtype: tuple[dict[str, float], np.ndarray]
+    """
+    metrics = {
+        "acc": accuracy_score(y_true, y_pred),
+        "jaccard_index": godbole_accuracy(y_true, y_pred, "macro"),
+        "f1": f1_score(y_true, y_pred, average="micro"),
+        "rec": recall_score(y_true, y_pred, average="micro"),
+        "prec": precision_score(y_true, y_pred, average="micro"),
+        "spec": recall_score(1 - y_true, 1 - y_pred, average="micro"),
+        "lrap": label_ranking_average_precision_score(y_true, y_prob),
+        "lrl": label_ranking_loss(y_true, y_prob),
+        "cov_err": coverage_error(y_true, y_prob),
+        "auroc": roc_auc_score(y_true, y_prob, average="micro"),
+        "ap": average_precision_score(y_true, y_prob, average="micro"),
+        "fill_rate_preds": np.sum(y_pred) / y_pred.size,
+    }
+    return metrics, multilabel_confusion_matrix(y_true, y_pred)
+
+
+def best_time(fn, repeats: int) -> float:
+    """Best wall-clock time of a function over a few runs.
+
+    :param fn: Function without arguments.
+    :type fn: Callable
+    :param repeats: Number of runs.
+    :type repeats: int
+    :return: Shortest run time in seconds.
+    :rtype: float
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main(n_samples: int, n_labels: int, repeats: int, seed: int):
+    """Check that both paths agree and compare their speed.
+
+    :param n_samples: Number of evaluated samples.
+    :type n_samples: int
+    :param n_labels: Number of labels.
+    :type n_labels: int
+    :param repeats: Number of timed runs per path.
+    :type repeats: int
+    :param seed: Seed of the random outputs.
+    :type seed: int
+    """
+    rng = np.random.default_rng(seed)
+    y_true = (rng.random((n_samples, n_labels)) < 0.2).astype(int)
+    # Rounded scores to exercise ties, with some rows without labels
+    y_prob = np.round(rng.random((n_samples, n_labels)) * 0.5 + 0.4 * y_true, 2)
+    y_pred = (y_prob > 0.5).astype(int)
+    y_true[::20] = 0
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        expected, expected_mlm = sklearn_metrics(y_true, y_prob, y_pred)
+        result = multilabel_metrics(y_true, y_prob, y_pred)
+        sklearn_s = best_time(lambda: sklearn_metrics(y_true, y_prob, y_pred), repeats)
+        single_s = best_time(
+            lambda: multilabel_metrics(y_true, y_prob, y_pred), repeats
+        )
+
+    for name, value in result.as_dict().items():
+        diff = abs(value - expected[name])
+        status = "ok" if np.isclose(value, expected[name], equal_nan=True) else "FAIL"
+        print(f"{name:>16}: {value:.6f} (abs diff {diff:.2e}) {status}")
+    mlm_status = "ok" if np.array_equal(result.mlm, expected_mlm) else "FAIL"
+    print(f"{'mlm':>16}: {mlm_status}")
+    print(
+        f"sklearn {sklearn_s * 1e3:.1f} ms, single pass {single_s * 1e3:.1f} ms "
+        f"({sklearn_s / single_s:.1f}x)"
+    )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--n-samples", type=int, default=2000)
+    args.add_argument("--n-labels", type=int, default=8)
+    args.add_argument("--repeats", type=int, default=5)
+    args.add_argument("--seed", type=int, default=42)
+    main(**vars(args.parse_args()))
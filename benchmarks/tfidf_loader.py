@@ -0,0 +1,77 @@
+"""Benchmark the per-item and batched TfIdfDataset loading paths.
+
+Run from the repository root with ``python -m benchmarks.tfidf_loader``.
+"""
+
+import argparse
+import math
+import time
+
+import numpy as np
+from torch.utils.data import DataLoader, Subset
+
+from dataset.tfidf import TfIdfDataset, batch_loader
+
+NUM_HEADS = 12
+
+
+def samples_per_second(loader: DataLoader, epochs: int) -> float:
+    """Iterate over a loader and measure its throughput.
+
+    :param loader: Data loader to iterate over.
+    :type loader: DataLoader
+    :param epochs: Number of passes over the loader.
+    :type epochs: int
+    :return: Number of samples loaded per second.
+    :rtype: float
+    """
+    num_samples = 0
+    start = time.perf_counter()
+    for _ in range(epochs):
+        for inputs, _ in loader:
+            num_samples += inputs.shape[0]
+    return num_samples / (time.perf_counter() - start)
+
+
+def main(labelled_csv: str, articles_dir: str, batch_size: int, epochs: int):
+    """Compare the loading path of `tf_idf.train_and_eval_pytorch` before and after.
+
+    :param labelled_csv: Path to the labelled CSV file.
+    :type labelled_csv: str
+    :param articles_dir: Directory containing the articles.
+    :type articles_dir: str
+    :param batch_size: Mini-batch size.
+    :type batch_size: int
+    :param epochs: Number of passes over the dataset per loader.
+    :type epochs: int
+    """
+    ds = TfIdfDataset(labelled_csv, articles_dir, False)
+    padded_size = math.ceil(ds.X[0].shape[1] / NUM_HEADS) * NUM_HEADS
+    ds.set_padded_shape((0, padded_size))
+    indices = np.arange(len(ds))
+
+    loaders = {
+        "per-item": DataLoader(
+            Subset(ds, indices), batch_size=batch_size, shuffle=True
+        ),
+        "batched dense": batch_loader(ds, indices, batch_size, shuffle=True),
+        "batched sparse": batch_loader(
+            ds, indices, batch_size, shuffle=True, sparse=True
+        ),
+    }
+    baseline = None
+    for name, loader in loaders.items():
+        throughput = samples_per_second(loader, epochs)
+        baseline = baseline or throughput
+        print(
+            f"{name:>15}: {throughput:10.1f} samples/s ({throughput / baseline:.2f}x)"
+        )
+
+
+if __name__ == "__main__":
+    args = argparse.ArgumentParser()
+    args.add_argument("--labelled-csv", default="multi_label_dataset.csv")
+    args.add_argument("--articles-dir", default="articles")
+    args.add_argument("--batch-size", type=int, default=32)
+    args.add_argument("--epochs", type=int, default=3)
+    main(**vars(args.parse_args()))
@@ -1,6 +1,7 @@
 """This script trains a BERT-based classifier on the multi-label dataset of articles.
 """
 
+import argparse
 import math
 import os
 from contextlib import nullcontext
@@ -9,38 +10,34 @@ import numpy as np
 import seaborn as sns
 import torch
 from iterstrat.ml_stratifiers import MultilabelStratifiedKFold
-from sklearn.metrics import (
-    accuracy_score,
-    average_precision_score,
-    coverage_error,
-    f1_score,
-    label_ranking_average_precision_score,
-    label_ranking_loss,
-    multilabel_confusion_matrix,
-    precision_score,
-    recall_score,
-    roc_auc_score,
-)
 from torch import nn, optim
 from torch.utils.data import DataLoader
 from tqdm.auto import tqdm
 from transformers import AutoTokenizer
 
 from dataset.textdataset import ArticleDataset
-from metrics.auc import godbole_accuracy, k_fold_roc_curve
+from metrics.auc import k_fold_roc_curve
+from metrics.multilabel import multilabel_metrics
+from metrics.results_store import ResultsStore, fold_outputs
+from metrics.threshold import best_threshold
 from models.bert_classifier import BertWithLinearClassifier
 
 DEVICE = "mps" if torch.backends.mps.is_available() else "cpu"  # Use MPS if available
 DEVICE = "cuda" if torch.cuda.is_available() else DEVICE  # Use GPU if available
 BATCH_SIZE = 2  # Batch size for training
+ACCUMULATION_STEPS = 8  # Batches per optimizer step, for an effective batch of 16
 NUM_EPOCHS = 1  # Number of epochs to train
 MAX_LENGTH = 512  # Maximum length of the input sequence
 NUM_FOLDS = 5  # Number of folds for cross-validation
 THRESHOLD = 0.5  # Threshold for binary classification
+# Data type of the mixed precision training steps, bfloat16 runs on CUDA and on CPU,
+# --full-precision trains in float32 instead
+AUTOCAST_DTYPE = torch.bfloat16 if DEVICE != "mps" else None
 TRAIN = False  # Train the model or evaluate it
 # MODEL_PATH = "google-bert/bert-base-uncased"  # BERT model path
 MODEL_PATH = "distilbert/distilbert-base-uncased"  # DistilBERT model path
 MODEL_NAME = MODEL_PATH.rsplit("/", maxsplit=1)[-1]  # Model name
+RESULTS_DIR = "results/bert"  # Store of per-fold predictions and metrics
 
 
 def test_model(
@@ -99,71 +96,39 @@ def test_model(
 
     # Calculate classification metrics
     # Get the best threshold
-    best_thresh = 0
-    max_f1 = 0.0
-    for thresh in sorted(y_prob.flatten()):
-        y_pred = (y_prob > thresh).astype(int)
-        f1 = f1_score(y_true, y_pred, average="samples")
-        if f1 > max_f1:
-            max_f1 = f1
-            best_thresh = thresh
+    best_thresh, _ = best_threshold(y_test, y_prob)
     y_pred = (y_prob > best_thresh).astype(int)
 
     # Calculate metrics
     chance_level = np.mean(y_test)
-    acc = accuracy_score(y_test, y_pred)
-    godbole_acc = godbole_accuracy(y_test, y_pred, "macro")
-    cov_error = coverage_error(y_test, y_prob)
-    f1 = f1_score(y_test, y_pred, average="micro")
-    lrap = label_ranking_average_precision_score(y_test, y_prob)
-    lrl = label_ranking_loss(y_test, y_prob)
-    prec = precision_score(y_test, y_pred, average="micro")
-    rec = recall_score(y_test, y_pred, average="micro")
-    y_test_inv = 1 - y_test
-    y_pred_inv = 1 - y_pred
-    spec = recall_score(y_test_inv, y_pred_inv, average="micro")
-    mlm = multilabel_confusion_matrix(y_test, y_pred)
-    auroc = roc_auc_score(y_test, y_prob, average="micro")
-    ap = average_precision_score(y_test, y_prob, average="micro")
-    fill_rate_pred = np.sum(y_pred) / y_pred.size
+    metrics = multilabel_metrics(y_test, y_prob, y_pred)
     fill_rate = np.sum(y_test) / y_test.size
 
     # Print metrics if verbose
     if verbose:
         print(
-            f"acc: {acc:.4f}",
-            f"jaccard_index: {godbole_acc:.4f} / {chance_level:.4f} (chance)",
-            f"lrap: {lrap:.4f} / {chance_level:.4f} (chance)",
-            f"f1: {f1:.4f}",
-            f"lrl: {lrl:.4f}",
-            f"rec: {rec:.4f}",
-            f"prec: {prec:.4f}",
-            f"spec: {spec: 4f}",
-            f"cov_err: {cov_error:.4f}",
-            f"auroc: {auroc:.4f}",
-            f"ap: {ap:.4f} / {chance_level:.4f} (chance)",
-            f"fill_rate_pred: {fill_rate_pred:.4f} / {fill_rate:.4f} (true)",
+            f"acc: {metrics.acc:.4f}",
+            f"jaccard_index: {metrics.jaccard_index:.4f} / {chance_level:.4f} (chance)",
+            f"lrap: {metrics.lrap:.4f} / {chance_level:.4f} (chance)",
+            f"f1: {metrics.f1:.4f}",
+            f"lrl: {metrics.lrl:.4f}",
+            f"rec: {metrics.rec:.4f}",
+            f"prec: {metrics.prec:.4f}",
+            f"spec: {metrics.spec: 4f}",
+            f"cov_err: {metrics.cov_err:.4f}",
+            f"auroc: {metrics.auroc:.4f}",
+            f"ap: {metrics.ap:.4f} / {chance_level:.4f} (chance)",
+            f"fill_rate_pred: {metrics.fill_rate_preds:.4f} / {fill_rate:.4f} (true)",
             sep="\n",
             end="\n\n",
         )
 
     return {
-        "acc": acc,
-        "jaccard_index": godbole_acc,
-        "rec": rec,
-        "prec": prec,
-        "f1": f1,
-        "spec": spec,
-        "lrap": lrap,
-        "lrl": lrl,
-        "cov_err": cov_error,
-        "auroc": auroc,
-        "ap": ap,
-        "fill_rate_preds": fill_rate_pred,
+        **metrics.as_dict(),
         "y_pred": y_pred,
         "y": y_test,
         "y_prob": y_prob,
-        "mlm": mlm,
+        "mlm": metrics.mlm,
         "val_loss": loss,
     }
 
@@ -176,7 +141,9 @@ def train_model(
     optimizer: optim.Optimizer,
     scheduler: optim.lr_scheduler._LRScheduler = None,
     num_epochs: int = 10,
-) -> None:
+    autocast_dtype: torch.dtype | None = None,
+    accumulation_steps: int = 1,
+) -> list[float]:
     """Trains the given model using the provided data loaders, criterion, optimizer, and scheduler (optional).
 
     :param model: The model to be trained.
@@ -193,27 +160,47 @@ def train_model(
     :type scheduler: optim.lr_scheduler._LRScheduler, optional
     :param num_epochs: Number of epochs to train for, defaults to 10
     :type num_epochs: int, optional
+    :param autocast_dtype: Data type of the mixed precision forward pass, bfloat16
+        needs no GradScaler and also runs on CPU, defaults to full precision
+    :type autocast_dtype: torch.dtype | None, optional
+    :param accumulation_steps: Number of batches whose gradients are averaged for
+        every optimizer step, the last step of an epoch takes the remaining
+        batches, defaults to 1
+    :type accumulation_steps: int, optional
+    :return: Training loss of every epoch.
+    :rtype: list[float]
     """
-    scaler = torch.cuda.amp.GradScaler() if DEVICE == "cuda" else None
+    scaler = (
+        torch.cuda.amp.GradScaler()
+        if DEVICE == "cuda" and autocast_dtype is not None
+        else None
+    )
     iterator = tqdm(range(num_epochs), desc="Epochs", position=0, leave=True)
+    num_batches = len(train_loader)
+    train_losses = []
     for _ in iterator:
         model.train()
-        for inputs, labels in tqdm(
-            train_loader,
-            desc="Train batches",
-            leave=False,
-            position=1,
-            total=int(math.ceil(len(train_loader.dataset) / BATCH_SIZE)),
+        running_loss = 0.0
+        optimizer.zero_grad(set_to_none=True)
+        for i, (inputs, labels) in enumerate(
+            tqdm(
+                train_loader,
+                desc="Train batches",
+                leave=False,
+                position=1,
+                total=int(math.ceil(len(train_loader.dataset) / BATCH_SIZE)),
+            )
         ):
-            running_loss = 0.0
+            # The last step of the epoch can have fewer batches
+            step_start = i - i % accumulation_steps
+            step_size = min(accumulation_steps, num_batches - step_start)
 
             # Mixed Precision
             with (
-                torch.autocast(device_type=DEVICE, dtype=torch.bfloat16)
-                if scaler is not None
+                torch.autocast(device_type=DEVICE, dtype=autocast_dtype)
+                if autocast_dtype is not None
                 else nullcontext()
             ):
-                optimizer.zero_grad()
                 squeeze_dim = 1 if len(inputs["input_ids"].shape) == 3 else 0
                 inputs = {
                     key: value.to(DEVICE).squeeze(squeeze_dim)
@@ -224,17 +211,23 @@ def train_model(
                 outputs = model(inputs)
                 loss = criterion(outputs, labels)
 
+            # The gradient of a step is the mean over its batches
+            step_loss = loss / step_size
             if scaler is not None:
-                scaler.scale(loss).backward()
-                scaler.step(optimizer)
-                scaler.update()
+                scaler.scale(step_loss).backward()
             else:
-                loss.backward()
-                optimizer.step()
-            optimizer.zero_grad(set_to_none=True)
+                step_loss.backward()
+            if i + 1 == step_start + step_size:
+                if scaler is not None:
+                    scaler.step(optimizer)
+                    scaler.update()
+                else:
+                    optimizer.step()
+                optimizer.zero_grad(set_to_none=True)
             running_loss += loss.item() * inputs["input_ids"].size(0)
 
         running_loss /= len(train_loader.dataset)
+        train_losses.append(running_loss)
         metrics = test_model(model, test_loader, criterion=criterion)
         if scheduler is not None:
             scheduler.step(metrics["val_loss"])
@@ -246,16 +239,29 @@ def train_model(
         )
         iterator.write(line)
         iterator.set_postfix_str(f"LR: {scheduler.get_last_lr()[0]:.4e}")
+    return train_losses
 
 
-def main(train: bool):
-    """Runs the main training loop for the BERT-based classifier.
+def cross_validate(
+    train: bool,
+    store: ResultsStore,
+    config: dict,
+    autocast_dtype: torch.dtype | None = AUTOCAST_DTYPE,
+) -> dict[str, list]:
+    """Train or load the model of every fold and evaluate it on the test rows.
 
     :param train: Whether to train the model or evaluate it.
     :type train: bool
+    :param store: Store the results of every fold are saved to.
+    :type store: ResultsStore
+    :param config: Configuration the store keys the results by.
+    :type config: dict
+    :param autocast_dtype: Data type of the mixed precision training steps, None for
+        full precision, defaults to AUTOCAST_DTYPE
+    :type autocast_dtype: torch.dtype | None, optional
+    :return: Dictionary of per-fold lists of metrics and predictions.
+    :rtype: dict[str, list]
     """
-    sns.set_theme("paper", "whitegrid")
-
     # Setup the dataset and cross-validation
     tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
     dataset = ArticleDataset(
@@ -296,6 +302,8 @@ def main(train: bool):
                 optimizer,
                 scheduler,
                 num_epochs=NUM_EPOCHS,
+                autocast_dtype=autocast_dtype,
+                accumulation_steps=ACCUMULATION_STEPS,
             )
         else:
             # Load the model
@@ -307,6 +315,7 @@ def main(train: bool):
 
         # Evaluate the model
         res = test_model(model, test_loader, True, criterion)
+        store.save_fold(MODEL_NAME, config, fold, res)
         for key, value in res.items():
             if key not in results:
                 results[key] = []
@@ -317,6 +326,39 @@ def main(train: bool):
             if not os.path.exists(f"./ckpts/{MODEL_NAME}/{fold}"):
                 os.makedirs(f"./ckpts/{MODEL_NAME}/{fold}")
             torch.save(model.state_dict(), f"./ckpts/{MODEL_NAME}/{fold}/model.pth")
+    return results
+
+
+def main(train: bool, from_store: bool = False, full_precision: bool = False):
+    """Runs the main training loop for the BERT-based classifier.
+
+    :param train: Whether to train the model or evaluate it.
+    :type train: bool
+    :param from_store: Report the stored results of a previous run instead of
+        evaluating the model, defaults to False
+    :type from_store: bool, optional
+    :param full_precision: Train in float32 instead of with AUTOCAST_DTYPE,
+        defaults to False
+    :type full_precision: bool, optional
+    """
+    sns.set_theme("paper", "whitegrid")
+
+    autocast_dtype = None if full_precision else AUTOCAST_DTYPE
+
+    store = ResultsStore(RESULTS_DIR)
+    config = {
+        "model_path": MODEL_PATH,
+        "max_length": MAX_LENGTH,
+        "num_folds": NUM_FOLDS,
+        "num_epochs": NUM_EPOCHS,
+        "batch_size": BATCH_SIZE,
+        "accumulation_steps": ACCUMULATION_STEPS,
+        "autocast_dtype": str(autocast_dtype),
+    }
+    if from_store:
+        results = store.load(MODEL_NAME, config)
+    else:
+        results = cross_validate(train, store, config, autocast_dtype)
 
     y = np.concatenate(results["y"])
     chance_level = np.mean(y)
@@ -334,17 +376,8 @@ def main(train: bool):
             print(f"{key}: {np.mean(value):.4f} ± {np.std(value):.4f}")
 
     # Plot ROC and PRC
-    model_outputs = []
-    for i in range(NUM_FOLDS):
-        fold_results = {
-            "y_pred": results["y_pred"][i],
-            "y": results["y"][i],
-            "y_prob": results["y_prob"][i],
-        }
-        model_outputs.append(fold_results)
-
     fig = k_fold_roc_curve(
-        model_outputs,
+        fold_outputs(results),
         MODEL_NAME,
         8,
         average="weighted",
@@ -353,4 +386,15 @@ def main(train: bool):
 
 
 if __name__ == "__main__":
-    main(TRAIN)
+    args = argparse.ArgumentParser()
+    args.add_argument(
+        "--from-store",
+        action="store_true",
+        help="Report the stored results of a previous run without evaluating",
+    )
+    args.add_argument(
+        "--full-precision",
+        action="store_true",
+        help="Train in float32 instead of with bfloat16 autocast",
+    )
+    main(TRAIN, **vars(args.parse_args()))
@@ -0,0 +1,328 @@
+"""Persisted TF-IDF feature artifacts that reload memory-mapped.
+"""
+
+import hashlib
+import json
+import os
+import struct
+import zipfile
+from typing import Callable, Iterable
+
+import numpy as np
+import scipy
+from nltk.tokenize import word_tokenize
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+from dataset.counts import TermCounts
+from dataset.tokenization import pretokenized, tokenize_corpus, tokenizer_name
+
+_SELECTION_PARAMS = ("stop_words", "max_features")
+
+
+def fingerprint(texts: Iterable[str], params: dict) -> str:
+    """Fingerprint a corpus together with the parameters used to vectorise it.
+
+    :param texts: Documents of the corpus, in order.
+    :type texts: Iterable[str]
+    :param params: JSON-serialisable vectoriser parameters.
+    :type params: dict
+    :return: Hex digest of the corpus and parameters.
+    :rtype: str
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8"))
+    for text in texts:
+        encoded = str(text).encode("utf-8")
+        digest.update(struct.pack("<Q", len(encoded)))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def load_npz_mmap(path: str | os.PathLike) -> dict[str, np.ndarray]:
+    """Memory-map the arrays of an uncompressed ``.npz`` archive.
+
+    ``np.load`` ignores ``mmap_mode`` for archives, so the offset of every stored
+    ``.npy`` member is located in the zip file and mapped directly.
+
+    :param path: Path to an archive written with ``np.savez``.
+    :type path: str | os.PathLike
+    :raises ValueError: If a member of the archive is compressed.
+    :return: Memory-mapped arrays keyed by name.
+    :rtype: dict[str, np.ndarray]
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as zf, open(path, "rb") as f:
+        for info in zf.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{info.filename} in {path} is compressed")
+            # The local file header is 30 bytes followed by the name and extra field
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack("<HH", f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[info.filename.removesuffix(".npy")] = np.memmap(
+                path,
+                dtype=dtype,
+                mode="r",
+                offset=f.tell(),
+                shape=shape,
+                order="F" if fortran_order else "C",
+            )
+    return arrays
+
+
+def _vectoriser_params(tokenizer: Callable[[str], list[str]], params: dict) -> dict:
+    """Parameters an artifact is fingerprinted and stored with.
+
+    :param tokenizer: Tokenizer for a single document.
+    :type tokenizer: Callable[[str], list[str]]
+    :param params: Feature selection and ``TfidfTransformer`` parameters.
+    :type params: dict
+    :return: Vectoriser parameters.
+    :rtype: dict
+    """
+    return {"tokenizer": tokenizer_name(tokenizer), "lowercase": True, **params}
+
+
+class FeatureArtifact:
+    """Vocabulary, IDF vector and float32 TF-IDF matrix of a fitted corpus.
+
+    Artifacts are saved as an uncompressed ``.npz`` archive with the corpus
+    fingerprint, and reloaded memory-mapped when the fingerprint still matches. They
+    can also vectorise new articles for inference.
+
+    :param X: TF-IDF matrix of the corpus.
+    :type X: scipy.sparse.csr_matrix
+    :param vocabulary: Feature names, one per column of ``X``.
+    :type vocabulary: np.ndarray
+    :param idf: IDF weight of every feature.
+    :type idf: np.ndarray
+    :param fingerprint: Fingerprint of the corpus and vectoriser parameters.
+    :type fingerprint: str
+    :param params: Vectoriser parameters.
+    :type params: dict
+    """
+
+    def __init__(
+        self,
+        X: scipy.sparse.csr_matrix,
+        vocabulary: np.ndarray,
+        idf: np.ndarray,
+        fingerprint: str,
+        params: dict,
+    ) -> None:
+        self.X = scipy.sparse.csr_matrix(X, dtype=np.float32)
+        self.vocabulary = np.asarray(vocabulary).astype(str)
+        self.idf = np.asarray(idf, dtype=np.float32)
+        self.fingerprint = fingerprint
+        self.params = params
+
+    @classmethod
+    def build(
+        cls,
+        texts: Iterable[str],
+        path: str | os.PathLike | None = None,
+        counts: TermCounts | None = None,
+        tokenizer: Callable[[str], list[str]] = word_tokenize,
+        token_cache_dir: str | os.PathLike | None = None,
+        source: "FeatureArtifact | None" = None,
+        **params,
+    ) -> "FeatureArtifact":
+        """Load the artifact of a corpus if it is fresh, otherwise fit and save it.
+
+        Selecting features does not change their IDF, so with counts and an artifact
+        of the same corpus without feature selection, the selected columns of that
+        artifact are renormalised instead of weighting the counts again.
+
+        :param texts: Documents of the corpus.
+        :type texts: Iterable[str]
+        :param path: Path to the ``.npz`` archive, defaults to no persistence.
+        :type path: str | os.PathLike | None, optional
+        :param counts: Term counts of the same documents, to fit from instead of
+            tokenising the corpus, defaults to None
+        :type counts: TermCounts | None, optional
+        :param tokenizer: Tokenizer for a single document, defaults to word_tokenize
+        :type tokenizer: Callable[[str], list[str]], optional
+        :param token_cache_dir: Directory of the token cache, defaults to no caching.
+        :type token_cache_dir: str | os.PathLike | None, optional
+        :param source: Artifact of the same corpus and ``TfidfTransformer``
+            parameters without feature selection, used with ``counts``, defaults to
+            None
+        :type source: FeatureArtifact | None, optional
+        :param params: JSON-serialisable ``stop_words`` and ``max_features``, and
+            keyword arguments for ``TfidfTransformer``.
+        :return: Artifact of the corpus.
+        :rtype: FeatureArtifact
+        """
+        texts = list(texts)
+        params = _vectoriser_params(tokenizer, params)
+        digest = fingerprint(texts, params)
+        if path is not None:
+            artifact = cls.load_if_fresh(path, digest)
+            if artifact is not None:
+                return artifact
+
+        if counts is None:
+            counts = TermCounts.from_texts(texts, tokenizer, cache_dir=token_cache_dir)
+        kwargs = {
+            key: value
+            for key, value in params.items()
+            if key not in ("tokenizer", "lowercase")
+        }
+        selection = {key: kwargs.pop(key) for key in _SELECTION_PARAMS if key in kwargs}
+        weighting = {
+            key: value for key, value in params.items() if key not in selection
+        }
+        if (
+            source is not None
+            and source.params == weighting
+            and source.fingerprint == fingerprint(texts, source.params)
+        ):
+            columns = counts.select_features(**selection)
+            positions = np.searchsorted(source.vocabulary, counts.vocabulary[columns])
+            X = source.X[:, positions]
+            norm = kwargs.get("norm", "l2")
+            artifact = cls(
+                X if norm is None else normalize(X, norm=norm, copy=False),
+                source.vocabulary[positions],
+                source.idf[positions],
+                digest,
+                params,
+            )
+        else:
+            columns, transformer = counts.fit_tfidf(**selection, **kwargs)
+            artifact = cls(
+                counts.transform(columns, transformer),
+                counts.vocabulary[columns],
+                transformer.idf_,
+                digest,
+                params,
+            )
+        if path is not None:
+            artifact.save(path)
+        return artifact
+
+    @staticmethod
+    def corpus_fingerprint(
+        texts: Iterable[str],
+        tokenizer: Callable[[str], list[str]] = word_tokenize,
+        **params,
+    ) -> str:
+        """Fingerprint a corpus as :meth:`build` does, without tokenising it.
+
+        :param texts: Documents of the corpus.
+        :type texts: Iterable[str]
+        :param tokenizer: Tokenizer for a single document, defaults to word_tokenize
+        :type tokenizer: Callable[[str], list[str]], optional
+        :param params: Parameters as passed to :meth:`build`.
+        :return: Fingerprint of the artifact :meth:`build` returns.
+        :rtype: str
+        """
+        return fingerprint(texts, _vectoriser_params(tokenizer, params))
+
+    @classmethod
+    def load(cls, path: str | os.PathLike, mmap: bool = True) -> "FeatureArtifact":
+        """Load an artifact saved with :meth:`save`.
+
+        :param path: Path to the ``.npz`` archive.
+        :type path: str | os.PathLike
+        :param mmap: Memory-map the arrays instead of reading them, defaults to True
+        :type mmap: bool, optional
+        :return: Loaded artifact.
+        :rtype: FeatureArtifact
+        """
+        if mmap:
+            arrays = load_npz_mmap(path)
+        else:
+            with np.load(path) as f:
+                arrays = dict(f)
+        X = scipy.sparse.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(arrays["shape"]),
+        )
+        return cls(
+            X,
+            arrays["vocabulary"],
+            arrays["idf"],
+            str(arrays["fingerprint"][()]),
+            json.loads(str(arrays["params"][()])),
+        )
+
+    @classmethod
+    def load_if_fresh(
+        cls, path: str | os.PathLike, fingerprint: str
+    ) -> "FeatureArtifact | None":
+        """Load an artifact only if it was built from the same corpus and parameters.
+
+        :param path: Path to the ``.npz`` archive.
+        :type path: str | os.PathLike
+        :param fingerprint: Expected fingerprint.
+        :type fingerprint: str
+        :return: Memory-mapped artifact, or None if it is missing or stale.
+        :rtype: FeatureArtifact | None
+        """
+        if not os.path.exists(path):
+            return None
+        artifact = cls.load(path)
+        return artifact if artifact.fingerprint == fingerprint else None
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Save the artifact to an uncompressed ``.npz`` archive.
+
+        The archive is written to a temporary file first and renamed into place.
+
+        :param path: Path to the ``.npz`` archive.
+        :type path: str | os.PathLike
+        """
+        root_dir = os.path.dirname(path)
+        if root_dir and not os.path.exists(root_dir):
+            os.makedirs(root_dir)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(
+            tmp_path,
+            data=self.X.data,
+            indices=self.X.indices,
+            indptr=self.X.indptr.astype(self.X.indices.dtype),
+            shape=np.array(self.X.shape),
+            vocabulary=self.vocabulary,
+            idf=self.idf,
+            fingerprint=np.array(self.fingerprint),
+            params=np.array(json.dumps(self.params, sort_keys=True)),
+        )
+        os.replace(tmp_path, path)
+
+    def transform(
+        self,
+        texts: Iterable[str],
+        tokenizer: Callable[[str], list[str]] = word_tokenize,
+        n_jobs: int | None = None,
+    ) -> scipy.sparse.csr_matrix:
+        """Vectorise new articles with the stored vocabulary and IDF.
+
+        :param texts: Articles to vectorise.
+        :type texts: Iterable[str]
+        :param tokenizer: Tokenizer the artifact was built with, defaults to
+            word_tokenize
+        :type tokenizer: Callable[[str], list[str]], optional
+        :param n_jobs: Number of tokeniser processes, defaults to all cores.
+        :type n_jobs: int | None, optional
+        :return: TF-IDF matrix of shape (n_articles, n_features).
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if self.params.get("lowercase", True):
+            texts = [text.lower() for text in texts]
+        tokens = tokenize_corpus(texts, tokenizer, n_jobs)
+        vectorizer = CountVectorizer(
+            analyzer=pretokenized, vocabulary=self.vocabulary, dtype=np.float32
+        )
+        X = vectorizer.transform(tokens)
+        if self.params.get("sublinear_tf", False):
+            np.log(X.data, X.data)
+            X.data += 1
+        X.data *= self.idf[X.indices]
+        norm = self.params.get("norm", "l2")
+        return X if norm is None else normalize(X, norm=norm, copy=False)
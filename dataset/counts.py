@@ -0,0 +1,221 @@
+"""Term-count matrix from which TF-IDF features are derived without re-tokenising.
+"""
+
+import os
+from typing import Callable, Iterable
+
+import numpy as np
+import scipy
+from nltk.tokenize import word_tokenize
+from sklearn.feature_extraction.text import (
+    ENGLISH_STOP_WORDS,
+    CountVectorizer,
+    TfidfTransformer,
+)
+
+from dataset.tokenization import pretokenized, tokenize_corpus
+
+
+class TermCounts:
+    """Sparse document-term counts over the full, unfiltered vocabulary.
+
+    Every document is tokenised once. TF-IDF matrices for any combination of stop
+    words, ``max_features`` and IDF fitting rows are then derived with sparse
+    arithmetic, and match in float32 what ``TfidfVectorizer`` fitted on the same rows
+    returns.
+
+    :param counts: Document-term count matrix.
+    :type counts: scipy.sparse.csr_matrix
+    :param vocabulary: Terms in sorted order, one per column of ``counts``.
+    :type vocabulary: np.ndarray
+    """
+
+    def __init__(self, counts: scipy.sparse.csr_matrix, vocabulary: np.ndarray):
+        self.counts = scipy.sparse.csr_matrix(counts)
+        self.vocabulary = np.asarray(vocabulary)
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: Iterable[str],
+        tokenizer: Callable[[str], list[str]] = word_tokenize,
+        lowercase: bool = True,
+        n_jobs: int | None = None,
+        cache_dir: str | os.PathLike | None = None,
+    ) -> "TermCounts":
+        """Tokenise and count a corpus, tokenising on a process pool.
+
+        :param texts: Documents to count.
+        :type texts: Iterable[str]
+        :param tokenizer: Tokenizer for a single document, defaults to word_tokenize
+        :type tokenizer: Callable[[str], list[str]], optional
+        :param lowercase: Lowercase documents before tokenising, as
+            ``TfidfVectorizer`` does, defaults to True
+        :type lowercase: bool, optional
+        :param n_jobs: Number of tokeniser processes, defaults to all cores.
+        :type n_jobs: int | None, optional
+        :param cache_dir: Directory of the token cache, defaults to no caching.
+        :type cache_dir: str | os.PathLike | None, optional
+        :return: Term counts of the corpus.
+        :rtype: TermCounts
+        """
+        if lowercase:
+            texts = [text.lower() for text in texts]
+        tokens = tokenize_corpus(texts, tokenizer, n_jobs, cache_dir)
+        return cls.from_tokens(tokens)
+
+    @classmethod
+    def from_tokens(cls, tokens: Iterable[list[str]]) -> "TermCounts":
+        """Count a corpus that has already been tokenised.
+
+        :param tokens: Token lists, one per document.
+        :type tokens: Iterable[list[str]]
+        :return: Term counts of the corpus.
+        :rtype: TermCounts
+        """
+        vectorizer = CountVectorizer(analyzer=pretokenized, dtype=np.int32)
+        counts = vectorizer.fit_transform(tokens)
+        return cls(counts, vectorizer.get_feature_names_out())
+
+    @classmethod
+    def load(cls, path: str | os.PathLike) -> "TermCounts":
+        """Load term counts saved with :meth:`save`.
+
+        :param path: Path to the ``.npz`` file.
+        :type path: str | os.PathLike
+        :return: Loaded term counts.
+        :rtype: TermCounts
+        """
+        with np.load(path) as f:
+            counts = scipy.sparse.csr_matrix(
+                (f["data"], f["indices"], f["indptr"]), shape=tuple(f["shape"])
+            )
+            return cls(counts, f["vocabulary"])
+
+    def save(self, path: str | os.PathLike) -> None:
+        """Save the term counts to a compressed ``.npz`` file.
+
+        :param path: Path to the ``.npz`` file.
+        :type path: str | os.PathLike
+        """
+        np.savez_compressed(
+            path,
+            data=self.counts.data,
+            indices=self.counts.indices,
+            indptr=self.counts.indptr,
+            shape=np.array(self.counts.shape),
+            vocabulary=self.vocabulary.astype(str),
+        )
+
+    def __len__(self) -> int:
+        return self.counts.shape[0]
+
+    def select_features(
+        self,
+        stop_words: str | Iterable[str] | None = None,
+        max_features: int | None = None,
+        fit_rows: np.ndarray | None = None,
+    ) -> np.ndarray:
+        """Select the vocabulary columns a vectoriser fitted on some rows would keep.
+
+        :param stop_words: "english" or a list of stop words to drop, defaults to None
+        :type stop_words: str | Iterable[str] | None, optional
+        :param max_features: Keep only the most frequent terms, defaults to None
+        :type max_features: int | None, optional
+        :param fit_rows: Rows the vocabulary is fitted on, defaults to all rows.
+        :type fit_rows: np.ndarray | None, optional
+        :return: Sorted column indices into :attr:`vocabulary`.
+        :rtype: np.ndarray
+        """
+        counts = self._rows(fit_rows)
+        mask = counts.getnnz(axis=0) > 0
+        if stop_words is not None:
+            if stop_words == "english":
+                stop_words = ENGLISH_STOP_WORDS
+            mask &= ~np.isin(self.vocabulary, list(stop_words))
+        if max_features is not None and mask.sum() > max_features:
+            # Same selection as CountVectorizer._limit_features
+            tfs = np.asarray(counts.sum(axis=0)).ravel()
+            mask_inds = (-tfs[mask]).argsort()[:max_features]
+            new_mask = np.zeros(len(mask), dtype=bool)
+            new_mask[np.where(mask)[0][mask_inds]] = True
+            mask = new_mask
+        return np.flatnonzero(mask)
+
+    def fit_tfidf(
+        self,
+        fit_rows: np.ndarray | None = None,
+        stop_words: str | Iterable[str] | None = None,
+        max_features: int | None = None,
+        **kwargs,
+    ) -> tuple[np.ndarray, TfidfTransformer]:
+        """Fit the vocabulary and IDF weights on a subset of rows.
+
+        :param fit_rows: Rows to fit on, defaults to all rows.
+        :type fit_rows: np.ndarray | None, optional
+        :param stop_words: "english" or a list of stop words to drop, defaults to None
+        :type stop_words: str | Iterable[str] | None, optional
+        :param max_features: Keep only the most frequent terms, defaults to None
+        :type max_features: int | None, optional
+        :param kwargs: Keyword arguments for ``TfidfTransformer``.
+        :return: Selected columns and the fitted transformer.
+        :rtype: tuple[np.ndarray, TfidfTransformer]
+        """
+        columns = self.select_features(stop_words, max_features, fit_rows)
+        transformer = TfidfTransformer(**kwargs)
+        transformer.fit(self._rows(fit_rows)[:, columns].astype(np.float32))
+        return columns, transformer
+
+    def transform(
+        self,
+        columns: np.ndarray,
+        transformer: TfidfTransformer,
+        rows: np.ndarray | None = None,
+    ) -> scipy.sparse.csr_matrix:
+        """Weight the counts of some rows with a fitted vocabulary and IDF.
+
+        :param columns: Columns returned by :meth:`fit_tfidf`.
+        :type columns: np.ndarray
+        :param transformer: Transformer returned by :meth:`fit_tfidf`.
+        :type transformer: TfidfTransformer
+        :param rows: Rows to transform, defaults to all rows.
+        :type rows: np.ndarray | None, optional
+        :return: float32 TF-IDF matrix of shape (len(rows), len(columns)).
+        :rtype: scipy.sparse.csr_matrix
+        """
+        counts = self._rows(rows)[:, columns].astype(np.float32)
+        return transformer.transform(counts, copy=False)
+
+    def tfidf(
+        self,
+        fit_rows: np.ndarray | None = None,
+        stop_words: str | Iterable[str] | None = None,
+        max_features: int | None = None,
+        **kwargs,
+    ) -> tuple[scipy.sparse.csr_matrix, np.ndarray]:
+        """Derive the TF-IDF matrix of every row, fitted on some of them.
+
+        :param fit_rows: Rows to fit the vocabulary and IDF on, defaults to all rows.
+        :type fit_rows: np.ndarray | None, optional
+        :param stop_words: "english" or a list of stop words to drop, defaults to None
+        :type stop_words: str | Iterable[str] | None, optional
+        :param max_features: Keep only the most frequent terms, defaults to None
+        :type max_features: int | None, optional
+        :param kwargs: Keyword arguments for ``TfidfTransformer``.
+        :return: TF-IDF matrix of all rows and its feature names.
+        :rtype: tuple[scipy.sparse.csr_matrix, np.ndarray]
+        """
+        columns, transformer = self.fit_tfidf(
+            fit_rows, stop_words, max_features, **kwargs
+        )
+        return self.transform(columns, transformer), self.vocabulary[columns]
+
+    def _rows(self, rows: np.ndarray | None) -> scipy.sparse.csr_matrix:
+        """Select rows of the count matrix.
+
+        :param rows: Row indices, or None for all rows.
+        :type rows: np.ndarray | None
+        :return: Selected counts.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        return self.counts if rows is None else self.counts[rows]
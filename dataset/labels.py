@@ -0,0 +1,124 @@
+"""Compact multi-hot label storage shared by the datasets.
+"""
+
+import numpy as np
+import pandas as pd
+import torch
+
+
+class LabelMatrix:
+    """Multi-hot label matrix stored once as a contiguous ``uint8`` array.
+
+    Rows are handed out as zero-copy views of the underlying buffer, and batches are
+    gathered into a single tensor instead of one tensor per sample.
+
+    :param matrix: Binary label matrix of shape (n_samples, n_categories).
+    :type matrix: np.ndarray
+    :param categories: Category names, one per column.
+    :type categories: list[str]
+    """
+
+    def __init__(self, matrix: np.ndarray, categories: list[str]) -> None:
+        matrix = np.ascontiguousarray(matrix, dtype=np.uint8)
+        if matrix.ndim != 2 or matrix.shape[1] != len(categories):
+            raise ValueError(
+                f"Label matrix of shape {matrix.shape} does not match "
+                + f"{len(categories)} categories"
+            )
+        self.matrix = matrix
+        self.categories = list(categories)
+
+    @classmethod
+    def from_dataframe(
+        cls, df: pd.DataFrame, columns: list[str] | pd.Index
+    ) -> "LabelMatrix":
+        """Build the label matrix from the binary category columns of a DataFrame.
+
+        :param df: DataFrame containing one 0/1 column per category.
+        :type df: pd.DataFrame
+        :param columns: Names of the category columns.
+        :type columns: list[str] | pd.Index
+        :return: Label matrix for the DataFrame rows.
+        :rtype: LabelMatrix
+        """
+        matrix = df[columns].fillna(0).to_numpy(dtype=np.uint8)
+        return cls(matrix, list(columns))
+
+    @classmethod
+    def from_packed(cls, packed: np.ndarray, categories: list[str]) -> "LabelMatrix":
+        """Restore a label matrix from its bit-packed form.
+
+        :param packed: Output of :meth:`packed`.
+        :type packed: np.ndarray
+        :param categories: Category names, one per column.
+        :type categories: list[str]
+        :return: Unpacked label matrix.
+        :rtype: LabelMatrix
+        """
+        matrix = np.unpackbits(packed, axis=1, count=len(categories))
+        return cls(matrix, categories)
+
+    def __len__(self) -> int:
+        return self.matrix.shape[0]
+
+    def __getitem__(self, idx) -> np.ndarray:
+        return self.matrix[idx]
+
+    def __array__(self, dtype=None) -> np.ndarray:
+        return self.matrix if dtype is None else self.matrix.astype(dtype)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Shape of the label matrix."""
+        return self.matrix.shape
+
+    @property
+    def num_categories(self) -> int:
+        """Number of label categories."""
+        return len(self.categories)
+
+    def packed(self) -> np.ndarray:
+        """Bit-pack the label matrix along the category axis, for storage.
+
+        :return: Packed array of shape (n_samples, ceil(n_categories / 8)).
+        :rtype: np.ndarray
+        """
+        return np.packbits(self.matrix, axis=1)
+
+    def row(self, idx: int) -> torch.Tensor:
+        """Get the labels of one sample as a tensor sharing the matrix memory.
+
+        :param idx: Sample index.
+        :type idx: int
+        :return: Labels of shape (n_categories,) with dtype ``uint8``.
+        :rtype: torch.Tensor
+        """
+        return torch.from_numpy(self.matrix[idx])
+
+    def batch(
+        self, indices: list[int] | np.ndarray, dtype: torch.dtype = torch.float
+    ) -> torch.Tensor:
+        """Gather the labels of several samples into a single tensor.
+
+        :param indices: Sample indices.
+        :type indices: list[int] | np.ndarray
+        :param dtype: Output dtype, defaults to torch.float
+        :type dtype: torch.dtype, optional
+        :return: Labels of shape (len(indices), n_categories).
+        :rtype: torch.Tensor
+        """
+        rows = self.matrix[np.asarray(indices, dtype=np.intp)]
+        return torch.from_numpy(rows).to(dtype)
+
+    def names(self, idx: int) -> list[str]:
+        """Get the category names assigned to a sample.
+
+        :param idx: Sample index.
+        :type idx: int
+        :return: Category names with dashes replaced by spaces.
+        :rtype: list[str]
+        """
+        return [
+            self.categories[i].replace("-", " ")
+            for i in np.flatnonzero(self.matrix[idx])
+        ]
@@ -0,0 +1,116 @@
+"""Dense low-rank projection of TF-IDF features, fitted per cross-validation fold.
+"""
+
+import os
+
+import joblib
+import numpy as np
+import scipy
+from sklearn.base import TransformerMixin
+from sklearn.decomposition import TruncatedSVD
+from sklearn.random_projection import SparseRandomProjection
+
+METHODS = ("svd", "random_projection")
+
+
+def _fit_reduce(
+    X: scipy.sparse.csr_matrix,
+    train_idx: np.ndarray,
+    method: str,
+    n_components: int,
+    random_state: int,
+) -> tuple[TransformerMixin, np.ndarray]:
+    """Fit a projection on the training rows and project every row.
+
+    :param X: TF-IDF matrix of all rows.
+    :type X: scipy.sparse.csr_matrix
+    :param train_idx: Rows to fit the projection on.
+    :type train_idx: np.ndarray
+    :param method: "svd" or "random_projection".
+    :type method: str
+    :param n_components: Number of dense components.
+    :type n_components: int
+    :param random_state: Seed of the randomized solver.
+    :type random_state: int
+    :return: Fitted projection and the float32 components of all rows.
+    :rtype: tuple[TransformerMixin, np.ndarray]
+    """
+    if method == "svd":
+        projection = TruncatedSVD(
+            n_components, algorithm="randomized", random_state=random_state
+        )
+    else:
+        projection = SparseRandomProjection(
+            n_components, dense_output=True, random_state=random_state
+        )
+    projection.fit(X[train_idx])
+    return projection, np.asarray(projection.transform(X), dtype=np.float32)
+
+
+class FeatureReducer:
+    """Project TF-IDF rows onto a few hundred dense float32 components.
+
+    The projection is fitted on the training rows of a fold only, so no information
+    leaks from the test rows. Results are cached on disk keyed by the matrix, the
+    training rows and the parameters, so every fold is only fitted once across runs
+    and models.
+
+    :param method: "svd" for randomized truncated SVD or "random_projection" for a
+        sparse random projection, defaults to "svd"
+    :type method: str, optional
+    :param n_components: Number of dense components, defaults to 256
+    :type n_components: int, optional
+    :param random_state: Seed of the randomized solver, defaults to 42
+    :type random_state: int, optional
+    :param cache_dir: Directory of the per-fold cache, defaults to no caching.
+    :type cache_dir: str | os.PathLike | None, optional
+    """
+
+    def __init__(
+        self,
+        method: str = "svd",
+        n_components: int = 256,
+        random_state: int = 42,
+        cache_dir: str | os.PathLike | None = None,
+    ) -> None:
+        if method not in METHODS:
+            raise ValueError(f"method must be one of {METHODS}, got {method}")
+        self.method = method
+        self.n_components = n_components
+        self.random_state = random_state
+        self.memory = joblib.Memory(cache_dir, verbose=0)
+        self.projection = None
+
+    def fit_transform(
+        self, X: scipy.sparse.csr_matrix, train_idx: np.ndarray
+    ) -> np.ndarray:
+        """Fit the projection on the training rows of a fold and project all rows.
+
+        :param X: TF-IDF matrix of all rows.
+        :type X: scipy.sparse.csr_matrix
+        :param train_idx: Training rows of the fold.
+        :type train_idx: np.ndarray
+        :return: float32 components of shape (n_rows, n_components).
+        :rtype: np.ndarray
+        """
+        self.projection, X_reduced = self.memory.cache(_fit_reduce)(
+            X,
+            np.asarray(train_idx),
+            self.method,
+            self.n_components,
+            self.random_state,
+        )
+        return X_reduced
+
+    def transform(self, X: scipy.sparse.csr_matrix) -> np.ndarray:
+        """Project new rows with the projection of the last fitted fold.
+
+        :param X: TF-IDF matrix of the new rows.
+        :type X: scipy.sparse.csr_matrix
+        :raises RuntimeError: If the reducer has not been fitted.
+        :return: float32 components of shape (n_rows, n_components).
+        :rtype: np.ndarray
+        """
+        if self.projection is None:
+            raise RuntimeError("FeatureReducer has not been fitted")
+        return np.asarray(self.projection.transform(X), dtype=np.float32)
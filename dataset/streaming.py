@@ -0,0 +1,276 @@
+"""Out-of-core TF-IDF features using feature hashing and an on-disk CSR store.
+"""
+
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+import scipy
+from nltk.tokenize import word_tokenize
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from dataset.tokenization import pretokenized, tokenize_corpus
+
+
+class CSRStore:
+    """Append-only CSR matrix stored as flat binary files on disk.
+
+    Rows are appended chunk by chunk and the full matrix is read back memory-mapped,
+    so neither writing nor reading needs the whole matrix in memory.
+
+    :param root_dir: Directory holding the store files.
+    :type root_dir: str | os.PathLike
+    :param n_features: Number of columns, defaults to the value in an existing store.
+    :type n_features: int, optional
+    :param overwrite: Discard an existing store in ``root_dir``, defaults to False
+    :type overwrite: bool, optional
+    """
+
+    def __init__(
+        self,
+        root_dir: str | os.PathLike,
+        n_features: int = None,
+        overwrite: bool = False,
+    ) -> None:
+        self.root_dir = root_dir
+        if not os.path.exists(root_dir):
+            os.makedirs(root_dir)
+        self._meta_pth = os.path.join(root_dir, "meta.json")
+        self._data_pth = os.path.join(root_dir, "data.bin")
+        self._indices_pth = os.path.join(root_dir, "indices.bin")
+        self._indptr_pth = os.path.join(root_dir, "indptr.bin")
+        if overwrite or not os.path.exists(self._meta_pth):
+            if n_features is None:
+                raise ValueError("n_features is required to create a new store")
+            self.meta = {"n_features": n_features, "n_rows": 0, "nnz": 0}
+            for pth in [self._data_pth, self._indices_pth]:
+                open(pth, "wb").close()
+            np.zeros(1, dtype=np.int64).tofile(self._indptr_pth)
+            self._write_meta()
+        else:
+            with open(self._meta_pth, "r", encoding="utf-8") as f:
+                self.meta = json.load(f)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        """Shape of the stored matrix."""
+        return self.meta["n_rows"], self.meta["n_features"]
+
+    def append(self, X: scipy.sparse.csr_matrix) -> None:
+        """Append rows to the store.
+
+        :param X: Rows to append, with ``n_features`` columns.
+        :type X: scipy.sparse.csr_matrix
+        """
+        X = scipy.sparse.csr_matrix(X)
+        if X.shape[1] != self.meta["n_features"]:
+            raise ValueError(
+                f"Expected {self.meta['n_features']} columns, got {X.shape[1]}"
+            )
+        with open(self._data_pth, "ab") as f:
+            X.data.astype(np.float32, copy=False).tofile(f)
+        with open(self._indices_pth, "ab") as f:
+            X.indices.astype(np.int32, copy=False).tofile(f)
+        with open(self._indptr_pth, "ab") as f:
+            (X.indptr[1:].astype(np.int64) + self.meta["nnz"]).tofile(f)
+        self.meta["n_rows"] += X.shape[0]
+        self.meta["nnz"] += X.nnz
+        self._write_meta()
+
+    def load(self) -> scipy.sparse.csr_matrix:
+        """Read the stored matrix with its values and column indices memory-mapped.
+
+        :return: CSR matrix backed by the store files.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        nnz = self.meta["nnz"]
+        if nnz == 0:
+            return scipy.sparse.csr_matrix(self.shape, dtype=np.float32)
+        data = np.memmap(self._data_pth, dtype=np.float32, mode="r", shape=(nnz,))
+        indices = np.memmap(self._indices_pth, dtype=np.int32, mode="r", shape=(nnz,))
+        indptr = np.fromfile(self._indptr_pth, dtype=np.int64)
+        if nnz < np.iinfo(np.int32).max:
+            # Matching index dtypes keep scipy from copying the column indices
+            indptr = indptr.astype(np.int32)
+        return scipy.sparse.csr_matrix((data, indices, indptr), shape=self.shape)
+
+    def iter_chunks(self, chunksize: int) -> Iterator[scipy.sparse.csr_matrix]:
+        """Iterate over the stored rows in chunks.
+
+        :param chunksize: Number of rows per chunk.
+        :type chunksize: int
+        :return: Iterator over CSR chunks.
+        :rtype: Iterator[scipy.sparse.csr_matrix]
+        """
+        X = self.load()
+        for start in range(0, X.shape[0], chunksize):
+            yield X[start : start + chunksize]
+
+    def _write_meta(self) -> None:
+        with open(self._meta_pth, "w", encoding="utf-8") as f:
+            json.dump(self.meta, f)
+
+
+class HashingTfIdf:
+    """Streaming TF-IDF vectoriser built on feature hashing.
+
+    Memory is bounded by ``n_features`` and the chunk size instead of the vocabulary
+    and corpus size. Document frequencies are updated incrementally, so new articles
+    can be added without refitting on the whole corpus.
+
+    :param n_features: Number of hashed feature columns, defaults to 2**18
+    :type n_features: int, optional
+    :param tokenizer: Tokenizer for a single document, defaults to word_tokenize
+    :type tokenizer: Callable[[str], list[str]], optional
+    :param lowercase: Lowercase documents before tokenising, defaults to True
+    :type lowercase: bool, optional
+    :param norm: Row normalisation, "l1", "l2" or None, defaults to "l2"
+    :type norm: str | None, optional
+    :param smooth_idf: Add one to document frequencies, defaults to True
+    :type smooth_idf: bool, optional
+    :param sublinear_tf: Use 1 + log(tf) as the term frequency, defaults to False
+    :type sublinear_tf: bool, optional
+    :param n_jobs: Number of tokeniser processes, defaults to all cores.
+    :type n_jobs: int | None, optional
+    """
+
+    def __init__(
+        self,
+        n_features: int = 2**18,
+        tokenizer: Callable[[str], list[str]] = word_tokenize,
+        lowercase: bool = True,
+        norm: str | None = "l2",
+        smooth_idf: bool = True,
+        sublinear_tf: bool = False,
+        n_jobs: int | None = None,
+    ) -> None:
+        self.n_features = n_features
+        self.tokenizer = tokenizer
+        self.lowercase = lowercase
+        self.norm = norm
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+        self.n_jobs = n_jobs
+        self.hasher = HashingVectorizer(
+            n_features=n_features,
+            analyzer=pretokenized,
+            alternate_sign=False,
+            norm=None,
+            dtype=np.float32,
+        )
+        self.doc_freq = np.zeros(n_features, dtype=np.int64)
+        self.n_docs = 0
+
+    @property
+    def idf(self) -> np.ndarray:
+        """IDF weights from the document frequencies seen so far."""
+        smooth = int(self.smooth_idf)
+        idf = np.log((self.n_docs + smooth) / (self.doc_freq + smooth)) + 1
+        return idf.astype(np.float32)
+
+    def count(
+        self, texts: Iterable[str], executor: Executor | None = None
+    ) -> scipy.sparse.csr_matrix:
+        """Tokenise and hash documents into term counts.
+
+        :param texts: Documents to count.
+        :type texts: Iterable[str]
+        :param executor: Process pool to tokenise on, defaults to a pool of
+            ``n_jobs`` processes created for this call.
+        :type executor: Executor | None, optional
+        :return: Hashed term counts of shape (n_docs, n_features).
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if self.lowercase:
+            texts = [text.lower() for text in texts]
+        tokens = tokenize_corpus(texts, self.tokenizer, self.n_jobs, executor=executor)
+        return self.hasher.transform(tokens)
+
+    def partial_fit(self, counts: scipy.sparse.csr_matrix) -> None:
+        """Add the document frequencies of a chunk of hashed counts.
+
+        :param counts: Hashed term counts from :meth:`count`.
+        :type counts: scipy.sparse.csr_matrix
+        """
+        self.doc_freq += np.bincount(counts.indices, minlength=self.n_features)
+        self.n_docs += counts.shape[0]
+
+    def weight(self, counts: scipy.sparse.csr_matrix) -> scipy.sparse.csr_matrix:
+        """Weight hashed counts with the current IDF and normalise the rows.
+
+        :param counts: Hashed term counts.
+        :type counts: scipy.sparse.csr_matrix
+        :return: TF-IDF matrix of the same shape.
+        :rtype: scipy.sparse.csr_matrix
+        """
+        X = scipy.sparse.csr_matrix(counts, dtype=np.float32, copy=True)
+        if self.sublinear_tf:
+            np.log(X.data, X.data)
+            X.data += 1
+        X.data *= self.idf[X.indices]
+        if self.norm is not None:
+            X = normalize(X, norm=self.norm, copy=False)
+        return X
+
+    def transform(self, texts: Iterable[str]) -> scipy.sparse.csr_matrix:
+        """Vectorise new documents with the current IDF, without updating it.
+
+        :param texts: Documents to vectorise.
+        :type texts: Iterable[str]
+        :return: TF-IDF matrix of shape (n_docs, n_features).
+        :rtype: scipy.sparse.csr_matrix
+        """
+        return self.weight(self.count(texts))
+
+    def fit_store(
+        self, texts: Iterable[str], store: CSRStore, chunksize: int = 256
+    ) -> None:
+        """Count documents chunk by chunk into a store, updating the frequencies.
+
+        All chunks are tokenised on one process pool, which is only started once.
+
+        :param texts: Documents to count, consumed lazily.
+        :type texts: Iterable[str]
+        :param store: Store the hashed counts are appended to.
+        :type store: CSRStore
+        :param chunksize: Number of documents per chunk, defaults to 256
+        :type chunksize: int, optional
+        """
+        n_jobs = self.n_jobs or os.cpu_count()
+        with (
+            ProcessPoolExecutor(max_workers=n_jobs) if n_jobs > 1 else nullcontext()
+        ) as executor:
+            chunk = []
+            for text in texts:
+                chunk.append(text)
+                if len(chunk) == chunksize:
+                    self._fit_chunk(chunk, store, executor)
+                    chunk = []
+            if chunk:
+                self._fit_chunk(chunk, store, executor)
+
+    def transform_store(
+        self, counts: CSRStore, out: CSRStore, chunksize: int = 256
+    ) -> None:
+        """Weight a store of hashed counts into a TF-IDF store, chunk by chunk.
+
+        :param counts: Store of hashed counts.
+        :type counts: CSRStore
+        :param out: Store the TF-IDF rows are appended to.
+        :type out: CSRStore
+        :param chunksize: Number of rows per chunk, defaults to 256
+        :type chunksize: int, optional
+        """
+        for chunk in counts.iter_chunks(chunksize):
+            out.append(self.weight(chunk))
+
+    def _fit_chunk(
+        self, texts: list[str], store: CSRStore, executor: Executor | None
+    ) -> None:
+        counts = self.count(texts, executor)
+        self.partial_fit(counts)
+        store.append(counts)
@@ -3,12 +3,14 @@
 
 import os
 
+import numpy as np
 import pandas as pd
-import torch
 from sklearn.preprocessing import LabelEncoder
 from torch.utils.data import Dataset
 from transformers.tokenization_utils_base import PreTrainedTokenizerBase
 
+from dataset.labels import LabelMatrix
+
 
 class ArticleDataset(Dataset):
     """
@@ -37,9 +39,8 @@ class ArticleDataset(Dataset):
         self.max_length = max_length
         self.labelled_csv = labelled_csv
         self.articles = []
-        self.labels = []
-        self.targets = []
         self.categories = []
+        self.label_matrix: LabelMatrix = None
         self.label_encoder = LabelEncoder()
         self._init_dataset()
 
@@ -55,16 +56,29 @@ class ArticleDataset(Dataset):
                         text = f.read()
                         df.loc[df["File"] == file, "Text"] = text
 
-        for _, row in df.iterrows():
-            targets = row[2:]
-            labels = df.columns[2:][targets == 1]
-            labels = list(map(lambda x: x.replace("-", " "), labels))
-            text = row["Text"]
-            if text:
-                self.articles.append(text)
-                self.labels.append(labels)
-                self.targets.append(targets.to_list())
+        # Skip articles whose text is empty
+        df = df[df["Text"].map(bool)]
+        self.articles = df["Text"].to_list()
         self.categories = df.columns[2:].to_list()
+        self.label_matrix = LabelMatrix.from_dataframe(df, self.categories)
+
+    @property
+    def targets(self) -> np.ndarray:
+        """Binary targets of every article, as a view of the label matrix.
+
+        :return: Array of shape (n_articles, n_categories).
+        :rtype: np.ndarray
+        """
+        return self.label_matrix.matrix
+
+    @property
+    def labels(self) -> list[list[str]]:
+        """Category names of every article.
+
+        :return: List of category names per article.
+        :rtype: list[list[str]]
+        """
+        return [self.label_matrix.names(i) for i in range(len(self.label_matrix))]
 
     def __len__(self):
         """
@@ -74,7 +88,6 @@ class ArticleDataset(Dataset):
 
     def __getitem__(self, idx):
         text = self.articles[idx]
-        target = self.targets[idx]
         inputs = self.tokenizer(
             text,
             return_tensors="pt",
@@ -91,4 +104,4 @@ class ArticleDataset(Dataset):
         if "token_type_ids" in inputs:
             res["token_type_ids"] = inputs.token_type_ids
 
-        return res, torch.tensor(target)
+        return res, self.label_matrix.row(idx)
@@ -1,15 +1,21 @@
 """TfIdfDataset class for loading data from a csv file and a directory of articles
 """
 
+import hashlib
+import json
 import os
+from functools import partial
 
 import numpy as np
 import scipy
 import torch
-from nltk.tokenize import word_tokenize
-from sklearn.feature_extraction.text import TfidfVectorizer
-from torch.utils.data import Dataset
+from torch.utils.data import DataLoader, Dataset
 
+from dataset.artifacts import FeatureArtifact
+from dataset.counts import TermCounts
+from dataset.labels import LabelMatrix
+from dataset.reduction import FeatureReducer
+from dataset.streaming import CSRStore, HashingTfIdf
 from dataset.transformers_dataset import load_data
 
 
@@ -24,6 +30,22 @@ class TfIdfDataset(Dataset):
     :type use_original_text: bool, optional
     :param padded_shape: Shape to pad the input tensor to.
     :type padded_shape: tuple[int, int], optional
+    :param counts: Term counts of the same articles, to derive the features from
+        instead of tokenising the corpus again, defaults to None
+    :type counts: TermCounts, optional
+    :param hashing_features: Build the features out-of-core with this many hashed
+        columns instead of a fitted vocabulary, defaults to None
+    :type hashing_features: int, optional
+    :param store_dir: Directory for the on-disk feature store of the hashed
+        features, required with ``hashing_features``, defaults to None
+    :type store_dir: str | os.PathLike, optional
+    :param cache_dir: Directory of the persisted feature artifact, which is loaded
+        memory-mapped while the articles and vectoriser parameters are unchanged,
+        defaults to None
+    :type cache_dir: str | os.PathLike, optional
+    :param source: Artifact of the same articles without feature selection, whose
+        columns are selected instead of weighting ``counts`` again, defaults to None
+    :type source: FeatureArtifact, optional
     """
 
     def __init__(
@@ -32,27 +54,118 @@ class TfIdfDataset(Dataset):
         articles_dir: str | os.PathLike,
         use_original_text: bool = False,
         padded_shape: tuple[int, int] = (0, 0),
+        counts: TermCounts = None,
+        hashing_features: int = None,
+        store_dir: str | os.PathLike = None,
+        cache_dir: str | os.PathLike = None,
+        source: FeatureArtifact = None,
     ) -> None:
         self.df = load_data(labelled_csv, articles_dir, use_original_text)
-        self.vectorizer = TfidfVectorizer(
-            tokenizer=word_tokenize, stop_words="english", max_features=10000
-        )
-        self.X = self.vectorizer.fit_transform(self.df["Text"])
-        self.features = self.vectorizer.get_feature_names_out()
-        self.y = self.df.iloc[:, 2:-1].to_numpy()
+        if hashing_features is not None:
+            self._init_hashed_features(hashing_features, store_dir)
+        else:
+            self.counts = counts
+            self.artifact = FeatureArtifact.build(
+                self.df["Text"],
+                None if cache_dir is None else os.path.join(cache_dir, "tfidf.npz"),
+                counts,
+                source=source,
+                stop_words="english",
+                max_features=10000,
+            )
+            self.X, self.features = self.artifact.X, self.artifact.vocabulary
+        self.labels = LabelMatrix.from_dataframe(self.df, self.df.columns[2:-1])
+        self.y = self.labels.matrix
+        self.X_reduced = None
         self.padded_shape = padded_shape
 
     def __len__(self) -> int:
         return len(self.df)
 
     def __getitem__(self, idx: int) -> tuple[torch.Tensor, torch.Tensor]:
-        x = self.X[idx]
         pad_x = self.padded_shape[0]
+        if self.X_reduced is not None:
+            inputs = self._get_reduced_batch(np.array([idx]))
+            return inputs[0] if pad_x else inputs, self.labels.row(idx).float()
+        x = self.X[idx]
         pad_y = self.padded_shape[1] - x.shape[1]
-        x = self._csr_matrix_to_tensor(x, (pad_x, pad_y))
-        x = x.to_dense()
-        y = self.y[idx]
-        return x.float(), torch.tensor(y, dtype=torch.float).squeeze()
+        inputs = torch.zeros((pad_x + 1, x.shape[1] + pad_y))
+        inputs[pad_x, torch.from_numpy(x.indices) + pad_y] = torch.from_numpy(x.data)
+        return inputs, self.labels.row(idx).float()
+
+    def get_batch(
+        self, indices: list[int] | np.ndarray, sparse: bool = False
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """Slice a whole batch out of the CSR matrix at once.
+
+        The column padding matches :meth:`__getitem__`, so a batch equals the stacked
+        per-item tensors without densifying each sample on its own.
+
+        :param indices: Row indices of the batch.
+        :type indices: list[int] | np.ndarray
+        :param sparse: Return the inputs as a sparse CSR tensor, ignored when a
+            reduction is set, defaults to False
+        :type sparse: bool, optional
+        :raises ValueError: If a sparse batch is requested with row padding.
+        :return: Inputs of shape (batch, padded_size) and labels of shape
+            (batch, n_categories).
+        :rtype: tuple[torch.Tensor, torch.Tensor]
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        if self.X_reduced is not None:
+            return self._get_reduced_batch(indices), self.labels.batch(indices)
+        x = self.X[indices]
+        pad_x = self.padded_shape[0]
+        pad_y = max(self.padded_shape[1] - x.shape[1], 0)
+        n_cols = x.shape[1] + pad_y
+        values = torch.from_numpy(x.data)
+        cols = torch.from_numpy(x.indices)
+        if pad_y:
+            cols = cols + pad_y
+        if sparse:
+            if pad_x:
+                raise ValueError("Sparse batches do not support row padding")
+            crow = torch.from_numpy(x.indptr)
+            inputs = torch.sparse_csr_tensor(crow, cols, values, (len(indices), n_cols))
+        else:
+            rows = torch.from_numpy(
+                np.repeat(
+                    np.arange(len(indices), dtype=x.indices.dtype), np.diff(x.indptr)
+                )
+            )
+            if pad_x:
+                inputs = torch.zeros((len(indices), pad_x + 1, n_cols))
+                inputs[rows, pad_x, cols] = values
+            else:
+                inputs = torch.zeros((len(indices), n_cols))
+                inputs[rows, cols] = values
+        return inputs, self.labels.batch(indices)
+
+    def collate_batch(
+        self, indices: list[int], sparse: bool = False
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        """Collate function for a loader that yields row indices instead of samples.
+
+        :param indices: Row indices gathered by the loader.
+        :type indices: list[int]
+        :param sparse: Return the inputs as a sparse CSR tensor, defaults to False
+        :type sparse: bool, optional
+        :return: Batched inputs and labels.
+        :rtype: tuple[torch.Tensor, torch.Tensor]
+        """
+        return self.get_batch(indices, sparse)
+
+    def transform(self, texts: list[str]) -> scipy.sparse.csr_matrix:
+        """Vectorise new articles with the fitted vocabulary and IDF for inference.
+
+        :param texts: Articles to vectorise.
+        :type texts: list[str]
+        :return: TF-IDF matrix of shape (n_articles, n_features).
+        :rtype: scipy.sparse.csr_matrix
+        """
+        if self.artifact is None:
+            return self.vectorizer.transform(texts)
+        return self.artifact.transform(texts)
 
     def get_feature_names(self) -> list[str]:
         """Get the feature names.
@@ -70,27 +183,102 @@ class TfIdfDataset(Dataset):
         """
         return len(self.features)
 
-    def _csr_matrix_to_tensor(
-        self, csr: scipy.sparse.csr_matrix, padding: tuple[int, int] = (0, 0)
-    ) -> torch.Tensor:
-        """Convert a CSR matrix to a PyTorch tensor.
+    def set_reduction(
+        self, reducer: FeatureReducer | None, train_idx: np.ndarray | None = None
+    ) -> None:
+        """Replace the tf-idf inputs by dense components fitted on training rows.
 
-        :param csr: CSR matrix to convert.
-        :type csr: scipy.sparse.csr_matrix
-        :param padding: Padding to add to the tensor, defaults to (0, 0)
-        :type padding: tuple[int, int], optional
-        :return: PyTorch tensor.
+        :param reducer: Reducer to fit, or None to go back to the tf-idf inputs.
+        :type reducer: FeatureReducer | None
+        :param train_idx: Training rows of the current fold, defaults to all rows.
+        :type train_idx: np.ndarray | None, optional
+        """
+        if reducer is None:
+            self.X_reduced = None
+            return
+        if train_idx is None:
+            train_idx = np.arange(len(self))
+        self.X_reduced = reducer.fit_transform(self.X, train_idx)
+
+    def _get_reduced_batch(self, indices: np.ndarray) -> torch.Tensor:
+        """Gather a batch of dense components, left padded like the tf-idf inputs.
+
+        :param indices: Row indices of the batch.
+        :type indices: np.ndarray
+        :return: Inputs of shape (batch, padded_size) or (batch, pad + 1,
+            padded_size) with row padding.
         :rtype: torch.Tensor
         """
-        coo = csr.tocoo()
-        values = coo.data
-        indices = np.vstack((coo.row + padding[0], coo.col + padding[1]))
-        shape = [coo.shape[0] + padding[0], coo.shape[1] + padding[1]]
+        x = torch.from_numpy(self.X_reduced[indices])
+        pad_x = self.padded_shape[0]
+        pad_y = max(self.padded_shape[1] - x.shape[1], 0)
+        if not pad_x and not pad_y:
+            return x
+        inputs = torch.zeros((len(indices), pad_x + 1, x.shape[1] + pad_y))
+        inputs[:, pad_x, pad_y:] = x
+        return inputs if pad_x else inputs[:, 0]
+
+    def _init_hashed_features(
+        self,
+        n_features: int,
+        store_dir: str | os.PathLike,
+        chunksize: int = 256,
+    ) -> None:
+        """Build hashed tf-idf features chunk by chunk into on-disk CSR stores.
+
+        The hashed counts are kept in ``store_dir/counts``, with a content hash of
+        every counted article in ``store_dir/articles.json``. While the counted
+        articles are the first ones of the dataset, only the new articles are
+        counted and appended, otherwise the counts are rebuilt. The weighted
+        features in ``store_dir/tfidf`` are recomputed when articles were added,
+        since the IDF changes, and are loaded memory-mapped as :attr:`X`.
+
+        :param n_features: Number of hashed feature columns.
+        :type n_features: int
+        :param store_dir: Directory for the feature stores.
+        :type store_dir: str | os.PathLike
+        :param chunksize: Number of articles per chunk, defaults to 256
+        :type chunksize: int, optional
+        :raises ValueError: If no store directory is given.
+        """
+        if store_dir is None:
+            raise ValueError("store_dir is required for hashed features")
+        self.counts = None
+        self.artifact = None
+        self.vectorizer = HashingTfIdf(n_features)
+        texts = self.df["Text"].tolist()
+        keys = [hashlib.sha1(text.encode("utf-8")).hexdigest() for text in texts]
+        keys_pth = os.path.join(store_dir, "articles.json")
+        counted = []
+        if os.path.exists(keys_pth):
+            with open(keys_pth, "r", encoding="utf-8") as f:
+                counted = json.load(f)
 
-        i = torch.LongTensor(indices)
-        v = torch.FloatTensor(values)
+        counts_dir = os.path.join(store_dir, "counts")
+        counts = CSRStore(counts_dir, n_features)
+        if (
+            counts.shape == (len(counted), n_features)
+            and counted == keys[: len(counted)]
+        ):
+            # The document frequencies of the stored counts are recounted
+            for chunk in counts.iter_chunks(chunksize):
+                self.vectorizer.partial_fit(chunk)
+        else:
+            counts = CSRStore(counts_dir, n_features, overwrite=True)
+            counted = []
+        num_new = len(texts) - len(counted)
+        if num_new:
+            self.vectorizer.fit_store(texts[len(counted) :], counts, chunksize)
+            with open(keys_pth, "w", encoding="utf-8") as f:
+                json.dump(keys, f)
 
-        return torch.sparse_coo_tensor(i, v, torch.Size(shape))
+        tfidf_dir = os.path.join(store_dir, "tfidf")
+        tfidf = CSRStore(tfidf_dir, n_features)
+        if num_new or tfidf.shape != counts.shape:
+            tfidf = CSRStore(tfidf_dir, n_features, overwrite=True)
+            self.vectorizer.transform_store(counts, tfidf, chunksize)
+        self.X = tfidf.load()
+        self.features = range(n_features)
 
     def set_padded_shape(self, padded_shape: tuple[int, int] = (0, 0)) -> None:
         """Sets the padded shape after initialization.
@@ -99,3 +287,40 @@ class TfIdfDataset(Dataset):
         :type padded_shape: tuple[int, int], optional
         """
         self.padded_shape = padded_shape
+
+
+def batch_loader(
+    ds: TfIdfDataset,
+    indices: list[int] | np.ndarray | None = None,
+    batch_size: int = 32,
+    shuffle: bool = False,
+    sparse: bool = False,
+    **kwargs,
+) -> DataLoader:
+    """Create a data loader that collates whole batches straight from the CSR matrix.
+
+    The loader samples row indices and :meth:`TfIdfDataset.collate_batch` slices the
+    batch in one call, instead of densifying every sample and stacking the results.
+
+    :param ds: TfIdfDataset to load from.
+    :type ds: TfIdfDataset
+    :param indices: Rows to sample from, defaults to all rows.
+    :type indices: list[int] | np.ndarray | None, optional
+    :param batch_size: Mini-batch size, defaults to 32
+    :type batch_size: int, optional
+    :param shuffle: Shuffle the rows every epoch, defaults to False
+    :type shuffle: bool, optional
+    :param sparse: Yield sparse CSR input tensors, defaults to False
+    :type sparse: bool, optional
+    :return: Data loader over the given rows.
+    :rtype: DataLoader
+    """
+    if indices is None:
+        indices = np.arange(len(ds))
+    return DataLoader(
+        np.asarray(indices),
+        batch_size=batch_size,
+        shuffle=shuffle,
+        collate_fn=partial(ds.collate_batch, sparse=sparse),
+        **kwargs,
+    )
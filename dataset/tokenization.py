@@ -0,0 +1,192 @@
+"""Parallel word tokenisation with an on-disk cache of token lists.
+"""
+
+import hashlib
+import json
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import nullcontext
+from functools import partial
+from typing import Callable, Iterable
+
+from nltk.tokenize import word_tokenize
+
+
+def tokenizer_name(tokenizer: Callable[[str], list[str]]) -> str:
+    """Name of a tokenizer that is stable across runs.
+
+    Partials are named by their function and arguments, callable objects by their
+    class, since the repr of either can contain a memory address.
+
+    :param tokenizer: Function, partial or callable object.
+    :type tokenizer: Callable[[str], list[str]]
+    :return: Qualified name of the tokenizer.
+    :rtype: str
+    """
+    if isinstance(tokenizer, partial):
+        keywords = sorted(tokenizer.keywords.items())
+        return f"{tokenizer_name(tokenizer.func)}({tokenizer.args!r}, {keywords!r})"
+    if not hasattr(tokenizer, "__qualname__"):
+        tokenizer = type(tokenizer)
+    module = getattr(tokenizer, "__module__", None) or type(tokenizer).__module__
+    return f"{module}.{tokenizer.__qualname__}"
+
+
+class TokenCache:
+    """On-disk cache of token lists keyed by a hash of the document content.
+
+    Entries are stored as JSON files sharded into sub-directories by the first two
+    characters of their key, and written atomically so concurrent runs can share a
+    cache directory.
+
+    :param cache_dir: Directory to store the cache in.
+    :type cache_dir: str | os.PathLike
+    """
+
+    def __init__(self, cache_dir: str | os.PathLike) -> None:
+        self.cache_dir = cache_dir
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    @staticmethod
+    def key(text: str, tokenizer: Callable[[str], list[str]]) -> str:
+        """Hash a document together with the tokenizer that splits it.
+
+        :param text: Document text.
+        :type text: str
+        :param tokenizer: Tokenizer applied to the document.
+        :type tokenizer: Callable[[str], list[str]]
+        :return: Hex digest identifying the token list.
+        :rtype: str
+        """
+        name = tokenizer_name(tokenizer)
+        return hashlib.sha1(f"{name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> list[str] | None:
+        """Look up a token list.
+
+        :param key: Key from :meth:`key`.
+        :type key: str
+        :return: Cached tokens, or None on a cache miss.
+        :rtype: list[str] | None
+        """
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def put(self, key: str, tokens: list[str]) -> None:
+        """Store a token list.
+
+        :param key: Key from :meth:`key`.
+        :type key: str
+        :param tokens: Tokens of the document.
+        :type tokens: list[str]
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(tokens, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+
+def pretokenized(tokens: list[str]) -> list[str]:
+    """Analyzer for vectorisers whose documents are already tokenised.
+
+    :param tokens: Tokens of a document.
+    :type tokens: list[str]
+    :return: The same tokens.
+    :rtype: list[str]
+    """
+    return tokens
+
+
+def _tokenize_chunk(
+    tokenizer: Callable[[str], list[str]], texts: list[str]
+) -> list[list[str]]:
+    """Tokenise a chunk of documents in a worker process.
+
+    :param tokenizer: Tokenizer for a single document.
+    :type tokenizer: Callable[[str], list[str]]
+    :param texts: Documents to tokenise.
+    :type texts: list[str]
+    :return: Token lists, one per document.
+    :rtype: list[list[str]]
+    """
+    return [tokenizer(text) for text in texts]
+
+
+def tokenize_corpus(
+    texts: Iterable[str],
+    tokenizer: Callable[[str], list[str]] = word_tokenize,
+    n_jobs: int | None = None,
+    cache_dir: str | os.PathLike | None = None,
+    chunksize: int = 32,
+    executor: Executor | None = None,
+) -> list[list[str]]:
+    """Tokenise a corpus on a process pool, reusing cached token lists.
+
+    Documents are deduplicated by content hash, looked up in the cache and only the
+    misses are sharded across the worker processes.
+
+    :param texts: Documents to tokenise.
+    :type texts: Iterable[str]
+    :param tokenizer: Picklable tokenizer for a single document, defaults to
+        word_tokenize
+    :type tokenizer: Callable[[str], list[str]], optional
+    :param n_jobs: Number of worker processes, defaults to all cores. 1 tokenises in
+        the calling process.
+    :type n_jobs: int | None, optional
+    :param cache_dir: Directory of the token cache, defaults to no caching.
+    :type cache_dir: str | os.PathLike | None, optional
+    :param chunksize: Number of documents sent to a worker at a time, defaults to 32
+    :type chunksize: int, optional
+    :param executor: Process pool to tokenise on, e.g. shared by the calls on the
+        chunks of a large corpus, defaults to a pool of ``n_jobs`` processes created
+        for this call.
+    :type executor: Executor | None, optional
+    :return: Token lists, one per document.
+    :rtype: list[list[str]]
+    """
+    texts = list(texts)
+    cache = TokenCache(cache_dir) if cache_dir is not None else None
+    keys = [TokenCache.key(text, tokenizer) for text in texts]
+
+    tokens_by_key = {}
+    for key, text in zip(keys, texts):
+        if key not in tokens_by_key:
+            tokens_by_key[key] = cache.get(key) if cache is not None else None
+    missing = {
+        key: text for key, text in zip(keys, texts) if tokens_by_key[key] is None
+    }
+
+    n_jobs = n_jobs or os.cpu_count()
+    missing_texts = list(missing.values())
+    if n_jobs == 1 or len(missing_texts) <= chunksize:
+        results = _tokenize_chunk(tokenizer, missing_texts)
+    else:
+        chunks = [
+            missing_texts[i : i + chunksize]
+            for i in range(0, len(missing_texts), chunksize)
+        ]
+        with (
+            nullcontext(executor)
+            if executor is not None
+            else ProcessPoolExecutor(max_workers=n_jobs)
+        ) as pool:
+            results = [
+                tokens
+                for chunk in pool.map(partial(_tokenize_chunk, tokenizer), chunks)
+                for tokens in chunk
+            ]
+
+    for key, tokens in zip(missing, results):
+        tokens_by_key[key] = tokens
+        if cache is not None:
+            cache.put(key, tokens)
+    return [tokens_by_key[key] for key in keys]
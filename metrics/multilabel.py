@@ -0,0 +1,200 @@
+"""Multi-label classification metrics computed from a single pass over the outputs.
+"""
+
+from dataclasses import asdict, dataclass, field
+
+import numpy as np
+
+
+@dataclass
+class MultiLabelMetrics:
+    """Metrics of a multi-label classifier on one evaluation set.
+
+    The values match the sklearn metrics of the same name, with micro averaging
+    where sklearn takes an ``average`` argument.
+    """
+
+    acc: float  # Subset accuracy
+    jaccard_index: float  # Sample-averaged Jaccard index (Godbole and Sarawagi)
+    f1: float
+    rec: float
+    prec: float
+    spec: float
+    lrap: float  # Label ranking average precision
+    lrl: float  # Label ranking loss
+    cov_err: float  # Coverage error
+    auroc: float
+    ap: float  # Average precision
+    fill_rate_preds: float  # Fraction of positive predictions
+    mlm: np.ndarray = field(repr=False)  # Per-label [[tn, fp], [fn, tp]]
+
+    def as_dict(self) -> dict[str, float]:
+        """Scalar metrics in the format of the cross-validation results.
+
+        :return: Dictionary of the scalar metrics, without the confusion matrices.
+        :rtype: dict[str, float]
+        """
+        metrics = asdict(self)
+        del metrics["mlm"]
+        return metrics
+
+
+def _ratio(numerator: float, denominator: float) -> float:
+    """Divide, with 0 for an ill-defined ratio as sklearn's default
+    ``zero_division``.
+
+    :param numerator: Numerator.
+    :type numerator: float
+    :param denominator: Denominator.
+    :type denominator: float
+    :return: Ratio or 0.
+    :rtype: float
+    """
+    return float(numerator / denominator) if denominator else 0.0
+
+
+def _ranking_metrics(
+    y_true: np.ndarray, y_prob: np.ndarray
+) -> tuple[float, float, float]:
+    """Label ranking average precision, ranking loss and coverage error.
+
+    Every row is sorted once. Tied scores form groups of consecutive positions, and
+    the number of labels scored at least as high as a position is the row length
+    minus the first position of its group.
+
+    :param y_true: Boolean labels of shape (n_samples, n_labels).
+    :type y_true: np.ndarray
+    :param y_prob: Scores of shape (n_samples, n_labels).
+    :type y_prob: np.ndarray
+    :return: LRAP, ranking loss and coverage error.
+    :rtype: tuple[float, float, float]
+    """
+    n_samples, n_labels = y_prob.shape
+    order = np.argsort(y_prob, axis=1, kind="stable")
+    scores = np.take_along_axis(y_prob, order, axis=1)
+    relevant = np.take_along_axis(y_true, order, axis=1).astype(np.int64)
+    positions = np.broadcast_to(np.arange(n_labels), scores.shape)
+
+    # First and last position of the group of ties of every position
+    new_group = np.ones(scores.shape, dtype=bool)
+    new_group[:, 1:] = scores[:, 1:] != scores[:, :-1]
+    first = np.maximum.accumulate(np.where(new_group, positions, 0), axis=1)
+    end_group = np.roll(new_group, -1, axis=1)
+    end_group[:, -1] = True
+    last = np.minimum.accumulate(
+        np.where(end_group, positions, n_labels - 1)[:, ::-1], axis=1
+    )[:, ::-1]
+
+    n_relevant = relevant.sum(axis=1)
+    relevant_before = np.cumsum(relevant, axis=1) - relevant
+    n_above = n_labels - first
+    relevant_above = n_relevant[:, None] - np.take_along_axis(
+        relevant_before, first, axis=1
+    )
+    relevant_below = np.take_along_axis(relevant_before + relevant, last, axis=1)
+    partial = (n_relevant > 0) & (n_relevant < n_labels)
+
+    # LRAP is 1 for rows with no or only relevant labels
+    precision_at = np.where(relevant, relevant_above / n_above, 0).sum(axis=1)
+    lrap = np.ones(n_samples)
+    lrap[partial] = precision_at[partial] / n_relevant[partial]
+
+    # Ranking loss counts the irrelevant labels scored at least as high as a relevant
+    # one, and is 0 for rows with no or only relevant labels
+    misordered = ((1 - relevant) * relevant_below).sum(axis=1)
+    lrl = np.zeros(n_samples)
+    lrl[partial] = misordered[partial] / (
+        n_relevant[partial] * (n_labels - n_relevant[partial])
+    )
+
+    # Coverage is the number of labels scored at least as high as the lowest relevant
+    lowest = np.argmax(relevant, axis=1)[:, None]
+    coverage = np.where(
+        n_relevant > 0, np.take_along_axis(n_above, lowest, axis=1)[:, 0], 0
+    )
+    return float(lrap.mean()), float(lrl.mean()), float(coverage.mean())
+
+
+def _micro_curve_metrics(y_true: np.ndarray, y_prob: np.ndarray) -> tuple[float, float]:
+    """Micro-averaged ROC AUC and average precision from one sort of all scores.
+
+    :param y_true: Boolean labels.
+    :type y_true: np.ndarray
+    :param y_prob: Scores.
+    :type y_prob: np.ndarray
+    :raises ValueError: If all labels are of the same class.
+    :return: ROC AUC and average precision.
+    :rtype: tuple[float, float]
+    """
+    order = np.argsort(-y_prob.ravel(), kind="mergesort")
+    scores = y_prob.ravel()[order]
+    labels = y_true.ravel()[order]
+
+    # Cumulative counts at the last position of every distinct score
+    thresholds = np.r_[np.flatnonzero(np.diff(scores)), len(scores) - 1]
+    tps = np.cumsum(labels)[thresholds]
+    fps = thresholds + 1 - tps
+    if tps[-1] == 0 or fps[-1] == 0:
+        raise ValueError(
+            "Only one class present in y_true. ROC AUC score is not defined in that "
+            "case."
+        )
+
+    tpr = np.r_[0, tps / tps[-1]]
+    fpr = np.r_[0, fps / fps[-1]]
+    auroc = np.trapz(tpr, fpr)
+    ap = np.sum(np.diff(tpr) * tps / (tps + fps))
+    return float(auroc), float(ap)
+
+
+def multilabel_metrics(
+    y_true: np.ndarray, y_prob: np.ndarray, y_pred: np.ndarray
+) -> MultiLabelMetrics:
+    """Compute every evaluation metric of a multi-label classifier.
+
+    The confusion counts are computed once from the predictions, and the scores are
+    sorted once per row for the ranking metrics and once overall for the curve
+    metrics, instead of validating and sorting them again for every sklearn metric.
+
+    :param y_true: Binary labels of shape (n_samples, n_labels).
+    :type y_true: np.ndarray
+    :param y_prob: Predicted scores of shape (n_samples, n_labels).
+    :type y_prob: np.ndarray
+    :param y_pred: Binary predictions of shape (n_samples, n_labels).
+    :type y_pred: np.ndarray
+    :return: Metrics of the predictions.
+    :rtype: MultiLabelMetrics
+    """
+    y_true = np.asarray(y_true).astype(bool)
+    y_pred = np.asarray(y_pred).astype(bool)
+    y_prob = np.asarray(y_prob)
+
+    both = y_true & y_pred
+    either = y_true | y_pred
+    tp = both.sum(axis=0)
+    fp = y_pred.sum(axis=0) - tp
+    fn = y_true.sum(axis=0) - tp
+    tn = len(y_true) - tp - fp - fn
+    mlm = np.stack([tn, fp, fn, tp], axis=1).reshape(-1, 2, 2)
+    tp, fp, fn, tn = tp.sum(), fp.sum(), fn.sum(), tn.sum()
+
+    # Rows without true or predicted labels are nan, as in `godbole_accuracy`
+    jaccard_index = np.sum(both.sum(axis=1) / either.sum(axis=1)) / len(y_true)
+
+    lrap, lrl, cov_err = _ranking_metrics(y_true, y_prob)
+    auroc, ap = _micro_curve_metrics(y_true, y_prob)
+    return MultiLabelMetrics(
+        acc=float(np.mean(~(y_true ^ y_pred).any(axis=1))),
+        jaccard_index=float(jaccard_index),
+        f1=_ratio(2 * tp, 2 * tp + fp + fn),
+        rec=_ratio(tp, tp + fn),
+        prec=_ratio(tp, tp + fp),
+        spec=_ratio(tn, tn + fp),
+        lrap=lrap,
+        lrl=lrl,
+        cov_err=cov_err,
+        auroc=auroc,
+        ap=ap,
+        fill_rate_preds=float(y_pred.mean()),
+        mlm=mlm,
+    )
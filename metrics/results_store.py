@@ -0,0 +1,195 @@
+"""On-disk store of cross-validation predictions and metrics for reporting.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import multilabel_confusion_matrix
+
+OUTPUT_KEYS = ("y", "y_pred", "y_prob")
+
+
+def config_hash(config: dict) -> str:
+    """Hash the configuration a set of results was produced with.
+
+    :param config: JSON-serialisable configuration.
+    :type config: dict
+    :return: Short hex digest of the configuration.
+    :rtype: str
+    """
+    encoded = json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+class ResultsStore:
+    """Per-fold predictions and metrics keyed by model, configuration and fold.
+
+    Every fold is written to ``root_dir/<model>/<config_hash>/`` as an NPZ file with
+    the labels, predictions and probabilities, and a one-row Parquet file with the
+    scalar metrics. Reports can then be rebuilt without retraining, and runs can
+    skip the folds that are already stored.
+
+    :param root_dir: Directory of the store, defaults to "results"
+    :type root_dir: str | os.PathLike, optional
+    """
+
+    def __init__(self, root_dir: str | os.PathLike = "results") -> None:
+        self.root_dir = root_dir
+
+    def has_fold(self, model: str, config: dict, fold: int) -> bool:
+        """Check whether a fold is stored.
+
+        :param model: Model name.
+        :type model: str
+        :param config: Configuration of the run.
+        :type config: dict
+        :param fold: Fold index.
+        :type fold: int
+        :return: Whether both files of the fold exist.
+        :rtype: bool
+        """
+        npz_pth, parquet_pth = self._fold_paths(model, config, fold)
+        return os.path.exists(npz_pth) and os.path.exists(parquet_pth)
+
+    def save_fold(self, model: str, config: dict, fold: int, res: dict) -> None:
+        """Store the predictions and scalar metrics of a fold.
+
+        :param model: Model name.
+        :type model: str
+        :param config: Configuration of the run.
+        :type config: dict
+        :param fold: Fold index.
+        :type fold: int
+        :param res: Fold results with ``y``, ``y_pred``, ``y_prob`` and metrics.
+            Other array values, such as confusion matrices, are not stored.
+        :type res: dict
+        """
+        config_dir = self._config_dir(model, config)
+        if not os.path.exists(config_dir):
+            os.makedirs(config_dir)
+            with open(
+                os.path.join(config_dir, "config.json"), "w", encoding="utf-8"
+            ) as f:
+                json.dump(config, f, indent=2, sort_keys=True, default=str)
+
+        npz_pth, parquet_pth = self._fold_paths(model, config, fold)
+        np.savez(f"{npz_pth}.tmp.npz", **{k: np.asarray(res[k]) for k in OUTPUT_KEYS})
+        os.replace(f"{npz_pth}.tmp.npz", npz_pth)
+        metrics = {
+            key: float(value)
+            for key, value in res.items()
+            if key not in OUTPUT_KEYS and np.ndim(value) == 0
+        }
+        pd.DataFrame([metrics]).to_parquet(f"{parquet_pth}.tmp", index=False)
+        os.replace(f"{parquet_pth}.tmp", parquet_pth)
+
+    def save(self, model: str, config: dict, results: dict[str, list]) -> None:
+        """Store every fold of cross-validation results.
+
+        :param model: Model name.
+        :type model: str
+        :param config: Configuration of the run.
+        :type config: dict
+        :param results: Dictionary of per-fold lists, as returned by the training
+            functions.
+        :type results: dict[str, list]
+        """
+        for fold in range(len(results["y"])):
+            res = {
+                key: value[fold]
+                for key, value in results.items()
+                if isinstance(value, list)
+            }
+            self.save_fold(model, config, fold, res)
+
+    def load_fold(self, model: str, config: dict, fold: int) -> dict:
+        """Load the predictions and metrics of a fold.
+
+        :param model: Model name.
+        :type model: str
+        :param config: Configuration of the run.
+        :type config: dict
+        :param fold: Fold index.
+        :type fold: int
+        :return: Fold results with the same keys as when saved, except the arrays
+            that are not stored.
+        :rtype: dict
+        """
+        npz_pth, parquet_pth = self._fold_paths(model, config, fold)
+        res = pd.read_parquet(parquet_pth).iloc[0].to_dict()
+        with np.load(npz_pth) as f:
+            res.update({key: f[key] for key in OUTPUT_KEYS})
+        return res
+
+    def load(self, model: str, config: dict) -> dict[str, list]:
+        """Load all stored folds of a model in fold order.
+
+        :param model: Model name.
+        :type model: str
+        :param config: Configuration of the run.
+        :type config: dict
+        :raises FileNotFoundError: If no fold of the model is stored.
+        :return: Dictionary of per-fold lists, with the multilabel confusion matrix
+            of the last fold under ``mlm``.
+        :rtype: dict[str, list]
+        """
+        folds = []
+        while self.has_fold(model, config, len(folds)):
+            folds.append(self.load_fold(model, config, len(folds)))
+        if not folds:
+            raise FileNotFoundError(
+                f"No results for {model} in {self._config_dir(model, config)}"
+            )
+        results = {key: [res[key] for res in folds] for key in folds[0]}
+        results["mlm"] = multilabel_confusion_matrix(
+            folds[-1]["y"], folds[-1]["y_pred"]
+        )
+        return results
+
+    def _config_dir(self, model: str, config: dict) -> str:
+        return os.path.join(self.root_dir, model, config_hash(config))
+
+    def _fold_paths(self, model: str, config: dict, fold: int) -> tuple[str, str]:
+        config_dir = self._config_dir(model, config)
+        return (
+            os.path.join(config_dir, f"fold_{fold}.npz"),
+            os.path.join(config_dir, f"fold_{fold}.parquet"),
+        )
+
+
+def summary_frame(results: dict[str, dict[str, list]]) -> pd.DataFrame:
+    """Tabulate the mean and standard deviation of every metric per model.
+
+    :param results: Cross-validation results per model name.
+    :type results: dict[str, dict[str, list]]
+    :return: One row per model, with a ``<metric>`` and ``<metric>_std`` column per
+        scalar metric.
+    :rtype: pd.DataFrame
+    """
+    rows = []
+    for model_name, result in results.items():
+        row = {"model": model_name}
+        for metric, values in result.items():
+            if metric in ["y_pred", "y", "y_prob", "mlm"]:
+                continue
+            row[metric] = np.mean(values)
+            row[f"{metric}_std"] = np.std(values)
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def fold_outputs(result: dict[str, list]) -> list[dict[str, np.ndarray]]:
+    """Split cross-validation results into the per-fold outputs `k_fold_roc_curve`
+    expects.
+
+    :param result: Cross-validation results of a model.
+    :type result: dict[str, list]
+    :return: Labels, predictions and probabilities of every fold.
+    :rtype: list[dict[str, np.ndarray]]
+    """
+    return [
+        {key: result[key][i] for key in OUTPUT_KEYS} for i in range(len(result["y"]))
+    ]
@@ -0,0 +1,184 @@
+"""Vectorised search for the decision threshold that maximises the F1 score.
+"""
+
+import numpy as np
+
+
+def _rowwise_f1_curve(
+    y_true: np.ndarray, y_prob: np.ndarray, thresholds: np.ndarray
+) -> np.ndarray:
+    """Mean over rows of the per-row F1 of ``y_prob > t`` for every threshold.
+
+    The F1 of a row is ``2 tp / (n_true + n_pred)``, and 0 when both are 0. As the
+    threshold grows, a row only changes when it passes one of the row's own values.
+    Each row is therefore sorted once, its F1 is computed for every number of
+    dropped values, and the changes are accumulated at the thresholds where they
+    happen.
+
+    :param y_true: Binary labels of shape (n_rows, n_cols).
+    :type y_true: np.ndarray
+    :param y_prob: Scores of shape (n_rows, n_cols).
+    :type y_prob: np.ndarray
+    :param thresholds: Sorted thresholds.
+    :type thresholds: np.ndarray
+    :return: Mean F1 for every threshold.
+    :rtype: np.ndarray
+    """
+    n_rows, n_cols = y_prob.shape
+    order = np.argsort(y_prob, axis=1, kind="stable")
+    values = np.take_along_axis(y_prob, order, axis=1)
+    labels = np.take_along_axis(y_true, order, axis=1).astype(np.int64)
+
+    # F1 of every row after dropping its d smallest values, for d = 0..n_cols
+    n_true = labels.sum(axis=1, keepdims=True)
+    dropped_tp = np.concatenate(
+        [np.zeros((n_rows, 1), dtype=np.int64), np.cumsum(labels, axis=1)], axis=1
+    )
+    tp = n_true - dropped_tp
+    n_pred = n_cols - np.arange(n_cols + 1)
+    denom = n_true + n_pred
+    f1 = np.divide(2 * tp, denom, out=np.zeros(denom.shape), where=denom > 0)
+
+    # The d-th smallest value is dropped from the first threshold >= it onwards
+    pos = np.searchsorted(thresholds, values, side="left")
+    changes = np.bincount(
+        pos.ravel(), weights=np.diff(f1, axis=1).ravel(), minlength=len(thresholds) + 1
+    )
+    curve = f1[:, 0].sum() + np.cumsum(changes[: len(thresholds)])
+    return curve / n_rows
+
+
+def f1_curve(
+    y_true: np.ndarray,
+    y_prob: np.ndarray,
+    thresholds: np.ndarray,
+    average: str = "samples",
+) -> np.ndarray:
+    """F1 score of ``y_prob > t`` for every threshold ``t``.
+
+    Equals ``f1_score(y_true, y_prob > t, average=average)`` for every threshold,
+    with ill-defined scores counted as 0, in O(n log n) for all thresholds.
+
+    :param y_true: Binary labels of shape (n_samples, n_labels).
+    :type y_true: np.ndarray
+    :param y_prob: Scores of shape (n_samples, n_labels).
+    :type y_prob: np.ndarray
+    :param thresholds: Sorted thresholds.
+    :type thresholds: np.ndarray
+    :param average: "samples", "micro" or "macro", defaults to "samples"
+    :type average: str, optional
+    :raises ValueError: If the average is not supported.
+    :return: F1 score for every threshold.
+    :rtype: np.ndarray
+    """
+    y_true = np.asarray(y_true)
+    y_prob = np.asarray(y_prob)
+    thresholds = np.asarray(thresholds)
+    if average == "samples":
+        return _rowwise_f1_curve(y_true, y_prob, thresholds)
+    if average == "micro":
+        return _rowwise_f1_curve(
+            y_true.reshape(1, -1), y_prob.reshape(1, -1), thresholds
+        )
+    if average == "macro":
+        # Macro F1 is the sample-averaged F1 of the transposed problem
+        return _rowwise_f1_curve(y_true.T, y_prob.T, thresholds)
+    raise ValueError(f"Unsupported average: {average}")
+
+
+def _argmax_first(scores: np.ndarray, tol: float) -> int:
+    """Index of the first score within ``tol`` of the maximum.
+
+    :param scores: Scores to search.
+    :type scores: np.ndarray
+    :param tol: Tolerance for rounding differences between equal scores.
+    :type tol: float
+    :return: Index of the first best score.
+    :rtype: int
+    """
+    return int(np.flatnonzero(scores >= scores.max() - tol)[0])
+
+
+def _search(
+    y_true: np.ndarray,
+    y_prob: np.ndarray,
+    average: str,
+    n_coarse: int | None,
+    tol: float,
+) -> tuple[float, float]:
+    """Best threshold among the scores, optionally on a coarse grid first.
+
+    :param y_true: Binary labels.
+    :type y_true: np.ndarray
+    :param y_prob: Scores.
+    :type y_prob: np.ndarray
+    :param average: "samples", "micro" or "macro".
+    :type average: str
+    :param n_coarse: Size of the coarse grid, or None for an exhaustive search.
+    :type n_coarse: int | None
+    :param tol: Tolerance for rounding differences between equal scores.
+    :type tol: float
+    :return: Best threshold and its F1 score.
+    :rtype: tuple[float, float]
+    """
+    candidates = np.unique(y_prob)
+    if n_coarse is not None and len(candidates) > n_coarse:
+        grid = candidates[np.linspace(0, len(candidates) - 1, n_coarse).astype(int)]
+        best = _argmax_first(f1_curve(y_true, y_prob, grid, average), tol)
+        low = grid[best - 1] if best > 0 else -np.inf
+        high = grid[best + 1] if best + 1 < len(grid) else np.inf
+        candidates = candidates[(candidates > low) & (candidates < high)]
+
+    scores = f1_curve(y_true, y_prob, candidates, average)
+    best = _argmax_first(scores, tol)
+    if scores[best] <= tol:
+        # No threshold beats an F1 of zero, keep the default threshold
+        return 0.0, 0.0
+    return candidates[best], scores[best].item()
+
+
+def best_threshold(
+    y_true: np.ndarray,
+    y_prob: np.ndarray,
+    average: str = "samples",
+    per_class: bool = False,
+    n_coarse: int | None = None,
+    tol: float = 1e-12,
+) -> tuple[float | np.ndarray, float | np.ndarray]:
+    """Find the threshold ``t`` maximising the F1 score of ``y_prob > t``.
+
+    The candidates are the distinct scores, as in a sweep over
+    ``sorted(y_prob.flatten())``, and ties go to the lowest threshold. If no
+    candidate reaches an F1 above 0 the threshold is 0.
+
+    :param y_true: Binary labels of shape (n_samples, n_labels).
+    :type y_true: np.ndarray
+    :param y_prob: Scores of shape (n_samples, n_labels).
+    :type y_prob: np.ndarray
+    :param average: "samples", "micro" or "macro", defaults to "samples"
+    :type average: str, optional
+    :param per_class: Search a separate threshold for every label, maximising its
+        binary F1, defaults to False
+    :type per_class: bool, optional
+    :param n_coarse: Evaluate a grid of this many candidates first and only refine
+        between the neighbours of the best one, defaults to an exhaustive search.
+        The result can miss the optimum when the F1 curve has several peaks.
+    :type n_coarse: int | None, optional
+    :param tol: Tolerance for rounding differences between equal scores, defaults
+        to 1e-12
+    :type tol: float, optional
+    :return: Best threshold and its F1 score, or arrays of both per label with
+        ``per_class``.
+    :rtype: tuple[float | np.ndarray, float | np.ndarray]
+    """
+    y_true = np.asarray(y_true)
+    y_prob = np.asarray(y_prob)
+    if not per_class:
+        return _search(y_true, y_prob, average, n_coarse, tol)
+
+    results = [
+        _search(y_true[:, [j]].T, y_prob[:, [j]].T, "micro", n_coarse, tol)
+        for j in range(y_prob.shape[1])
+    ]
+    thresholds, scores = zip(*results)
+    return np.array(thresholds), np.array(scores)
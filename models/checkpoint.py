@@ -0,0 +1,217 @@
+"""Checkpoints of the full training state, written in the background.
+"""
+
+import copy
+import hashlib
+import json
+import os
+import random
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+
+def snapshot(obj):
+    """Copy a nested training state, with every tensor copied to the host.
+
+    The copy no longer shares memory with the live training state, so it can be
+    written while training continues.
+
+    :param obj: Tensor, array, or nested dict, list or tuple of them.
+    :return: Independent copy of the object.
+    """
+    if isinstance(obj, torch.Tensor):
+        return obj.detach().to("cpu", copy=True)
+    if isinstance(obj, np.ndarray):
+        return obj.copy()
+    if isinstance(obj, dict):
+        return {key: snapshot(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(snapshot(value) for value in obj)
+    return copy.deepcopy(obj)
+
+
+def get_rng_state() -> dict:
+    """Capture the state of the Python, NumPy and PyTorch random number generators.
+
+    :return: Generator states, with the CUDA ones if CUDA is available.
+    :rtype: dict
+    """
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else None,
+    }
+
+
+def set_rng_state(state: dict) -> None:
+    """Restore the random number generators from :func:`get_rng_state`.
+
+    :param state: Generator states.
+    :type state: dict
+    """
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    # The states must be host tensors, whatever the checkpoint was mapped to
+    torch.set_rng_state(state["torch"].cpu())
+    if state["cuda"] is not None and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all([s.cpu() for s in state["cuda"]])
+
+
+class CheckpointManager:
+    """Write training checkpoints on a background thread and keep the last few.
+
+    :meth:`save` copies the state to the host on the calling thread and returns,
+    the copy is then written by a single worker thread. Every checkpoint is written
+    to a temporary file that is renamed into place, so a crash never leaves a
+    partial checkpoint behind. Errors of the worker are raised by the next call to
+    :meth:`save` or :meth:`wait`.
+
+    Every checkpoint stores a fingerprint of the run configuration, and
+    :meth:`load` refuses checkpoints written with another configuration.
+
+    :param root_dir: Directory of the checkpoints.
+    :type root_dir: str | os.PathLike
+    :param keep_last: Number of most recent checkpoints to keep, None to keep all,
+        defaults to 3.
+    :type keep_last: int | None, optional
+    :param prefix: File name prefix of the checkpoints, defaults to "checkpoint".
+    :type prefix: str, optional
+    :param config: JSON-serialisable configuration of the run, defaults to None.
+    :type config: dict | None, optional
+    """
+
+    def __init__(
+        self,
+        root_dir: str | os.PathLike,
+        keep_last: int | None = 3,
+        prefix: str = "checkpoint",
+        config: dict | None = None,
+    ) -> None:
+        self.root_dir = root_dir
+        self.keep_last = keep_last
+        self.prefix = prefix
+        self.fingerprint = hashlib.sha256(
+            json.dumps(config, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+        self.pattern = re.compile(rf"{re.escape(prefix)}_(\d+)\.pt")
+        os.makedirs(root_dir, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending: list[Future] = []
+
+    def path(self, epoch: int) -> str:
+        """Path of the checkpoint of an epoch.
+
+        :param epoch: Number of completed epochs.
+        :type epoch: int
+        :return: Checkpoint path.
+        :rtype: str
+        """
+        return os.path.join(self.root_dir, f"{self.prefix}_{epoch:04d}.pt")
+
+    def epochs(self) -> list[int]:
+        """Epochs of the checkpoints on disk, in increasing order.
+
+        :return: Checkpointed epochs.
+        :rtype: list[int]
+        """
+        epochs = []
+        for name in os.listdir(self.root_dir):
+            match = self.pattern.fullmatch(name)
+            if match is not None:
+                epochs.append(int(match.group(1)))
+        return sorted(epochs)
+
+    def latest(self) -> str | None:
+        """Path of the most recent checkpoint.
+
+        :return: Checkpoint path, or None if there is none.
+        :rtype: str | None
+        """
+        epochs = self.epochs()
+        return self.path(epochs[-1]) if epochs else None
+
+    def save(self, state: dict, epoch: int) -> None:
+        """Copy a training state and write it in the background.
+
+        :param state: Training state, e.g. from :meth:`Learner.training_state`.
+        :type state: dict
+        :param epoch: Number of completed epochs, used to name the checkpoint.
+        :type epoch: int
+        """
+        self._raise_errors(wait=False)
+        state = {**snapshot(state), "fingerprint": self.fingerprint}
+        self.pending.append(
+            self.executor.submit(self._write, state, self.path(epoch), epoch)
+        )
+
+    def load(self, path: str | None = None, map_location=None) -> dict | None:
+        """Load a checkpoint, after the pending writes are finished.
+
+        :param path: Checkpoint path, defaults to the most recent checkpoint.
+        :type path: str | None, optional
+        :param map_location: Device to load the tensors to, see ``torch.load``.
+        :raise ValueError: If the checkpoint was written with another run
+            configuration.
+        :return: Training state, or None if there is no checkpoint.
+        :rtype: dict | None
+        """
+        self.wait()
+        path = path if path is not None else self.latest()
+        if path is None:
+            return None
+        state = torch.load(path, map_location=map_location)
+        if state.get("fingerprint") != self.fingerprint:
+            raise ValueError(
+                f"Checkpoint {path} was written with another run configuration"
+            )
+        return state
+
+    def clear(self) -> None:
+        """Remove the checkpoints on disk, after the pending writes are finished."""
+        self.wait()
+        for epoch in self.epochs():
+            os.remove(self.path(epoch))
+
+    def wait(self) -> None:
+        """Wait for the pending writes and raise their errors."""
+        self._raise_errors(wait=True)
+
+    def _raise_errors(self, wait: bool) -> None:
+        """Collect the finished writes and raise the first error.
+
+        :param wait: Wait for all pending writes.
+        :type wait: bool
+        """
+        done = [future for future in self.pending if wait or future.done()]
+        self.pending = [future for future in self.pending if future not in done]
+        for future in done:
+            future.result()
+
+    def _write(self, state: dict, path: str, epoch: int) -> None:
+        """Write a checkpoint atomically and remove the old ones.
+
+        Only checkpoints of earlier epochs are removed, so a later checkpoint left
+        on disk is never pruned in favour of this one.
+
+        :param state: Host copy of the training state.
+        :type state: dict
+        :param path: Checkpoint path.
+        :type path: str
+        :param epoch: Number of completed epochs of the checkpoint.
+        :type epoch: int
+        """
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            torch.save(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        if self.keep_last is not None:
+            older = [e for e in self.epochs() if e < epoch]
+            for e in older[: max(len(older) - self.keep_last + 1, 0)]:
+                os.remove(self.path(e))
@@ -0,0 +1,246 @@
+"""Data-parallel training over worker processes on one machine with the gloo backend.
+
+Run a training function with :func:`launch`. Inside the workers, a :class:`Learner`
+detects the process group, wraps its model in ``DistributedDataParallel``, shards
+the training loader with a ``DistributedSampler`` and reduces the validation
+metrics. Callbacks and checkpoints only run on rank 0.
+"""
+
+import os
+import pickle
+import queue
+import time
+import warnings
+from contextlib import nullcontext, redirect_stdout
+from typing import Callable
+
+import numpy as np
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader, DistributedSampler, RandomSampler, Subset
+
+
+def is_distributed() -> bool:
+    """Check whether this process is part of an initialised process group.
+
+    :return: Whether training is distributed.
+    :rtype: bool
+    """
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank() -> int:
+    """Rank of this process, 0 when not distributed.
+
+    :return: Process rank.
+    :rtype: int
+    """
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size() -> int:
+    """Number of processes, 1 when not distributed.
+
+    :return: World size.
+    :rtype: int
+    """
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process() -> bool:
+    """Check whether this process is rank 0, which runs callbacks and checkpoints.
+
+    :return: Whether this process is the main process.
+    :rtype: bool
+    """
+    return get_rank() == 0
+
+
+def shard_loader(loader: DataLoader, seed: int = 0) -> DataLoader:
+    """Create a training loader over the shard of this process.
+
+    The shards come from a ``DistributedSampler``, which shuffles if the loader
+    does and pads the shards to the same number of samples. Call its
+    ``set_epoch`` every epoch for a new order.
+
+    :param loader: Training loader over the whole dataset.
+    :type loader: DataLoader
+    :param seed: Seed of the shuffling, the same on every process, defaults to 0.
+    :type seed: int, optional
+    :return: Loader over the shard, with the same batch size and collation.
+    :rtype: DataLoader
+    """
+    sampler = DistributedSampler(
+        loader.dataset,
+        shuffle=isinstance(loader.sampler, RandomSampler),
+        seed=seed,
+    )
+    return DataLoader(
+        loader.dataset,
+        batch_size=loader.batch_size,
+        sampler=sampler,
+        collate_fn=loader.collate_fn,
+        num_workers=loader.num_workers,
+        pin_memory=loader.pin_memory,
+    )
+
+
+def split_loader(loader: DataLoader) -> DataLoader:
+    """Create an evaluation loader over a contiguous part of the batches.
+
+    Unlike the ``DistributedSampler``, the parts are not padded, so every sample
+    is evaluated exactly once. The batches are those of the loader, so the batch
+    losses are the same, and concatenating the outputs in rank order gives the
+    order of the loader.
+
+    :param loader: Evaluation loader over the whole dataset, without shuffling.
+    :type loader: DataLoader
+    :return: Loader over the part of this process.
+    :rtype: DataLoader
+    """
+    batches = np.array_split(np.arange(len(loader)), get_world_size())[get_rank()]
+    start = batches[0] * loader.batch_size if len(batches) else 0
+    stop = (batches[-1] + 1) * loader.batch_size if len(batches) else 0
+    indices = range(start, min(stop, len(loader.dataset)))
+    return DataLoader(
+        Subset(loader.dataset, indices),
+        batch_size=loader.batch_size,
+        collate_fn=loader.collate_fn,
+        num_workers=loader.num_workers,
+        pin_memory=loader.pin_memory,
+    )
+
+
+def gather_arrays(array: np.ndarray | None) -> np.ndarray | None:
+    """Concatenate an array of every process in rank order, on every process.
+
+    :param array: Array of this process, None if there is nothing to gather.
+    :type array: np.ndarray | None
+    :return: Concatenated arrays, or None.
+    :rtype: np.ndarray | None
+    """
+    arrays = [None] * get_world_size()
+    dist.all_gather_object(arrays, array)
+    arrays = [array for array in arrays if array is not None]
+    return np.concatenate(arrays) if arrays else None
+
+
+def _worker(
+    rank: int,
+    world_size: int,
+    port: int,
+    num_threads: int,
+    results: mp.Queue,
+    fn: Callable,
+    args: tuple,
+):
+    """Join the process group, run the function and send back the result of rank 0.
+
+    :param rank: Rank of the process.
+    :type rank: int
+    :param world_size: Number of processes.
+    :type world_size: int
+    :param port: Port of the rendezvous store of the launching process.
+    :type port: int
+    :param num_threads: Number of intra-op threads of the process.
+    :type num_threads: int
+    :param results: Queue the result of rank 0 is sent to.
+    :type results: mp.Queue
+    :param fn: Function to run.
+    :type fn: Callable
+    :param args: Arguments of the function.
+    :type args: tuple
+    """
+    torch.set_num_threads(num_threads)
+    with open(os.devnull, "w", encoding="utf-8") as devnull:
+        # Only rank 0 reports progress
+        with redirect_stdout(devnull) if rank != 0 else nullcontext():
+            store = dist.TCPStore("127.0.0.1", port, world_size, is_master=False)
+            dist.init_process_group(
+                "gloo", store=store, rank=rank, world_size=world_size
+            )
+            try:
+                result = fn(*args)
+                if rank == 0:
+                    # Sent before the teardown, which launch bounds. Pickled by
+                    # value, tensors sent through the queue would be shared memory
+                    # that is released when this process exits.
+                    results.put(pickle.dumps(result))
+                dist.barrier()
+                # A gloo thread wakes the waiting process before it drops its
+                # reference to the finished collective, so it can be left holding
+                # the last reference to tensors Python has already freed, such as
+                # those of all_gather_object. Freeing them takes the GIL, which
+                # destroy_process_group holds while it joins the gloo threads.
+                # Sleeping releases the GIL for the threads to finish first.
+                time.sleep(0.1)
+            finally:
+                dist.destroy_process_group()
+
+
+def launch(
+    fn: Callable,
+    world_size: int,
+    *args,
+    num_threads: int | None = None,
+    start_method: str = "spawn",
+    shutdown_timeout: float = 60.0,
+):
+    """Run a function in worker processes that form a gloo process group.
+
+    With the spawn start method, the function and its arguments must be picklable,
+    and the calling script must be guarded by ``if __name__ == "__main__"``.
+
+    :param fn: Function to run in every process, e.g. one that fits a Learner.
+    :type fn: Callable
+    :param world_size: Number of processes.
+    :type world_size: int
+    :param args: Arguments of the function.
+    :param num_threads: Number of intra-op threads per process, defaults to the
+        CPU cores divided between the processes.
+    :type num_threads: int | None, optional
+    :param start_method: Multiprocessing start method, defaults to "spawn".
+    :type start_method: str, optional
+    :param shutdown_timeout: Seconds the workers have to exit once rank 0 has sent
+        its result, after which they are terminated, defaults to 60.
+    :type shutdown_timeout: float, optional
+    :return: The return value of the function on rank 0.
+    """
+    if num_threads is None:
+        num_threads = max(1, (os.cpu_count() or 1) // world_size)
+    # The store lives in this process, so that it outlives every worker
+    store = dist.TCPStore(
+        "127.0.0.1", 0, world_size, is_master=True, wait_for_workers=False
+    )
+    results = mp.get_context(start_method).Queue()
+    context = mp.start_processes(
+        _worker,
+        args=(world_size, store.port, num_threads, results, fn, args),
+        nprocs=world_size,
+        join=False,
+        start_method=start_method,
+    )
+    # Read the result while waiting, rank 0 cannot exit before it is received
+    while True:
+        try:
+            result = results.get(timeout=1.0)
+            break
+        except queue.Empty:
+            # Raises if a worker failed
+            if context.join(timeout=0):
+                result = results.get(timeout=1.0)
+                break
+    # A worker stuck tearing down its process group is stopped, see _worker
+    deadline = time.monotonic() + shutdown_timeout
+    while not context.join(timeout=1.0):
+        if time.monotonic() > deadline:
+            warnings.warn(
+                f"Workers did not exit {shutdown_timeout}s after sending the "
+                "result, terminating them"
+            )
+            for process in context.processes:
+                process.terminate()
+                process.join()
+            break
+    return pickle.loads(result)
@@ -4,17 +4,35 @@
 import abc
 import enum
 import os
+import queue
+import threading
+import time
+import warnings
+from contextlib import contextmanager, nullcontext
 from typing import Callable
 
 import numpy as np
+import pandas as pd
 import torch
+import torch.distributed as dist
 from fastprogress import master_bar, progress_bar
 from fastprogress.fastprogress import ConsoleMasterBar
 from sklearn.base import BaseEstimator
 from sklearn.metrics import f1_score
 from torch import autocast, nn, optim
 from torch.cuda.amp import GradScaler
-from torch.utils.data import DataLoader
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader, Subset
+
+from models.checkpoint import CheckpointManager, get_rng_state, set_rng_state
+from models.distributed import (
+    gather_arrays,
+    get_world_size,
+    is_distributed,
+    is_main_process,
+    shard_loader,
+    split_loader,
+)
 
 
 class CallbackRequirement(enum.Flag):
@@ -28,6 +46,8 @@ class CallbackRequirement(enum.Flag):
     :member TRAIN_LOSS: Requires the training loss.
     :member VALID_LOSS: Requires the validation loss.
     :member PERSISTENT_DATA: Requires persistent data.
+    :member PROFILE: Requires the wall time of the training phases, see
+        :class:`ProfilerCallback`.
     """
 
     NONE = 0
@@ -38,6 +58,7 @@ class CallbackRequirement(enum.Flag):
     TRAIN_LOSS = enum.auto()
     VALID_LOSS = enum.auto()
     PERSISTENT_DATA = enum.auto()
+    PROFILE = enum.auto()
 
 
 class Callback(metaclass=abc.ABCMeta):
@@ -57,11 +78,32 @@ class Callback(metaclass=abc.ABCMeta):
         :type mbar: ConsoleMasterBar
         """
 
+    def state_dict(self) -> dict:
+        """State of the callback to checkpoint, for callbacks that track one.
+
+        :return: The state of the callback.
+        :rtype: dict
+        """
+        return {}
+
+    def load_state_dict(self, state: dict):
+        """Restore the state of the callback from a checkpoint.
+
+        :param state: The state from :meth:`state_dict`.
+        :type state: dict
+        """
+        self.__dict__.update(state)
+
 
 class MetricCallback(Callback):
     """
     A callback that computes a metric on the model's validation output and label.
 
+    Metrics that can be accumulated batch by batch override :meth:`reset` and
+    :meth:`update` and drop ``VALID_OUTPUT`` and ``VALID_LABEL`` from their
+    requirements, so that the learner does not keep the full validation outputs
+    for them.
+
     :param requirements: The requirements for this callback.
     :type requirements: CallbackRequirement
     """
@@ -84,7 +126,7 @@ class MetricCallback(Callback):
         if self.__repr__() not in state_dict["metrics"]:
             state_dict["metrics"][self.__repr__()] = []
         values = self._metric(
-            state_dict, outputs["valid_output"], outputs["valid_label"]
+            state_dict, outputs.get("valid_output"), outputs.get("valid_label")
         )
 
         if isinstance(values, tuple):
@@ -110,6 +152,22 @@ class MetricCallback(Callback):
         """
         return self.__class__.__name__.replace("Callback", "").lower()
 
+    def reset(self):
+        """Reset the accumulated state before an evaluation."""
+
+    def sync(self):
+        """Sum the accumulated state over the processes of distributed training."""
+
+    def update(self, output: torch.Tensor, label: torch.Tensor):
+        """
+        Accumulate the metric state with a validation batch.
+
+        :param output: The output of the model for the batch, on the device.
+        :type output: torch.Tensor
+        :param label: The label of the batch, on the device.
+        :type label: torch.Tensor
+        """
+
     @abc.abstractmethod
     def _metric(self, state_dict: dict, valid_output, valid_label):
         """
@@ -129,6 +187,8 @@ class MetricCallback(Callback):
 class F1Callback(MetricCallback):
     """A callback that computes the F1 score of a model on a validation set.
 
+    The multi-label score is accumulated from per-label counts batch by batch.
+
     :param multilabel: Whether the targets are multi-label, defaults to True.
     :type multilabel: bool, optional
     :param threshold: Positive prediction threshold, defaults to 0.5.
@@ -139,11 +199,38 @@ class F1Callback(MetricCallback):
         super().__init__(*args, **kwargs)
         self.multilabel = multilabel
         self.threshold = threshold
+        if multilabel:
+            self.requirements = CallbackRequirement.NONE
+        self.counts = None
+
+    def reset(self):
+        self.counts = None
+
+    def sync(self):
+        # Every process takes part, also one without validation batches
+        counts = self.counts.cpu().numpy()[None] if self.counts is not None else None
+        counts = gather_arrays(counts)
+        self.counts = (
+            torch.from_numpy(counts.sum(axis=0)) if counts is not None else None
+        )
+
+    def update(self, output: torch.Tensor, label: torch.Tensor):
+        if not self.multilabel:
+            return
+        preds = output > self.threshold
+        label = label.bool()
+        tp = (preds & label).sum(dim=0)
+        counts = torch.stack([tp, preds.sum(dim=0) - tp, label.sum(dim=0) - tp])
+        self.counts = counts if self.counts is None else self.counts + counts
 
     def _metric(self, state_dict: dict, valid_output, valid_label):
         if self.multilabel:
-            valid_preds = (valid_output > self.threshold).astype(int)
-            f1 = f1_score(valid_label, valid_preds, average="weighted")
+            # Support-weighted mean of the per-label F1, as sklearn's "weighted"
+            tp, fp, fn = self.counts.cpu().numpy()
+            support = tp + fn
+            denom = 2 * tp + fp + fn
+            f1 = np.divide(2 * tp, denom, out=np.zeros(len(tp)), where=denom > 0)
+            f1 = np.average(f1, weights=support) if support.sum() > 0 else 0.0
         else:
             valid_preds = np.argmax(valid_output, axis=1)
             f1 = f1_score(valid_label, valid_output, average="weighted")
@@ -164,30 +251,291 @@ class AccuracyCallback(MetricCallback):
         super().__init__(**kwargs)
         self.threshold = threshold
         self.multilabel = multilabel
+        self.requirements = CallbackRequirement.NONE
+        self.correct, self.total = 0, 0
+
+    def reset(self):
+        self.correct, self.total = 0, 0
+
+    def sync(self):
+        counts = torch.tensor([int(self.correct), self.total])
+        dist.all_reduce(counts)
+        self.correct, self.total = counts.tolist()
+
+    def update(self, output: torch.Tensor, label: torch.Tensor):
+        """
+        Count the correct predictions of a validation batch.
+
+        :param output: The output of the model for the batch, on the device.
+        :type output: torch.Tensor
+        :param label: The label of the batch, on the device.
+        :type label: torch.Tensor
+        """
+        if self.multilabel:
+            valid_preds = (output >= self.threshold).to(label.dtype)
+        else:
+            valid_preds = torch.argmax(output, dim=1)
+        self.correct = self.correct + (valid_preds == label).sum()
+        self.total += valid_preds.numel()
 
     def _metric(self, state_dict: dict, valid_output, valid_label) -> float:
         """
-        Computes the accuracy of the model on the validation set.
+        Computes the accuracy of the model on the validation set from the counts
+        accumulated by :meth:`update`.
 
         :param state_dict: The state dictionary of the model.
         :type state_dict: dict
-        :param valid_output: The output of the model on the validation set.
-        :type valid_output: np.ndarray
-        :param valid_label: The labels of the validation set.
-        :type valid_label: np.ndarray
+        :param valid_output: Not used, the accuracy is accumulated batch by batch.
+        :type valid_output: np.ndarray | None
+        :param valid_label: Not used, the accuracy is accumulated batch by batch.
+        :type valid_label: np.ndarray | None
         :return: The accuracy of the model on the validation set.
         :rtype: float
         """
-        if self.multilabel:
-            valid_preds = (valid_output >= self.threshold).astype(int)
-            valid_acc = np.sum(valid_preds == valid_label) / (
-                valid_preds.shape[0] * valid_preds.shape[1]
-            )
-        else:
-            valid_acc = np.sum(np.argmax(valid_output, axis=1) == valid_label) / len(
-                valid_label
-            )
-        return valid_acc
+        return int(self.correct) / self.total
+
+
+def subsample_loader(
+    loader: DataLoader, size: int | float, seed: int = 0
+) -> DataLoader:
+    """Create a loader over a fixed random subset of the samples of a loader.
+
+    :param loader: Data loader to subsample.
+    :type loader: DataLoader
+    :param size: Number of samples, or fraction of the samples if a float.
+    :type size: int | float
+    :param seed: Seed of the subset, defaults to 0.
+    :type seed: int, optional
+    :return: Data loader over the subset, with the same batch size and collation.
+    :rtype: DataLoader
+    """
+    num_samples = len(loader.dataset)
+    if isinstance(size, float):
+        size = max(1, round(size * num_samples))
+    rng = np.random.default_rng(seed)
+    indices = np.sort(rng.choice(num_samples, min(size, num_samples), replace=False))
+    return DataLoader(
+        Subset(loader.dataset, indices.tolist()),
+        batch_size=loader.batch_size,
+        collate_fn=loader.collate_fn,
+        num_workers=loader.num_workers,
+        pin_memory=loader.pin_memory,
+    )
+
+
+def _map_tensors(fn: Callable, data):
+    """Apply a function to every tensor of a possibly nested tuple or list.
+
+    :param fn: Function applied to the tensors.
+    :type fn: Callable
+    :param data: Tensor, or tuple or list of tensors.
+    :return: The data with the function applied to its tensors.
+    """
+    if isinstance(data, (tuple, list)):
+        return type(data)(_map_tensors(fn, x) for x in data)
+    return fn(data) if isinstance(data, torch.Tensor) else data
+
+
+class PrefetchLoader:
+    """
+    Wrap a data loader to prepare the next batches in a background thread.
+
+    The inputs and labels of a batch are squeezed to at most two dimensions and
+    moved to the device before the training loop asks for them. On CUDA the batches
+    are pinned and copied with ``non_blocking`` on a side stream, which the consuming
+    stream waits for. Without prefetching the batches are prepared in the calling
+    thread. The time spent waiting for batches is kept in :attr:`wait_time` and is
+    reset at the start of every iteration.
+
+    Other attributes, such as ``dataset`` and ``batch_size``, are those of the
+    wrapped loader.
+
+    :param loader: Data loader yielding (inputs, labels) batches.
+    :type loader: DataLoader
+    :param device: Device the batches are moved to.
+    :type device: torch.device
+    :param num_prefetch: Number of batches prepared ahead, 0 to prepare them when
+        asked for, defaults to 2.
+    :type num_prefetch: int, optional
+    """
+
+    def __init__(self, loader: DataLoader, device: torch.device, num_prefetch: int = 2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.num_prefetch = num_prefetch
+        self.pin_memory = self.device.type == "cuda" and num_prefetch > 0
+        self.wait_time = 0.0
+
+    def __len__(self) -> int:
+        return len(self.loader)
+
+    def __getattr__(self, name: str):
+        if name == "loader":
+            raise AttributeError(name)
+        return getattr(self.loader, name)
+
+    def __iter__(self):
+        self.wait_time = 0.0
+        if self.num_prefetch <= 0:
+            yield from self._iter_sync()
+            return
+
+        batches = queue.Queue(self.num_prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(
+            target=self._worker, args=(batches, stop), daemon=True
+        )
+        worker.start()
+        try:
+            while True:
+                start = time.perf_counter()
+                item = batches.get()
+                self.wait_time += time.perf_counter() - start
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                batch, event = item
+                if event is not None:
+                    stream = torch.cuda.current_stream(self.device)
+                    stream.wait_event(event)
+                    # The side stream's memory must not be reused while in use here
+                    _map_tensors(lambda x: x.record_stream(stream), batch)
+                yield batch
+        finally:
+            stop.set()
+            worker.join()
+
+    def _iter_sync(self):
+        """Prepare every batch in the calling thread."""
+        batches = iter(self.loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                batch = self._prepare(next(batches))
+            except StopIteration:
+                return
+            finally:
+                self.wait_time += time.perf_counter() - start
+            yield batch
+
+    def _worker(self, batches: queue.Queue, stop: threading.Event):
+        """Prepare the batches and queue them, followed by None or the exception.
+
+        :param batches: Queue of prepared batches.
+        :type batches: queue.Queue
+        :param stop: Set when the consumer stops iterating.
+        :type stop: threading.Event
+        """
+        stream = torch.cuda.Stream(self.device) if self.pin_memory else None
+        try:
+            for data in self.loader:
+                event = None
+                with torch.cuda.stream(stream) if stream is not None else nullcontext():
+                    batch = self._prepare(data)
+                    if stream is not None:
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                if not self._put(batches, (batch, event), stop):
+                    return
+        except Exception as e:
+            self._put(batches, e, stop)
+            return
+        self._put(batches, None, stop)
+
+    @staticmethod
+    def _put(batches: queue.Queue, item, stop: threading.Event) -> bool:
+        """Queue an item unless the consumer has stopped.
+
+        :param batches: Queue of prepared batches.
+        :type batches: queue.Queue
+        :param item: Item to queue.
+        :param stop: Set when the consumer stops iterating.
+        :type stop: threading.Event
+        :return: Whether the item was queued.
+        :rtype: bool
+        """
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prepare(self, data: tuple) -> tuple:
+        """Squeeze a batch and move it to the device.
+
+        :param data: Inputs and labels of the batch.
+        :type data: tuple
+        :return: Inputs and labels on the device.
+        :rtype: tuple
+        """
+        inputs, labels = data
+        inputs = inputs.squeeze() if len(inputs.shape) > 2 else inputs
+        labels = labels.squeeze() if len(labels.shape) > 2 else labels
+        return _map_tensors(self._to_device, (inputs, labels))
+
+    def _to_device(self, x: torch.Tensor) -> torch.Tensor:
+        """Move a tensor to the device, through pinned memory on CUDA.
+
+        :param x: Tensor on the host.
+        :type x: torch.Tensor
+        :return: Tensor on the device.
+        :rtype: torch.Tensor
+        """
+        if self.pin_memory and x.layout == torch.strided and not x.is_pinned():
+            x = x.pin_memory()
+        return x.to(self.device, non_blocking=self.pin_memory)
+
+
+class CompiledModule(nn.Module):
+    """
+    Run a model through ``torch.compile``, falling back to eager execution if the
+    compilation fails, either when wrapping the model or when a call is compiled.
+    Only errors of dynamo and inductor fall back, errors of the model are raised.
+
+    The compiled module shares its parameters with the wrapped model, so the model
+    can still be saved and loaded directly.
+
+    :param module: The model to compile.
+    :type module: nn.Module
+    :param compile_kwargs: Keyword arguments for ``torch.compile``.
+    :type compile_kwargs: dict
+    """
+
+    def __init__(self, module: nn.Module, **compile_kwargs):
+        super().__init__()
+        self.module = module
+        try:
+            self.compiled = torch.compile(module, **compile_kwargs)
+        except Exception as e:
+            warnings.warn(f"torch.compile is not available, running eagerly: {e}")
+            self.compiled = None
+            return
+        # Inductor errors are usually wrapped in dynamo's BackendCompilerFailed
+        from torch._dynamo.exc import TorchDynamoException
+        from torch._inductor.exc import (
+            CppCompileError,
+            CUDACompileError,
+            LoweringException,
+        )
+
+        self.compile_errors = (
+            TorchDynamoException,
+            CppCompileError,
+            CUDACompileError,
+            LoweringException,
+        )
+
+    def forward(self, *args, **kwargs):
+        if self.compiled is not None:
+            try:
+                return self.compiled(*args, **kwargs)
+            except self.compile_errors as e:
+                warnings.warn(f"torch.compile failed, running eagerly: {e}")
+                self.compiled = None
+        return self.module(*args, **kwargs)
 
 
 class Learner(BaseEstimator):
@@ -201,6 +549,9 @@ class Learner(BaseEstimator):
         scaler: GradScaler = None,
         metrics: list[MetricCallback] = None,
         cbs: list[Callback] = None,
+        compile_model: bool = False,
+        autocast_dtype: torch.dtype | None = None,
+        prefetch: int = 0,
     ) -> None:
         """Learner class for training PyTorch models with callbacks.
 
@@ -220,23 +571,64 @@ class Learner(BaseEstimator):
         :type metrics: list[MetricCallback], optional
         :param cbs: List of callbacks, defaults to None.
         :type cbs: list[Callback], optional
+        :param compile_model: Run the model through ``torch.compile``, with an eager
+            fallback if it fails, defaults to False.
+        :type compile_model: bool, optional
+        :param autocast_dtype: Data type of the mixed precision training steps, e.g.
+            ``torch.bfloat16`` on CPU, defaults to bfloat16 on CUDA and full
+            precision otherwise.
+        :type autocast_dtype: torch.dtype | None, optional
+        :param prefetch: Number of batches prepared ahead in a background thread, 0
+            to prepare them in the training loop, see :class:`PrefetchLoader`,
+            defaults to 0.
+        :type prefetch: int, optional
         """
         self.model = model
         self.criterion = criterion
         self.optimizer = optimizer
         self.scaler = scaler
         self.scheduler = scheduler
+        self.autocast_dtype = autocast_dtype
+        self.prefetch = prefetch
+        self.compile_model = compile_model
         if device == torch.device("cuda") and torch.cuda.is_available():
             self.device = device
             if self.scaler is None:
                 self.scaler = GradScaler()
+            if self.autocast_dtype is None:
+                self.autocast_dtype = torch.bfloat16
             self.model = self.model.to(self.device)
         else:
-            self.device = torch.device("cpu")
+            # The CPU device passed in is kept as is, so that clone() accepts it
+            self.device = device if device.type == "cpu" else torch.device("cpu")
+        # Training forward passes go through the data-parallel and compiled
+        # modules, everything else uses the model itself. Evaluation bypasses the
+        # data-parallel module, whose forward pass broadcasts the buffers from rank
+        # 0 and hangs when another rank has no validation batches.
+        self.distributed = is_distributed()
+        self.data_parallel = (
+            DistributedDataParallel(self.model) if self.distributed else None
+        )
+        self.forward_model = (
+            self.data_parallel if self.data_parallel is not None else self.model
+        )
+        self.eval_model = self.model
+        if self.compile_model:
+            self.forward_model = CompiledModule(self.forward_model)
+            self.eval_model = (
+                self.forward_model
+                if self.data_parallel is None
+                else CompiledModule(self.model)
+            )
         self.state_dict = {}
         self.metrics = metrics
         self.mbar = None
         self.cbs = cbs
+        self.profilers = [
+            cb
+            for cb in cbs or []
+            if cb.requirements & CallbackRequirement.PROFILE and is_main_process()
+        ]
 
     def fit(
         self,
@@ -246,9 +638,30 @@ class Learner(BaseEstimator):
         lr: float = 1e-3,
         wd: float = 0.0,
         grad_clip: float = 0.0,
+        eval_every: int = 1,
+        eval_subsample: int | float | None = None,
+        checkpoint: CheckpointManager | None = None,
+        resume: bool = False,
+        accumulation_steps: int = 1,
     ) -> None:
         """Fits the model to the training data.
 
+        Callbacks run after every evaluation. Training stops early when a callback
+        sets ``state_dict["stop_training"]``, see :class:`EarlyStoppingCallback`.
+        With a checkpoint manager, the training state is saved after the callbacks
+        of every evaluation, and training can resume from the latest checkpoint.
+        Without resuming, the checkpoints of earlier runs are removed first.
+
+        With gradient accumulation, the gradients of several batches are averaged
+        before every optimizer step, for a larger effective batch size in the same
+        memory. The scheduler counts optimizer steps, not batches.
+
+        In distributed training, see :mod:`models.distributed`, every process
+        trains on a shard of the training loader and evaluates a part of the
+        validation loader. The losses and metrics are reduced over all processes,
+        and the callbacks and checkpoints only run on rank 0, which decides when to
+        stop.
+
         :param train_loader: The training data loader.
         :type train_loader: DataLoader
         :param test_loader: The validation data loader.
@@ -261,58 +674,232 @@ class Learner(BaseEstimator):
         :type wd: float, optional
         :param grad_clip: Gradient clipping, defaults to 0.0.
         :type grad_clip: float, optional
+        :param eval_every: Evaluate every this many epochs, and always after the
+            last one, defaults to 1.
+        :type eval_every: int, optional
+        :param eval_subsample: Evaluate on a fixed random subset of the validation
+            set during training, given as a number of samples or a fraction,
+            defaults to the whole set.
+        :type eval_subsample: int | float | None, optional
+        :param checkpoint: Manager the training state is saved with, defaults to
+            None.
+        :type checkpoint: CheckpointManager | None, optional
+        :param resume: Resume from the latest checkpoint of the manager if there is
+            one, defaults to False.
+        :type resume: bool, optional
+        :param accumulation_steps: Number of batches per optimizer step, the last
+            step of an epoch takes the remaining batches, defaults to 1.
+        :type accumulation_steps: int, optional
+        :raise ValueError: If the number of accumulation steps is less than 1, or
+            the checkpoint to resume from was written with another configuration.
         """
+        if accumulation_steps < 1:
+            raise ValueError("accumulation_steps must be at least 1")
         if self.optimizer is None:
             self.optimizer = optim.AdamW(
                 self.model.parameters(), lr=lr, weight_decay=wd
             )
 
+        if self.distributed:
+            train_loader = shard_loader(train_loader)
+        # The progress of this process, over its shard under distributed training
+        self.state_dict["batch_size"] = train_loader.batch_size
+        self.state_dict["dataset_len"] = len(train_loader.sampler)
+        self.state_dict["batches_per_epoch"] = len(train_loader)
+
         if self.scheduler is None:
             self.scheduler = optim.lr_scheduler.OneCycleLR(
                 self.optimizer,
                 max_lr=lr,
-                steps_per_epoch=int(
-                    np.ceil(len(train_loader.dataset) / train_loader.batch_size)
-                ),
+                steps_per_epoch=int(np.ceil(len(train_loader) / accumulation_steps)),
                 epochs=num_epochs,
             )
         self.state_dict["train_loss"] = []
         self.state_dict["valid_loss"] = []
         self.state_dict["num_epochs"] = num_epochs
-        self.state_dict["batch_size"] = train_loader.batch_size
-        self.state_dict["dataset_len"] = len(train_loader.dataset)
+        self.state_dict["accumulation_steps"] = accumulation_steps
         self.state_dict["epoch"] = 0
         self.state_dict["metrics"] = {}
-        self.mbar = master_bar(range(num_epochs))
-
-        for epoch in self.mbar:
-            self.state_dict["epoch"] = epoch + 1
-            train_loss = self._train_epoch(
-                self.model,
-                train_loader,
-                self.criterion,
-                self.optimizer,
-                self.scheduler,
-                self.device,
-                self.scaler,
-            )
+        self.state_dict["valid_epochs"] = []
+        self.state_dict["stop_training"] = False
+        start_epoch = 0
+        if not resume and checkpoint is not None and is_main_process():
+            checkpoint.clear()
+        if resume and checkpoint is not None:
+            state = checkpoint.load(map_location=self.device)
+            if state is not None:
+                self.load_training_state(state)
+                self.state_dict["num_epochs"] = num_epochs
+                start_epoch = state["epoch"]
+                if self.state_dict["stop_training"]:
+                    return
+        self.mbar = master_bar(range(start_epoch, num_epochs))
+        if eval_subsample is not None:
+            test_loader = subsample_loader(test_loader, eval_subsample)
+        # Full validation outputs are only kept for the callbacks that need them
+        keep_outputs = any(
+            cb.requirements
+            & (CallbackRequirement.VALID_OUTPUT | CallbackRequirement.VALID_LABEL)
+            for cb in (self.cbs or []) + (self.metrics or [])
+        )
 
-            val_loss, outputs, labels = self.evaluate(test_loader)
-            if self.cbs is not None:
-                for cb in self.cbs:
-                    if (
-                        cb.requirements & CallbackRequirement.TRAIN_LOSS
-                        or cb.requirements & CallbackRequirement.VALID_LOSS
-                        or cb.requirements & CallbackRequirement.PERSISTENT_DATA
-                    ):
-                        cb(
-                            self.state_dict,
-                            self.mbar,
-                            train_loss=train_loss,
-                            valid_loss=val_loss,
-                            outputs=outputs,
-                            labels=labels,
-                        )
+        train_losses = []
+        for profiler in self.profilers:
+            profiler.start()
+        try:
+            for epoch in self.mbar:
+                self.state_dict["epoch"] = epoch + 1
+                if self.distributed:
+                    train_loader.sampler.set_epoch(epoch)
+                train_losses.append(
+                    self._train_epoch(
+                        self.forward_model,
+                        train_loader,
+                        self.criterion,
+                        self.optimizer,
+                        self.scheduler,
+                        self.device,
+                        self.scaler,
+                        self.autocast_dtype,
+                        accumulation_steps,
+                    )
+                )
+                if (epoch + 1) % eval_every != 0 and epoch + 1 != num_epochs:
+                    continue
+
+                # Callbacks see the training losses of every epoch since the last one
+                train_loss = np.concatenate(train_losses)
+                self.state_dict["train_loss"] = train_loss
+                train_losses = []
+                self.state_dict["valid_epochs"].append(epoch + 1)
+                with self._phase("evaluate"):
+                    val_loss, outputs, labels = self.evaluate(test_loader, keep_outputs)
+                if self.cbs is not None and is_main_process():
+                    for cb in self.cbs:
+                        if (
+                            cb.requirements & CallbackRequirement.TRAIN_LOSS
+                            or cb.requirements & CallbackRequirement.VALID_LOSS
+                            or cb.requirements & CallbackRequirement.PERSISTENT_DATA
+                        ):
+                            with self._phase(f"callback:{cb.__class__.__name__}"):
+                                cb(
+                                    self.state_dict,
+                                    self.mbar,
+                                    train_loss=train_loss,
+                                    valid_loss=val_loss,
+                                    outputs=outputs,
+                                    labels=labels,
+                                )
+                if self.distributed:
+                    # Rank 0 decides for every process
+                    stop = [self.state_dict["stop_training"]]
+                    dist.broadcast_object_list(stop, src=0)
+                    self.state_dict["stop_training"] = stop[0]
+                if checkpoint is not None and is_main_process():
+                    checkpoint.save(self.training_state(), epoch + 1)
+                if self.state_dict["stop_training"]:
+                    break
+        finally:
+            for profiler in self.profilers:
+                profiler.stop()
+        if checkpoint is not None:
+            checkpoint.wait()
+
+    def _phase(self, name: str):
+        """Time a phase of training for the profiling callbacks, if there are any.
+
+        :param name: Name of the phase.
+        :type name: str
+        :return: Context manager around the phase.
+        """
+        return self._timed_phase(name) if self.profilers else nullcontext()
+
+    @contextmanager
+    def _timed_phase(self, name: str):
+        """Record the wall time of a phase, waiting for the device around it.
+
+        :param name: Name of the phase, also labelling it in ``torch.profiler``
+            traces.
+        :type name: str
+        """
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        start = time.perf_counter()
+        with torch.profiler.record_function(name):
+            yield
+        if self.device.type == "cuda":
+            torch.cuda.synchronize(self.device)
+        elapsed = time.perf_counter() - start
+        for profiler in self.profilers:
+            profiler.record(name, elapsed)
+
+    def _timed_iter(self, name: str, iterable):
+        """Time every fetch of an iterable as a phase.
+
+        :param name: Name of the phase.
+        :type name: str
+        :param iterable: Iterable to fetch from.
+        :return: The iterable, or a generator timing its fetches.
+        """
+        if not self.profilers:
+            return iterable
+
+        def timed():
+            iterator = iter(iterable)
+            while True:
+                with self._phase(name):
+                    item = next(iterator, StopIteration)
+                if item is StopIteration:
+                    return
+                yield item
+
+        return timed()
+
+    def training_state(self) -> dict:
+        """Capture everything needed to resume training after an evaluation.
+
+        :return: The states of the model, optimizer, scheduler, scaler, callbacks
+            and random number generators, the number of completed epochs and the
+            metric history.
+        :rtype: dict
+        """
+        return {
+            "model": self.model.state_dict(),
+            "optimizer": self.optimizer.state_dict(),
+            "scheduler": (
+                self.scheduler.state_dict() if self.scheduler is not None else None
+            ),
+            "scaler": self.scaler.state_dict() if self.scaler is not None else None,
+            "epoch": self.state_dict["epoch"],
+            # The validation outputs are recomputed, not resumed
+            "history": {
+                key: value
+                for key, value in self.state_dict.items()
+                if key not in ["valid_output", "valid_label"]
+            },
+            "callbacks": [cb.state_dict() for cb in self.cbs or []],
+            "rng": get_rng_state(),
+        }
+
+    def load_training_state(self, state: dict) -> None:
+        """Restore a training state from :meth:`training_state`.
+
+        The optimizer and scheduler are created by :meth:`fit` before their states
+        are restored.
+
+        :param state: The training state.
+        :type state: dict
+        """
+        self.model.load_state_dict(state["model"])
+        self.optimizer.load_state_dict(state["optimizer"])
+        if self.scheduler is not None and state["scheduler"] is not None:
+            self.scheduler.load_state_dict(state["scheduler"])
+        if self.scaler is not None and state["scaler"] is not None:
+            self.scaler.load_state_dict(state["scaler"])
+        self.state_dict.update(state["history"])
+        for cb, cb_state in zip(self.cbs or [], state["callbacks"]):
+            cb.load_state_dict(cb_state)
+        set_rng_state(state["rng"])
 
     def _train_epoch(
         self,
@@ -323,9 +910,23 @@ class Learner(BaseEstimator):
         scheduler: optim.lr_scheduler._LRScheduler,
         device: torch.device,
         scaler: GradScaler = None,
+        autocast_dtype: torch.dtype | None = None,
+        accumulation_steps: int = 1,
     ) -> np.ndarray:
         """Train the model for one epoch.
 
+        The forward pass and loss run under autocast when a data type is given, on
+        CPU as well as on CUDA. The backward pass then runs in the data types of the
+        forward operations. The GradScaler is only used on CUDA, bfloat16 has the
+        range of float32 and needs no loss scaling. The time spent waiting for
+        batches is appended to the ``train_data_wait`` metric.
+
+        The optimizer and scheduler step after every ``accumulation_steps``
+        batches, and after the last batch. Every loss is divided by the number of
+        batches of its step, so the gradient is their mean. In distributed
+        training, the gradients are only reduced over the processes on the last
+        batch of a step.
+
         :param model: The PyTorch model to train.
         :type model: nn.Module
         :param train_loader: The training data loader.
@@ -340,80 +941,137 @@ class Learner(BaseEstimator):
         :type device: torch.device
         :param scaler: GradScaler for mixed precision training, defaults to None.
         :type scaler: GradScaler, optional
+        :param autocast_dtype: Data type of the mixed precision forward pass,
+            defaults to full precision.
+        :type autocast_dtype: torch.dtype | None, optional
+        :param accumulation_steps: Number of batches per optimizer step, defaults
+            to 1.
+        :type accumulation_steps: int, optional
         :return: The training losses for each batch.
         :rtype np.ndarray
         """
         model.train()
-        losses = []
-        for data in progress_bar(train_loader, parent=self.mbar):
-            # Mixed Precision if available
-            if scaler is not None and device.type == "cuda":
-                with autocast(device.type, torch.bfloat16):
-                    inputs, labels = data
-                    inputs = inputs.squeeze() if len(inputs.shape) > 2 else inputs
-                    labels = labels.squeeze() if len(labels.shape) > 2 else labels
-                    inputs = inputs.to(device)
-                    labels = labels.to(device)
-
+        # Losses stay on the device until the end of the epoch to avoid a host
+        # synchronisation per batch
+        num_batches = len(train_loader)
+        losses = torch.empty(num_batches, device=device)
+        use_scaler = scaler is not None and device.type == "cuda"
+        opt.zero_grad(set_to_none=True)
+        train_loader = PrefetchLoader(train_loader, device, self.prefetch)
+        batches = self._timed_iter("data", progress_bar(train_loader, parent=self.mbar))
+        for i, (inputs, labels) in enumerate(batches):
+            # The last step of the epoch can have fewer batches
+            step_start = i - i % accumulation_steps
+            step_size = min(accumulation_steps, num_batches - step_start)
+            is_step = i + 1 == step_start + step_size
+            # The gradients are only reduced over the processes before a step
+            with (
+                self.data_parallel.no_sync()
+                if self.data_parallel is not None and not is_step
+                else nullcontext()
+            ):
+                # Mixed Precision if requested
+                with self._phase("forward"), (
+                    autocast(device.type, autocast_dtype)
+                    if autocast_dtype is not None
+                    else nullcontext()
+                ):
                     output = model(inputs)
                     output = output.unsqueeze(0) if len(output.shape) == 1 else output
                     loss = criterion(output, labels)
-                scaler.scale(loss).backward()
-                scaler.step(opt)
-                scaler.update()
-            else:
-                inputs, labels = data
-                inputs = inputs.squeeze() if len(inputs.shape) > 2 else inputs
-                labels = labels.squeeze() if len(labels.shape) > 2 else labels
-                inputs = inputs.to(device)
-                labels = labels.to(device)
-
-                output = model(inputs)
-                output = output.unsqueeze(0) if len(output.shape) == 1 else output
-                loss = criterion(output, labels)
-                loss.backward()
-                opt.step()
-            losses.append(loss.detach().cpu().numpy())
-            scheduler.step()
-
-        losses = np.array(losses)
+                with self._phase("backward"):
+                    step_loss = loss / step_size
+                    (scaler.scale(step_loss) if use_scaler else step_loss).backward()
+            losses[i] = loss.detach()
+            if is_step:
+                with self._phase("optimizer"):
+                    if use_scaler:
+                        scaler.step(opt)
+                        scaler.update()
+                    else:
+                        opt.step()
+                    opt.zero_grad(set_to_none=True)
+                with self._phase("scheduler"):
+                    scheduler.step()
+            for profiler in self.profilers:
+                profiler.step()
+
+        if self.distributed:
+            # Every process runs the same number of batches on its shard
+            dist.all_reduce(losses)
+            losses /= get_world_size()
+        losses = losses.cpu().numpy()
         self.state_dict["train_loss"] = losses
         if "train_loss" not in self.state_dict["metrics"].keys():
             self.state_dict["metrics"]["train_loss"] = []
         self.state_dict["metrics"]["train_loss"].append(np.mean(losses))
+        # Time the loop waited for batches, to spot an input pipeline bottleneck
+        if "train_data_wait" not in self.state_dict["metrics"].keys():
+            self.state_dict["metrics"]["train_data_wait"] = []
+        self.state_dict["metrics"]["train_data_wait"].append(train_loader.wait_time)
         return losses
 
     def evaluate(
-        self, test_loader: DataLoader
-    ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        self, test_loader: DataLoader, return_outputs: bool = True
+    ) -> tuple[np.ndarray, np.ndarray | None, np.ndarray | None]:
         """Evaluate the model on the validation set.
 
+        Metric callbacks are updated batch by batch. The outputs and labels are
+        written into buffers sized from the dataset and only kept when requested.
+        The time spent waiting for batches is kept as the ``valid_data_wait`` metric.
+
         :param test_loader: The validation data loader.
         :type test_loader: DataLoader
-        :return: The validation loss, outputs, and labels.
-        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray]
+        :param return_outputs: Keep and return the outputs and labels, defaults to
+            True.
+        :type return_outputs: bool, optional
+        :return: The validation loss, outputs, and labels, or None for the outputs
+            and labels if they are not kept.
+        :rtype: tuple[np.ndarray, np.ndarray | None, np.ndarray | None]
         """
         self.model.eval()
-
-        with torch.no_grad():
-            losses, outputs, labels = [], [], []
-            for data in progress_bar(test_loader, parent=self.mbar):
-                inputs, label = data
-                inputs = inputs.squeeze() if len(inputs.shape) > 2 else inputs
-                label = label.squeeze() if len(label.shape) > 2 else label
-                inputs = inputs.to(self.device)
-                label = label.to(self.device)
-
-                output = self.model(inputs)
+        metrics = self.metrics if self.metrics is not None else []
+        for metric in metrics:
+            metric.reset()
+
+        with torch.inference_mode():
+            if self.distributed:
+                test_loader = split_loader(test_loader)
+            # Everything stays on the device and is transferred once at the end
+            losses = torch.empty(len(test_loader), device=self.device)
+            outputs, labels, num_samples = None, None, 0
+            test_loader = PrefetchLoader(test_loader, self.device, self.prefetch)
+            for i, (inputs, label) in enumerate(
+                progress_bar(test_loader, parent=self.mbar)
+            ):
+                output = self.eval_model(inputs)
                 output = output.unsqueeze(0) if len(output.shape) == 1 else output
                 loss = self.criterion(output, label)
-                losses.append(loss.squeeze().detach().cpu().numpy())
-                outputs.append(output.detach().cpu().numpy())
-                labels.append(label.detach().cpu().numpy())
-
+                losses[i] = loss.squeeze()
+                for metric in metrics:
+                    metric.update(output, label)
+
+                if return_outputs:
+                    if outputs is None:
+                        dataset_len = len(test_loader.dataset)
+                        outputs = output.new_empty((dataset_len, *output.shape[1:]))
+                        labels = label.new_empty((dataset_len, *label.shape[1:]))
+                    outputs[num_samples : num_samples + len(output)] = output
+                    labels[num_samples : num_samples + len(label)] = label
+                num_samples += len(output)
+
+        losses = losses.cpu().numpy()
+        # A process may have no validation batches in distributed evaluation
+        if outputs is not None:
+            outputs = outputs[:num_samples].cpu().numpy()
+            labels = labels[:num_samples].cpu().numpy()
+        if self.distributed:
+            losses = gather_arrays(losses)
+            outputs = gather_arrays(outputs)
+            labels = gather_arrays(labels)
+            for metric in metrics:
+                metric.sync()
         losses = np.mean(losses)
-        outputs = np.concatenate(outputs)
-        labels = np.concatenate(labels)
 
         if "valid_loss" in self.state_dict:
             self.state_dict["valid_loss"] = np.append(
@@ -423,6 +1081,7 @@ class Learner(BaseEstimator):
             self.state_dict["valid_loss"] = losses.reshape(-1, 1)
 
         self.state_dict["metrics"]["valid_loss"] = np.mean(losses)
+        self.state_dict["metrics"]["valid_data_wait"] = test_loader.wait_time
         self.state_dict["valid_output"] = outputs
         self.state_dict["valid_label"] = labels
 
@@ -452,21 +1111,127 @@ class Learner(BaseEstimator):
         return outputs
 
 
+class LossHistory:
+    """
+    Loss values downsampled on the fly to a fixed number of plot points.
+
+    The values are aggregated into at most ``max_points`` buckets of equal width,
+    keeping the count, sum, minimum and maximum of the values and the sum of their
+    x positions. When all buckets are full, neighbouring buckets are merged and the
+    width doubles. The storage is allocated once, and appending costs amortised
+    constant time per value however long the history grows.
+
+    :param max_points: Maximum number of points, an even number, defaults to 512.
+    :type max_points: int, optional
+    :raise ValueError: If the number of points is not even and at least 2.
+    """
+
+    def __init__(self, max_points: int = 512):
+        if max_points < 2 or max_points % 2:
+            raise ValueError("max_points must be an even number of at least 2")
+        self.max_points = max_points
+        self.width = 1
+        self.size = 0
+        self.count = np.zeros(max_points, dtype=np.int64)
+        self.sum = np.zeros(max_points)
+        self.x_sum = np.zeros(max_points)
+        self.min = np.full(max_points, np.inf)
+        self.max = np.full(max_points, -np.inf)
+
+    def __len__(self) -> int:
+        return int(self.count[: self.size].sum())
+
+    def append(self, values: np.ndarray | float, x: np.ndarray | float):
+        """
+        Append values at the given x positions.
+
+        :param values: The values to append.
+        :type values: np.ndarray | float
+        :param x: The x position of every value.
+        :type x: np.ndarray | float
+        """
+        values = np.ravel(values).astype(float)
+        x = np.broadcast_to(np.ravel(x), values.shape).astype(float)
+        while len(values):
+            last = self.size - 1
+            if self.size and self.count[last] < self.width:
+                # Top up the last bucket
+                n = min(self.width - self.count[last], len(values))
+                self.count[last] += n
+                self.sum[last] += values[:n].sum()
+                self.x_sum[last] += x[:n].sum()
+                self.min[last] = min(self.min[last], values[:n].min())
+                self.max[last] = max(self.max[last], values[:n].max())
+            elif self.size == self.max_points:
+                self._merge()
+                continue
+            else:
+                num_full = min(self.max_points - self.size, len(values) // self.width)
+                if num_full == 0:
+                    # Open an empty bucket for the remaining values
+                    self.size += 1
+                    continue
+                n = num_full * self.width
+                buckets = slice(self.size, self.size + num_full)
+                block = values[:n].reshape(num_full, self.width)
+                self.count[buckets] = self.width
+                self.sum[buckets] = block.sum(axis=1)
+                self.x_sum[buckets] = x[:n].reshape(num_full, self.width).sum(axis=1)
+                self.min[buckets] = block.min(axis=1)
+                self.max[buckets] = block.max(axis=1)
+                self.size += num_full
+            values, x = values[n:], x[n:]
+
+    def _merge(self):
+        """Merge every pair of neighbouring buckets and double the bucket width."""
+        half = self.max_points // 2
+        self.count[:half] = self.count[0::2] + self.count[1::2]
+        self.sum[:half] = self.sum[0::2] + self.sum[1::2]
+        self.x_sum[:half] = self.x_sum[0::2] + self.x_sum[1::2]
+        self.min[:half] = np.minimum(self.min[0::2], self.min[1::2])
+        self.max[:half] = np.maximum(self.max[0::2], self.max[1::2])
+        self.count[half:] = 0
+        self.sum[half:] = 0.0
+        self.x_sum[half:] = 0.0
+        self.min[half:] = np.inf
+        self.max[half:] = -np.inf
+        self.size = half
+        self.width *= 2
+
+    def points(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The downsampled history.
+
+        :return: The mean x position, mean, minimum and maximum of every bucket.
+        :rtype: tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+        """
+        count = self.count[: self.size]
+        return (
+            self.x_sum[: self.size] / count,
+            self.sum[: self.size] / count,
+            self.min[: self.size].copy(),
+            self.max[: self.size].copy(),
+        )
+
+
 class PlotGraphCallback(Callback):
     """
     A callback that plots the training and validation loss curves during training.
 
     This callback requires the following attributes in the state_dict:
-    - train_loss: a list of training losses for each batch
-    - valid_loss: a list of validation losses for each epoch
+    - train_loss: the training losses of every batch since the last evaluation
+    - valid_loss: the validation losses of every evaluation
+    - epoch: the number of completed epochs
 
     This callback also requires the following attributes in the state_dict:
     - batch_size: the size of the training batches
-    - dataset_len: the length of the training dataset
+    - dataset_len: the number of training samples of this process per epoch
+    - batches_per_epoch: the number of training batches of this process per epoch
     - num_epochs: the number of training epochs
 
-    The callback plots the training and validation loss curves using matplotlib,
-    and updates the progress bar using the ConsoleMasterBar object.
+    The losses are kept in :class:`LossHistory` objects, so that plotting costs the
+    same at every epoch, however long the training. The mean of every downsampled
+    point is plotted, and the graph is updated using the ConsoleMasterBar object.
 
     Example usage:
 
@@ -477,16 +1242,28 @@ class PlotGraphCallback(Callback):
     learner = Learner(callbacks=[plot_callback])
     learner.train(...)
     ```
+
+    :param max_points: Maximum number of points of each curve, defaults to 512.
+    :type max_points: int, optional
     """
 
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, max_points: int = 512, **kwargs):
         super().__init__(*args, **kwargs)
         self.requirements = (
             CallbackRequirement.TRAIN_LOSS
             | CallbackRequirement.VALID_LOSS
             | CallbackRequirement.PERSISTENT_DATA
         )
-        self.values = {"train_loss": None, "valid_loss": None}
+        self.train_history = LossHistory(max_points)
+        self.valid_history = LossHistory(max_points)
+        self.num_batches = 0
+
+    def state_dict(self) -> dict:
+        return {
+            "train_history": self.train_history,
+            "valid_history": self.valid_history,
+            "num_batches": self.num_batches,
+        }
 
     def __call__(self, state_dict: dict, mbar: ConsoleMasterBar, **outputs):
         """
@@ -500,44 +1277,32 @@ class PlotGraphCallback(Callback):
         """
         if len(state_dict["train_loss"]) == 0 or len(state_dict["valid_loss"]) == 0:
             return
-        # measurements are taken every batch of len batch_size until the last batch
-        # which could be of size < batch size
-        if self.values["train_loss"] is None:
-            self.values["train_loss"] = np.array(state_dict["train_loss"])
-        else:
-            self.values["train_loss"] = np.append(
-                self.values["train_loss"], state_dict["train_loss"]
-            )
-        last_minibatch_size = len(state_dict["train_loss"]) % state_dict["batch_size"]
-        train_x = (
-            np.arange(state_dict["dataset_len"] // state_dict["batch_size"])
-            * state_dict["batch_size"]
-        )
-        train_x = np.append(train_x, [train_x[-1] + last_minibatch_size])
-        train_x = np.concatenate(
-            [
-                train_x + state_dict["dataset_len"] * i
-                for i in range(state_dict["epoch"])
-            ]
+        # The training losses are placed at the number of samples seen before their
+        # batch, and the validation loss at the end of its epoch
+        train_loss = np.ravel(state_dict["train_loss"])
+        batch_size = state_dict["batch_size"]
+        dataset_len = state_dict["dataset_len"]
+        batches_per_epoch = state_dict["batches_per_epoch"]
+        batch = self.num_batches + np.arange(len(train_loss))
+        train_x = (batch // batches_per_epoch) * dataset_len + (
+            batch % batches_per_epoch
+        ) * batch_size
+        self.num_batches += len(train_loss)
+        self.train_history.append(train_loss, train_x)
+        self.valid_history.append(
+            np.ravel(state_dict["valid_loss"])[-1], state_dict["epoch"] * dataset_len
         )
 
-        if len(state_dict["valid_loss"]) == 1:
-            valid_x = np.array([1])
-        else:
-            valid_x = (
-                np.arange(1, len(state_dict["valid_loss"]) + 1)
-                * state_dict["dataset_len"]
-            )
-        valid_loss = np.array(state_dict["valid_loss"])
-        y = np.concatenate([self.values["train_loss"], valid_loss])
-        graphs = [[train_x, self.values["train_loss"]], [valid_x, valid_loss]]
+        train_x, train_mean, _, train_max = self.train_history.points()
+        valid_x, valid_mean, _, valid_max = self.valid_history.points()
+        graphs = [[train_x, train_mean], [valid_x, valid_mean]]
         x_margin = 20.0
         y_margin = 0.05
         x_bounds = [
             0 - x_margin,
-            state_dict["dataset_len"] * state_dict["num_epochs"] + x_margin,
+            dataset_len * state_dict["num_epochs"] + x_margin,
         ]
-        y_bounds = [0.0 - y_margin, np.max(y) + y_margin]
+        y_bounds = [0.0 - y_margin, max(train_max.max(), valid_max.max()) + y_margin]
 
         mbar.update_graph(graphs, x_bounds, y_bounds)
 
@@ -584,6 +1349,9 @@ class SaveModelCallback(Callback):
         self.best_metric = np.inf
         self.requirements = CallbackRequirement.PERSISTENT_DATA
 
+    def state_dict(self) -> dict:
+        return {"best_metric": self.best_metric}
+
     def __call__(self, state_dict: dict, mbar: ConsoleMasterBar, **outputs):
         """
         Method to save the model based on the given strategy and metric.
@@ -620,6 +1388,102 @@ class SaveModelCallback(Callback):
         )
 
 
+class EarlyStoppingCallback(Callback):
+    """
+    Callback to stop training when a monitored metric has stopped improving.
+
+    :param monitor: Key of the metric in ``state_dict["metrics"]``, defaults to
+        "valid_loss".
+    :type monitor: str
+    :param mode: "min" if lower values are better, "max" if higher values are,
+        defaults to "min".
+    :type mode: str
+    :param patience: Number of evaluations without improvement before stopping,
+        defaults to 5.
+    :type patience: int
+    :param min_delta: Minimum change that counts as an improvement, defaults to 0.0.
+    :type min_delta: float
+    :param model: Model whose best weights are restored, defaults to None.
+    :type model: nn.Module, optional
+    :param restore_best_weights: Restore the weights of the best evaluation when
+        training stops or ends, defaults to False.
+    :type restore_best_weights: bool
+    :raise NotImplementedError: If the mode is not "min" or "max".
+    :raise ValueError: If the best weights should be restored without a model.
+    """
+
+    def __init__(
+        self,
+        monitor: str = "valid_loss",
+        mode: str = "min",
+        patience: int = 5,
+        min_delta: float = 0.0,
+        model: nn.Module = None,
+        restore_best_weights: bool = False,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if mode not in ["min", "max"]:
+            raise NotImplementedError("Only min and max mode is supported")
+        if restore_best_weights and model is None:
+            raise ValueError("A model is required to restore the best weights")
+        self.monitor = monitor
+        self.sign = 1 if mode == "min" else -1
+        self.patience = patience
+        self.min_delta = min_delta
+        self.model = model
+        self.restore_best_weights = restore_best_weights
+        self.best_metric = np.inf
+        self.best_epoch = 0
+        self.best_weights = None
+        self.wait = 0
+        self.requirements = CallbackRequirement.PERSISTENT_DATA
+
+    def state_dict(self) -> dict:
+        return {
+            "best_metric": self.best_metric,
+            "best_epoch": self.best_epoch,
+            "best_weights": self.best_weights,
+            "wait": self.wait,
+        }
+
+    def __call__(self, state_dict: dict, mbar: ConsoleMasterBar, **outputs):
+        """
+        Track the monitored metric and request a stop when it stops improving.
+
+        :param state_dict: The state dictionary containing the current epoch and metric values.
+        :type state_dict: dict
+        :param mbar: The console progress bar.
+        :type mbar: ConsoleMasterBar
+        :param outputs: Additional outputs.
+        """
+        value = np.ravel(state_dict["metrics"][self.monitor])[-1] * self.sign
+        if value < self.best_metric - self.min_delta:
+            self.best_metric = value
+            self.best_epoch = state_dict["epoch"]
+            self.wait = 0
+            if self.restore_best_weights:
+                self.best_weights = {
+                    key: tensor.detach().clone()
+                    for key, tensor in self.model.state_dict().items()
+                }
+        else:
+            self.wait += 1
+
+        stop = self.wait >= self.patience
+        if stop:
+            state_dict["stop_training"] = True
+            mbar.write(
+                f"Early stopping at epoch {state_dict['epoch']}, best {self.monitor}: "
+                + f"{self.best_metric * self.sign} at epoch {self.best_epoch}"
+            )
+        if (stop or state_dict["epoch"] == state_dict["num_epochs"]) and (
+            self.best_weights is not None
+        ):
+            self.model.load_state_dict(self.best_weights)
+
+
 class ModelProgressCallback(Callback):
     """
     A callback that logs the progress of a model during training and validation.
@@ -644,6 +1508,7 @@ class ModelProgressCallback(Callback):
             | CallbackRequirement.PERSISTENT_DATA
         )
         self.values = {}
+        self._header_printed = False
 
     def __call__(self, state_dict: dict, mbar: ConsoleMasterBar, **outputs):
         """
@@ -661,13 +1526,13 @@ class ModelProgressCallback(Callback):
         for metric in self.metrics:
             self.values[metric] = state_dict["metrics"][metric][-1]
 
-        if state_dict["epoch"] == 1:
+        # The first call is not at epoch 1 with eval_every > 1 or when resuming
+        if not self._header_printed:
             mbar.write([metric for metric in self.losses + self.metrics], table=True)
+            self._header_printed = True
 
         if "train_loss" in self.losses:
-            num_batches = int(
-                np.ceil(state_dict["dataset_len"] / state_dict["batch_size"])
-            )
+            num_batches = state_dict["batches_per_epoch"]
             self.values["train_loss"] = np.mean(state_dict["train_loss"][-num_batches:])
         if "valid_loss" in self.losses:
             self.values["valid_loss"] = state_dict["valid_loss"][-1]
@@ -679,3 +1544,116 @@ class ModelProgressCallback(Callback):
             ],
             table=True,
         )
+
+
+class ProfilerCallback(Callback):
+    """
+    A callback that profiles where the training loop of the learner spends its time.
+
+    The learner reports the wall time of every data fetch, forward pass with the
+    loss, backward pass, optimizer step, scheduler step, evaluation and callback
+    call. On CUDA the device is synchronised around every phase, so the times
+    include the kernels of the phase. When training stops, a summary table of the
+    phases is written to ``root_dir/profile_summary.csv``.
+
+    Optionally, a range of training steps is recorded with ``torch.profiler``, with
+    the phases as labelled ranges, and exported as a Chrome trace to
+    ``root_dir/trace.json``, to be opened in ``chrome://tracing`` or Perfetto.
+
+    :param root_dir: Directory of the summary and trace, defaults to None to only
+        keep the summary in memory.
+    :type root_dir: str | None, optional
+    :param profile_steps: Number of training steps to skip and number of steps to
+        trace with ``torch.profiler``, defaults to None for no trace.
+    :type profile_steps: tuple[int, int] | None, optional
+    :raise ValueError: If a trace is requested without a directory.
+    """
+
+    def __init__(
+        self,
+        root_dir: str | None = None,
+        profile_steps: tuple[int, int] | None = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if profile_steps is not None and root_dir is None:
+            raise ValueError("A directory is required to export the trace")
+        if root_dir is not None and not os.path.exists(root_dir):
+            os.makedirs(root_dir)
+        self.root_dir = root_dir
+        self.profile_steps = profile_steps
+        self.requirements = CallbackRequirement.PROFILE
+        self.totals = {}
+        self.profiler = None
+
+    def __call__(self, state_dict: dict, mbar: ConsoleMasterBar, **outputs):
+        """The phases are recorded by the learner, nothing to do after evaluation.
+
+        :param state_dict: The state dictionary of the training loop.
+        :type state_dict: dict
+        :param mbar: The console progress bar.
+        :type mbar: ConsoleMasterBar
+        """
+
+    def record(self, phase: str, seconds: float):
+        """
+        Add the wall time of one occurrence of a phase.
+
+        :param phase: The name of the phase.
+        :type phase: str
+        :param seconds: The wall time of the phase.
+        :type seconds: float
+        """
+        calls, total = self.totals.get(phase, (0, 0.0))
+        self.totals[phase] = (calls + 1, total + seconds)
+
+    def start(self):
+        """Start the ``torch.profiler`` trace, if requested, when training starts."""
+        if self.profile_steps is None:
+            return
+        activities = [torch.profiler.ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(torch.profiler.ProfilerActivity.CUDA)
+        skip, active = self.profile_steps
+        # The last skipped step warms the profiler up, so that the steps
+        # skip + 1 to skip + active are traced
+        self.profiler = torch.profiler.profile(
+            activities=activities,
+            schedule=torch.profiler.schedule(
+                wait=max(skip - 1, 0), warmup=min(skip, 1), active=active, repeat=1
+            ),
+            on_trace_ready=lambda prof: prof.export_chrome_trace(
+                os.path.join(self.root_dir, "trace.json")
+            ),
+        )
+        self.profiler.start()
+
+    def step(self):
+        """Advance the ``torch.profiler`` schedule after a training step."""
+        if self.profiler is not None:
+            self.profiler.step()
+
+    def stop(self):
+        """Stop the trace and write the summary table when training stops."""
+        if self.profiler is not None:
+            self.profiler.stop()
+            self.profiler = None
+        if self.root_dir is not None:
+            self.summary().to_csv(os.path.join(self.root_dir, "profile_summary.csv"))
+
+    def summary(self) -> pd.DataFrame:
+        """
+        The time spent in every phase, longest first.
+
+        :return: Number of calls, total seconds, mean milliseconds and share of the
+            total time per phase.
+        :rtype: pd.DataFrame
+        """
+        summary = pd.DataFrame.from_dict(
+            self.totals, orient="index", columns=["calls", "total_s"]
+        )
+        summary.index.name = "phase"
+        summary["mean_ms"] = summary["total_s"] / summary["calls"] * 1e3
+        summary["share"] = summary["total_s"] / summary["total_s"].sum()
+        return summary.sort_values("total_s", ascending=False)
@@ -0,0 +1,267 @@
+"""Cosine nearest-neighbour classifier for sparse TF-IDF rows.
+"""
+
+import numpy as np
+import scipy
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.preprocessing import normalize
+
+from dataset.reduction import FeatureReducer
+
+
+def _to_dense(X: np.ndarray | scipy.sparse.spmatrix) -> np.ndarray:
+    """Densify a product of a matmul, which is sparse for sparse operands.
+
+    :param X: Dense or sparse matrix.
+    :type X: np.ndarray | scipy.sparse.spmatrix
+    :return: Dense array.
+    :rtype: np.ndarray
+    """
+    return X.toarray() if scipy.sparse.issparse(X) else np.asarray(X)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Select the columns of the ``k`` highest scores of every row, best first.
+
+    :param scores: Scores of shape (n, m).
+    :type scores: np.ndarray
+    :param k: Number of columns to keep, at most m.
+    :type k: int
+    :return: Column indices of shape (n, k).
+    :rtype: np.ndarray
+    """
+    if k < scores.shape[1]:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1)
+
+
+class IVFIndex:
+    """Approximate inverted-file index over reduced features.
+
+    Training rows are projected to dense components and clustered into ``n_lists``
+    lists. A query only scores the rows of its ``n_probe`` closest lists instead of
+    the whole training set.
+
+    :param n_lists: Number of clusters, defaults to 64
+    :type n_lists: int, optional
+    :param n_probe: Number of clusters searched per query, defaults to 8
+    :type n_probe: int, optional
+    :param reducer: Reduction the clustering runs on, defaults to a randomized SVD
+        with at most 128 components.
+    :type reducer: FeatureReducer, optional
+    :param random_state: Seed of the clustering, defaults to 42
+    :type random_state: int, optional
+    """
+
+    def __init__(
+        self,
+        n_lists: int = 64,
+        n_probe: int = 8,
+        reducer: FeatureReducer = None,
+        random_state: int = 42,
+    ) -> None:
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.reducer = reducer
+        self.random_state = random_state
+
+    def fit(self, X: np.ndarray | scipy.sparse.csr_matrix) -> "IVFIndex":
+        """Cluster the training rows into inverted lists.
+
+        :param X: L2-normalised training rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :return: The fitted index.
+        :rtype: IVFIndex
+        """
+        if self.reducer is None:
+            n_components = min(128, X.shape[1] - 1)
+            self.reducer = FeatureReducer("svd", n_components, self.random_state)
+        Z = normalize(self.reducer.fit_transform(X, np.arange(X.shape[0])))
+        n_lists = min(self.n_lists, X.shape[0])
+        kmeans = MiniBatchKMeans(n_lists, random_state=self.random_state, n_init=3)
+        assignment = kmeans.fit_predict(Z)
+        self.centroids = normalize(kmeans.cluster_centers_).astype(np.float32)
+        self.members = np.argsort(assignment, kind="stable")
+        self.offsets = np.searchsorted(assignment[self.members], np.arange(n_lists + 1))
+        return self
+
+    def probe(self, X: np.ndarray | scipy.sparse.csr_matrix) -> np.ndarray:
+        """Find the closest lists of every query.
+
+        :param X: L2-normalised query rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :return: List ids of shape (n_queries, n_probe).
+        :rtype: np.ndarray
+        """
+        Z = normalize(self.reducer.transform(X))
+        n_probe = min(self.n_probe, len(self.centroids))
+        return _top_k(Z @ self.centroids.T, n_probe)
+
+    def members_of(self, list_id: int) -> np.ndarray:
+        """Training rows of a list.
+
+        :param list_id: List id.
+        :type list_id: int
+        :return: Training row indices.
+        :rtype: np.ndarray
+        """
+        return self.members[self.offsets[list_id] : self.offsets[list_id + 1]]
+
+
+class SparseCosineKNN:
+    """Multilabel k-nearest-neighbour classifier with cosine similarity.
+
+    Rows are L2-normalised so that cosine similarity is a sparse dot product, and
+    query rows are scored against the training set in blocks, keeping the top
+    ``n_neighbors`` per row with ``argpartition``. On L2-normalised TF-IDF rows the
+    neighbours are the same as with the Euclidean ``KNeighborsClassifier``. With an
+    ``index`` only its candidate rows are scored.
+
+    ``predict`` and ``predict_proba`` follow ``KNeighborsClassifier`` on a
+    multilabel target.
+
+    :param n_neighbors: Number of neighbours, defaults to 5
+    :type n_neighbors: int, optional
+    :param weights: "uniform" or "distance" weighting of the neighbour votes,
+        defaults to "uniform"
+    :type weights: str, optional
+    :param block_size: Number of query rows scored per matmul, defaults to 1024
+    :type block_size: int, optional
+    :param index: Approximate index to draw candidates from, defaults to an exact
+        search.
+    :type index: IVFIndex, optional
+    """
+
+    def __init__(
+        self,
+        n_neighbors: int = 5,
+        weights: str = "uniform",
+        block_size: int = 1024,
+        index: IVFIndex = None,
+    ) -> None:
+        if weights not in ("uniform", "distance"):
+            raise ValueError(f"weights must be uniform or distance, got {weights}")
+        self.n_neighbors = n_neighbors
+        self.weights = weights
+        self.block_size = block_size
+        self.index = index
+
+    def fit(
+        self, X: np.ndarray | scipy.sparse.csr_matrix, y: np.ndarray
+    ) -> "SparseCosineKNN":
+        """Store the normalised training rows and their labels.
+
+        :param X: Training rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :param y: Binary label matrix of shape (n_samples, n_labels).
+        :type y: np.ndarray
+        :return: The fitted classifier.
+        :rtype: SparseCosineKNN
+        """
+        self.X_ = normalize(X).astype(np.float32)
+        self.y_ = np.asarray(y)
+        if self.index is not None:
+            self.index.fit(self.X_)
+        return self
+
+    def kneighbors(
+        self, X: np.ndarray | scipy.sparse.csr_matrix
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Find the nearest training rows of every query row.
+
+        :param X: Query rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :return: Cosine distances and training row indices, both of shape
+            (n_queries, n_neighbors), closest first.
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        X = normalize(X).astype(np.float32)
+        k = min(self.n_neighbors, self.X_.shape[0])
+        similarities, neighbours = [], []
+        for start in range(0, X.shape[0], self.block_size):
+            block = X[start : start + self.block_size]
+            if self.index is None:
+                scores = _to_dense(block @ self.X_.T)
+                top = _top_k(scores, k)
+                similarities.append(np.take_along_axis(scores, top, axis=1))
+                neighbours.append(top)
+            else:
+                sims, idx = self._search_candidates(block, k)
+                similarities.append(sims)
+                neighbours.append(idx)
+        return 1 - np.concatenate(similarities), np.concatenate(neighbours)
+
+    def predict_proba(
+        self, X: np.ndarray | scipy.sparse.csr_matrix
+    ) -> list[np.ndarray]:
+        """Predict the probability of every label from the neighbour votes.
+
+        :param X: Query rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :return: One array of shape (n_queries, 2) per label, with the probabilities
+            of the label being absent and present.
+        :rtype: list[np.ndarray]
+        """
+        distances, neighbours = self.kneighbors(X)
+        votes = self.y_[neighbours].astype(np.float64)
+        if self.weights == "distance":
+            weights = 1 / np.maximum(distances, 1e-12)
+        else:
+            weights = np.ones_like(distances)
+        proba = np.einsum("nk,nkl->nl", weights, votes) / weights.sum(axis=1)[:, None]
+        return [np.column_stack([1 - p, p]) for p in proba.T]
+
+    def predict(self, X: np.ndarray | scipy.sparse.csr_matrix) -> np.ndarray:
+        """Predict the labels present in a majority of the neighbours.
+
+        :param X: Query rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :return: Binary label matrix of shape (n_queries, n_labels).
+        :rtype: np.ndarray
+        """
+        proba = np.stack([p[:, 1] for p in self.predict_proba(X)], axis=1)
+        return (proba > 0.5).astype(self.y_.dtype)
+
+    def _search_candidates(
+        self, X: np.ndarray | scipy.sparse.csr_matrix, k: int
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Score a block of query rows against the lists the index probes.
+
+        Each probed list is scored with one matmul against all queries probing it,
+        and the per-list top ``k`` are merged. Queries whose lists hold fewer than
+        ``k`` rows are scored against every row.
+
+        :param X: L2-normalised query rows.
+        :type X: np.ndarray | scipy.sparse.csr_matrix
+        :param k: Number of neighbours.
+        :type k: int
+        :return: Cosine similarities and training row indices of shape (n, k).
+        :rtype: tuple[np.ndarray, np.ndarray]
+        """
+        lists = self.index.probe(X)
+        similarities = np.full((X.shape[0], lists.shape[1] * k), -np.inf, np.float32)
+        neighbours = np.zeros(similarities.shape, dtype=np.intp)
+        for list_id in np.unique(lists):
+            members = self.index.members_of(list_id)
+            if not len(members):
+                continue
+            queries, slots = np.nonzero(lists == list_id)
+            scores = _to_dense(X[queries] @ self.X_[members].T)
+            top = _top_k(scores, min(k, len(members)))
+            cols = slots[:, None] * k + np.arange(top.shape[1])
+            similarities[queries[:, None], cols] = np.take_along_axis(scores, top, 1)
+            neighbours[queries[:, None], cols] = members[top]
+
+        top = _top_k(similarities, k)
+        similarities = np.take_along_axis(similarities, top, axis=1)
+        neighbours = np.take_along_axis(neighbours, top, axis=1)
+        short = np.flatnonzero(np.isinf(similarities).any(axis=1))
+        if len(short):
+            scores = _to_dense(X[short] @ self.X_.T)
+            top = _top_k(scores, k)
+            similarities[short] = np.take_along_axis(scores, top, axis=1)
+            neighbours[short] = top
+        return similarities, neighbours
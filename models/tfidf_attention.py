@@ -2,10 +2,55 @@
 """
 
 import torch
+import torch.nn.functional as F
 from torch import nn
 from torch.nn.utils.parametrizations import weight_norm
 
 
+def is_sparse_input(x: torch.Tensor | tuple[torch.Tensor, ...]) -> bool:
+    """Check whether an input is a sparse tensor or an (indices, offsets, values) bag.
+
+    :param x: Model input.
+    :type x: torch.Tensor | tuple[torch.Tensor, ...]
+    :return: Whether the input should go through :func:`sparse_linear`.
+    :rtype: bool
+    """
+    return isinstance(x, tuple) or x.layout != torch.strided
+
+
+def sparse_linear(
+    x: torch.Tensor | tuple[torch.Tensor, torch.Tensor, torch.Tensor],
+    weight: torch.Tensor,
+    bias: torch.Tensor | None = None,
+) -> torch.Tensor:
+    """Apply a linear projection whose cost scales with the non-zeros of the input.
+
+    Sparse COO/CSR tensors are multiplied with a sparse matmul, and bags of
+    (indices, offsets, values) are reduced with a summing ``embedding_bag``. Dense
+    inputs fall back to ``F.linear``. All paths equal ``F.linear(x.to_dense(), ...)``.
+
+    :param x: Sparse batch of shape (batch, n_inputs) or an (indices, offsets,
+        values) bag as used by ``nn.EmbeddingBag``.
+    :type x: torch.Tensor | tuple[torch.Tensor, torch.Tensor, torch.Tensor]
+    :param weight: Weight of shape (n_outputs, n_inputs).
+    :type weight: torch.Tensor
+    :param bias: Bias of shape (n_outputs,), defaults to None
+    :type bias: torch.Tensor | None, optional
+    :return: Dense output of shape (batch, n_outputs).
+    :rtype: torch.Tensor
+    """
+    if isinstance(x, tuple):
+        indices, offsets, values = x
+        out = F.embedding_bag(
+            indices, weight.t(), offsets, mode="sum", per_sample_weights=values
+        )
+    elif x.layout != torch.strided:
+        out = torch.sparse.mm(x, weight.t())
+    else:
+        return F.linear(x, weight, bias)
+    return out if bias is None else out + bias
+
+
 class TfIdfAttention(nn.Module):
     """An attention model for TfIdf features.
 
@@ -60,11 +105,41 @@ class TfIdfAttention(nn.Module):
         self.net = nn.Sequential(*layers)
 
     def forward(self, x):
-        x, _ = self.attention(x, x, x)
+        if is_sparse_input(x):
+            x = self._sparse_attention(x)
+        else:
+            x, _ = self.attention(x, x, x)
         x = self.net(x)
         x = x.squeeze()
         return x
 
+    def _sparse_attention(
+        self, x: torch.Tensor | tuple[torch.Tensor, ...]
+    ) -> torch.Tensor:
+        """Self-attention over a sparse batch, projecting the inputs sparsely.
+
+        Matches ``self.attention(x, x, x)`` on the dense, unbatched (batch, n_inputs)
+        input, with the batch acting as the sequence.
+
+        :param x: Sparse input batch or (indices, offsets, values) bag.
+        :type x: torch.Tensor | tuple[torch.Tensor, ...]
+        :return: Attention output of shape (batch, n_inputs).
+        :rtype: torch.Tensor
+        """
+        attn = self.attention
+        qkv = sparse_linear(x, attn.in_proj_weight, attn.in_proj_bias)
+        seq_len = qkv.shape[0]
+        head_dim = attn.embed_dim // attn.num_heads
+        q, k, v = (
+            t.reshape(seq_len, attn.num_heads, head_dim).transpose(0, 1)
+            for t in qkv.chunk(3, dim=-1)
+        )
+        out = F.scaled_dot_product_attention(
+            q, k, v, dropout_p=attn.dropout if self.training else 0.0
+        )
+        out = out.transpose(0, 1).reshape(seq_len, attn.embed_dim)
+        return attn.out_proj(out)
+
 
 class TfIdfDense(nn.Module):
     """A dense model for TfIdf features.
@@ -106,5 +181,8 @@ class TfIdfDense(nn.Module):
         self.net = nn.Sequential(*layers)
 
     def forward(self, x):
+        if is_sparse_input(x):
+            x = sparse_linear(x, self.fc.weight, self.fc.bias)
+            return self.net[1:](x)
         x = self.net(x)
         return x
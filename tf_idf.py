@@ -1,7 +1,11 @@
 """This script runs various machine learning models with 5-fold cross validation
 on tf-idf features and evaluates them using various metrics.
 """
+import argparse
+import hashlib
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from functools import partial
 from typing import Callable
 
@@ -10,39 +14,164 @@ import pandas as pd
 import seaborn as sns
 import torch
 from iterstrat.ml_stratifiers import MultilabelStratifiedKFold
-from nltk.tokenize import word_tokenize
 from sklearn.ensemble import RandomForestClassifier
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics import (accuracy_score, average_precision_score,
-                             coverage_error, f1_score,
-                             label_ranking_average_precision_score,
-                             label_ranking_loss, multilabel_confusion_matrix,
-                             precision_score, recall_score, roc_auc_score)
+from sklearn.metrics import multilabel_confusion_matrix
 from sklearn.neighbors import KNeighborsClassifier
 from sklearn.neural_network import MLPClassifier
 from sklearn.tree import DecisionTreeClassifier
+from threadpoolctl import threadpool_limits
 from torch import nn
-from torch.utils.data import DataLoader, Subset
 
-from dataset.tfidf import TfIdfDataset
+from dataset.artifacts import FeatureArtifact, fingerprint
+from dataset.counts import TermCounts
+from dataset.labels import LabelMatrix
+from dataset.reduction import FeatureReducer
+from dataset.tfidf import TfIdfDataset, batch_loader
 from dataset.transformers_dataset import load_data
-from metrics.auc import godbole_accuracy, k_fold_roc_curve
-from models.learner import (AccuracyCallback, F1Callback, Learner,
-                            ModelProgressCallback, PlotGraphCallback,
+from metrics.auc import k_fold_roc_curve
+from metrics.multilabel import multilabel_metrics
+from metrics.results_store import ResultsStore, fold_outputs, summary_frame
+from metrics.threshold import best_threshold
+from models.checkpoint import CheckpointManager
+from models.learner import (AccuracyCallback, EarlyStoppingCallback,
+                            F1Callback, Learner, ModelProgressCallback,
+                            PlotGraphCallback, ProfilerCallback,
                             SaveModelCallback)
+from models.neighbours import SparseCosineKNN
 from models.tfidf_attention import TfIdfDense
 
 NUM_FOLDS = 5
 NUM_HEADS = 12
 BATCH_SIZE = 32
 NUM_EPOCHS = 50
+PATIENCE = 5  # Evaluations without a lower validation loss before stopping
+EVAL_EVERY = 1  # Evaluate on the validation fold every this many epochs
+EVAL_SUBSAMPLE = None  # Number or fraction of validation rows evaluated in training
+COMPILE = False  # Run the PyTorch models through torch.compile
+AUTOCAST_DTYPE = None  # Mixed precision training, e.g. torch.bfloat16 on CPU
+PREFETCH = 2  # Batches prepared ahead in a background thread, 0 to disable
+RESUME = False  # Resume the PyTorch folds from their latest training checkpoints
+KEEP_CHECKPOINTS = 2  # Training checkpoints kept per fold
+PROFILE = False  # Profile the training phases and trace a few steps per fold
 THRESHOLD = 0.85
+PER_FOLD_IDF = False  # Fit the tf-idf vocabulary and IDF on each training fold only
+TOKEN_CACHE_DIR = "cache/tokens"  # On-disk cache of tokenised articles
+FEATURE_CACHE_DIR = "cache/features"  # Persisted tf-idf feature artifacts
+REDUCTION = None  # None, "svd" or "random_projection" to train on dense components
+N_COMPONENTS = 256  # Number of dense components of the reduction
+REDUCTION_CACHE_DIR = "cache/reduction"  # Per-fold cache of the fitted reductions
+N_JOBS = None  # Worker processes for the (model, fold) grid, None for all cores
+RESULTS_DIR = "results/tf_idf"  # Store of per-fold predictions and metrics
 DEVICE = "mps" if torch.backends.mps.is_available() else "cpu"
 DEVICE = "cuda" if torch.cuda.is_available() else DEVICE
 
 
+def train_and_eval_fold(
+    model_class: Callable,
+    X: np.ndarray,
+    y: np.ndarray,
+    train_idx: np.ndarray,
+    test_idx: np.ndarray,
+    counts: TermCounts = None,
+    reducer: FeatureReducer = None,
+) -> dict:
+    """Train and evaluate a model on a single cross-validation fold.
+
+    :param model_class: Class of the model to be trained
+    :type model_class: Callable
+    :param X: Dataset of input features
+    :type X: np.ndarray
+    :param y: Dataset of target labels
+    :type y: np.ndarray
+    :param train_idx: Training rows of the fold
+    :type train_idx: np.ndarray
+    :param test_idx: Test rows of the fold
+    :type test_idx: np.ndarray
+    :param counts: Term counts to refit the tf-idf features on the training rows,
+        defaults to None
+    :type counts: TermCounts, optional
+    :param reducer: Reduction fitted on the training rows to train on dense
+        components instead of the tf-idf features, defaults to None
+    :type reducer: FeatureReducer, optional
+    :return: Metrics, predictions and labels of the fold
+    :rtype: dict
+    """
+    # Split the dataset into training and testing sets
+    X_fold = X if counts is None else counts.tfidf(fit_rows=train_idx)[0]
+    if reducer is not None:
+        X_fold = reducer.fit_transform(X_fold, train_idx)
+    X_train, X_test = X_fold[train_idx], X_fold[test_idx]
+    y_train, y_test = y[train_idx], y[test_idx]
+
+    # Initialize and fit the model to training data
+    model = model_class()
+    model.fit(X_train, y_train)
+
+    # Retrieve the predicted probabilities and labels
+    y_prob = np.array(model.predict_proba(X_test))
+    if not model_class.__name__ == "MLPClassifier":
+        y_prob = y_prob[:, :, 1].reshape(len(y_test), -1)
+    y_pred = model.predict(X_test)
+
+    # Calculate metrics
+    return {
+        **multilabel_metrics(y_test, y_prob, y_pred).as_dict(),
+        "y_pred": y_pred,
+        "y": y_test,
+        "y_prob": y_prob,
+    }
+
+
+def print_fold(i: int, res: dict) -> None:
+    """Print the metrics of a single fold.
+
+    :param i: Index of the fold
+    :type i: int
+    :param res: Fold results from `train_and_eval_fold`
+    :type res: dict
+    """
+    y_test = res["y"]
+    chance_level = y_test.sum() / y_test.size
+    fill_rate = np.sum(y_test) / y_test.size
+    print(f"Fold: {i + 1}")
+    print(
+        f"acc: {res['acc']:.4f}",
+        f"jaccard_index: {res['jaccard_index']:.4f} / {chance_level:.4f} (chance)",
+        f"lrap: {res['lrap']:.4f} / {chance_level:.4f} (chance)",
+        f"f1: {res['f1']:.4f}",
+        f"lrl: {res['lrl']:.4f}",
+        f"rec: {res['rec']:.4f}",
+        f"prec: {res['prec']:.4f}",
+        f"spec: {res['spec']: 4f}",
+        f"cov_err: {res['cov_err']:.4f}",
+        f"auroc: {res['auroc']:.4f}",
+        f"ap: {res['ap']:.4f}",
+        f"fill_rate_pred: {res['fill_rate_preds']:.4f} / {fill_rate:.4f} (true)",
+        sep="\n",
+        end="\n\n",
+    )
+
+
+def collect_folds(folds: list[dict]) -> dict[str, list]:
+    """Combine the results of all folds into lists per metric.
+
+    :param folds: Fold results from `train_and_eval_fold`, in fold order
+    :type folds: list[dict]
+    :return: Dictionary of metrics, with the confusion matrices of the last fold
+    :rtype: dict[str, list]
+    """
+    results = {key: [res[key] for res in folds] for key in folds[0]}
+    results["mlm"] = multilabel_confusion_matrix(folds[-1]["y"], folds[-1]["y_pred"])
+    return results
+
+
 def train_and_eval(
-    mskf: MultilabelStratifiedKFold, model_class: Callable, X: np.ndarray, y: np.ndarray
+    mskf: MultilabelStratifiedKFold,
+    model_class: Callable,
+    X: np.ndarray,
+    y: np.ndarray,
+    counts: TermCounts = None,
+    reducer: FeatureReducer = None,
 ) -> dict[str, float]:
     """Train and evaluate a model using MultilabelStratifiedKFold cross-validation.
 
@@ -50,128 +179,262 @@ def train_and_eval(
     :type mskf: MultilabelStratifiedKFold
     :param model_class: Class of the model to be trained
     :type model_class: Callable
-    :param X: Dataset of input features
+    :param X: Dataset of input features, converted to float32 if needed
     :type X: np.ndarray
     :param y: Dataset of target labels
     :type y: np.ndarray
+    :param counts: Term counts to refit the tf-idf features on the training rows of
+        each fold, defaults to None
+    :type counts: TermCounts, optional
+    :param reducer: Reduction fitted on the training rows of each fold to train on
+        dense components instead of the tf-idf features, defaults to None
+    :type reducer: FeatureReducer, optional
     :return: Dictionary of metrics
     :rtype: dict[str, float]
     """
     print(f"Model type: {model_class.__name__}")
+    X = X.astype(np.float32, copy=False)
 
-    # Initialize lists to store metrics
-    accs, lraps, f1s, lrls, precs, recs, specs, cov_errs, aurocs, aps, godbole_accs, fill_rate_preds = (
-        [],
-        [],
-        [],
-        [],
-        [],
-        [],
-        [],
-        [],
-        [],
-        [],
-        [],
-        []
-    )
-    y_preds, y_probs, y_tests = [], [], []
-
+    folds = []
     for i, (train_idx, test_idx) in enumerate(mskf.split(X, y)):
-        # Split the dataset into training and testing sets
-        X_train, X_test = X[train_idx], X[test_idx]
-        y_train, y_test = y[train_idx], y[test_idx]
+        res = train_and_eval_fold(
+            model_class, X, y, train_idx, test_idx, counts, reducer
+        )
+        print_fold(i, res)
+        folds.append(res)
+    return collect_folds(folds)
 
-        # Initialize and fit the model to training data
-        model = model_class()
-        model.fit(X_train, y_train)
 
-        # Retrieve the predicted probabilities and labels
-        y_prob = np.array(model.predict_proba(X_test))
-        if not model_class.__name__ == "MLPClassifier":
-            y_prob = y_prob[:, :, 1].reshape(len(y_test), -1)
-        y_pred = model.predict(X_test)
+_worker_features = {}
 
-        # Calculate metrics
-        chance_level = y_test.sum() / y_test.size
-        acc = accuracy_score(y_test, y_pred)
-        godbole_acc = godbole_accuracy(y_test, y_pred, "macro")
-        cov_error = coverage_error(y_test, y_prob)
-        f1 = f1_score(y_test, y_pred, average="micro")
-        lrap = label_ranking_average_precision_score(y_test, y_prob)
-        lrl = label_ranking_loss(y_test, y_prob)
-        prec = precision_score(y_test, y_pred, average="micro")
-        rec = recall_score(y_test, y_pred, average="micro")
-        y_test_inv = 1 - y_test
-        y_pred_inv = 1 - y_pred
-        spec = recall_score(y_test_inv, y_pred_inv, average="micro")
-        mlm = multilabel_confusion_matrix(y_test, y_pred)
-        auroc = roc_auc_score(y_test, y_prob, average="micro")
-        ap = average_precision_score(y_test, y_prob, average="micro")
-
-        # Append metrics to lists
-        accs.append(acc)
-        godbole_accs.append(godbole_acc)
-        lraps.append(lrap)
-        f1s.append(f1)
-        lrls.append(lrl)
-        precs.append(prec)
-        recs.append(rec)
-        specs.append(spec)
-        cov_errs.append(cov_error)
-        y_preds.append(y_pred)
-        y_probs.append(y_prob)
-        y_tests.append(y_test)
-        aurocs.append(auroc)
-        aps.append(ap)
-        fill_rate = np.sum(y_test) / y_test.size
-        fill_rate_pred = np.sum(y_pred) / y_pred.size
-        fill_rate_preds.append(fill_rate_pred)
-
-        # Print metrics
-        print(f"Fold: {i + 1}")
-        print(
-            f"acc: {acc:.4f}",
-            f"jaccard_index: {godbole_acc:.4f} / {chance_level:.4f} (chance)",
-            f"lrap: {lrap:.4f} / {chance_level:.4f} (chance)",
-            f"f1: {f1:.4f}",
-            f"lrl: {lrl:.4f}",
-            f"rec: {rec:.4f}",
-            f"prec: {prec:.4f}",
-            f"spec: {spec: 4f}",
-            f"cov_err: {cov_error:.4f}",
-            f"auroc: {auroc:.4f}",
-            f"ap: {ap:.4f}",
-            f"fill_rate_pred: {fill_rate_pred:.4f} / {fill_rate:.4f} (true)",
-            sep="\n",
-            end="\n\n",
-        )
 
-    # Return metrics as a dictionary
-    return {
-        "acc": accs,
-        "jaccard_index": godbole_accs,
-        "f1": f1s,
-        "rec": recs,
-        "prec": precs,
-        "spec": specs,
-        "lrap": lraps,
-        "lrl": lrls,
-        "cov_err": cov_errs,
-        "auroc": aurocs,
-        "ap": aps,
-        "fill_rate_preds": fill_rate_preds,
-        "y_pred": y_preds,
-        "y": y_tests,
-        "y_prob": y_probs,
-        "mlm": mlm,
-    }
+def _init_worker() -> None:
+    """Keep every worker of the fold pool to a single BLAS/OpenMP thread."""
+    threadpool_limits(1)
+
+
+def _load_worker_features(features_pth: str) -> np.ndarray:
+    """Load the shared inputs once per worker process.
+
+    The tf-idf matrix or the dense components are memory-mapped, so all workers
+    read the same pages.
+
+    :param features_pth: Path to the feature artifact, or to the ``.npy`` components
+        of a reduction
+    :type features_pth: str
+    :return: Feature matrix
+    :rtype: np.ndarray
+    """
+    if features_pth not in _worker_features:
+        if features_pth.endswith(".npy"):
+            X = np.load(features_pth, mmap_mode="r")
+        else:
+            X = FeatureArtifact.load(features_pth).X
+        _worker_features[features_pth] = X
+    return _worker_features[features_pth]
+
+
+def save_fold_features(
+    counts: TermCounts,
+    features_fingerprint: str,
+    splits: list[tuple[np.ndarray, np.ndarray]],
+    root_dir: str,
+) -> list[str]:
+    """Fit the tf-idf features of every fold on its training rows and save them.
+
+    Every fold is fitted once for all models, and the workers memory-map the saved
+    artifacts. Artifacts of the same corpus and training rows are reused.
+
+    :param counts: Term counts of the corpus
+    :type counts: TermCounts
+    :param features_fingerprint: Fingerprint of the full-corpus feature artifact,
+        which covers the articles and vectoriser parameters
+    :type features_fingerprint: str
+    :param splits: Training and test rows of every fold
+    :type splits: list[tuple[np.ndarray, np.ndarray]]
+    :param root_dir: Directory of the fold artifacts
+    :type root_dir: str
+    :return: Path to the feature artifact of every fold
+    :rtype: list[str]
+    """
+    paths = []
+    for i, (train_idx, _) in enumerate(splits):
+        path = f"{root_dir}/tfidf_fold_{i}.npz"
+        params = {
+            "features": features_fingerprint,
+            "fit_rows": hashlib.sha256(np.asarray(train_idx).tobytes()).hexdigest(),
+        }
+        digest = fingerprint([], params)
+        if FeatureArtifact.load_if_fresh(path, digest) is None:
+            columns, transformer = counts.fit_tfidf(fit_rows=train_idx)
+            FeatureArtifact(
+                counts.transform(columns, transformer),
+                counts.vocabulary[columns],
+                transformer.idf_,
+                digest,
+                params,
+            ).save(path)
+        paths.append(path)
+    return paths
+
+
+def save_fold_reductions(
+    reducer: FeatureReducer,
+    features_pths: list[str],
+    splits: list[tuple[np.ndarray, np.ndarray]],
+    root_dir: str,
+) -> list[str]:
+    """Fit the reduction of every fold on its training rows and save the components.
+
+    Every fold is reduced once for all models, and the workers memory-map the saved
+    components instead of fitting the same reduction each. The fitted reductions
+    are cached by the reducer.
+
+    :param reducer: Reduction to fit on the training rows of every fold
+    :type reducer: FeatureReducer
+    :param features_pths: Path to the feature artifact of every fold
+    :type features_pths: list[str]
+    :param splits: Training and test rows of every fold
+    :type splits: list[tuple[np.ndarray, np.ndarray]]
+    :param root_dir: Directory of the fold components
+    :type root_dir: str
+    :return: Path to the ``.npy`` components of every fold
+    :rtype: list[str]
+    """
+    os.makedirs(root_dir, exist_ok=True)
+    paths = []
+    for i, ((train_idx, _), features_pth) in enumerate(zip(splits, features_pths)):
+        path = f"{root_dir}/reduced_fold_{i}.npy"
+        X = FeatureArtifact.load(features_pth).X
+        np.save(path, reducer.fit_transform(X, train_idx))
+        paths.append(path)
+    return paths
+
+
+def _run_fold_job(
+    model_class: Callable,
+    features_pth: str,
+    y: np.ndarray,
+    train_idx: np.ndarray,
+    test_idx: np.ndarray,
+) -> dict:
+    """Run `train_and_eval_fold` in a worker on the memory-mapped features.
+
+    :param model_class: Class of the model to be trained
+    :type model_class: Callable
+    :param features_pth: Path to the feature artifact, or to the ``.npy``
+        components of a reduction
+    :type features_pth: str
+    :param y: Dataset of target labels
+    :type y: np.ndarray
+    :param train_idx: Training rows of the fold
+    :type train_idx: np.ndarray
+    :param test_idx: Test rows of the fold
+    :type test_idx: np.ndarray
+    :return: Fold results from `train_and_eval_fold`
+    :rtype: dict
+    """
+    X = _load_worker_features(features_pth)
+    return train_and_eval_fold(model_class, X, y, train_idx, test_idx)
+
+
+def train_and_eval_parallel(
+    mskf: MultilabelStratifiedKFold,
+    models: dict[str, Callable],
+    features_pth: str,
+    y: np.ndarray,
+    n_jobs: int | None = None,
+    fold_features_pths: list[str] | None = None,
+    store: ResultsStore = None,
+    config: dict = None,
+) -> dict[str, dict[str, float]]:
+    """Cross-validate several models, running every (model, fold) pair in parallel.
+
+    Workers memory-map the feature artifact instead of receiving a pickled copy of
+    the matrix, and results are gathered and printed in model and fold order. With a
+    store, folds it already holds are loaded instead of retrained, and new folds are
+    saved to it.
+
+    :param mskf: MultilabelStratifiedKFold object
+    :type mskf: MultilabelStratifiedKFold
+    :param models: Classes of the models to be trained, by the name their results
+        are stored and reported under
+    :type models: dict[str, Callable]
+    :param features_pth: Path to the saved `FeatureArtifact` of the inputs
+    :type features_pth: str
+    :param y: Dataset of target labels
+    :type y: np.ndarray
+    :param n_jobs: Number of worker processes, defaults to all cores. 1 runs every
+        job in the calling process.
+    :type n_jobs: int | None, optional
+    :param fold_features_pths: Paths to the feature artifacts fitted on the
+        training rows of each fold, see `save_fold_features`, or to their dense
+        components, see `save_fold_reductions`, used instead of ``features_pth``,
+        defaults to None
+    :type fold_features_pths: list[str] | None, optional
+    :param store: Store of fold results, defaults to None
+    :type store: ResultsStore, optional
+    :param config: Configuration the store keys the results by, defaults to None
+    :type config: dict, optional
+    :return: Dictionary of metrics per model name
+    :rtype: dict[str, dict[str, float]]
+    """
+    splits = list(mskf.split(np.zeros((len(y), 1)), y))
+    jobs = [
+        (name, i, train_idx, test_idx)
+        for name in models
+        for i, (train_idx, test_idx) in enumerate(splits)
+    ]
+    fold_pths = fold_features_pths or [features_pth] * len(splits)
+    outputs = {}
+    if store is not None:
+        for name, i, _, _ in jobs:
+            if store.has_fold(name, config, i):
+                outputs[name, i] = store.load_fold(name, config, i)
+    pending = [job for job in jobs if (job[0], job[1]) not in outputs]
+
+    n_jobs = n_jobs or os.cpu_count()
+    if n_jobs == 1:
+        for name, i, tr, te in pending:
+            outputs[name, i] = _run_fold_job(models[name], fold_pths[i], y, tr, te)
+    elif pending:
+        with ProcessPoolExecutor(n_jobs, initializer=_init_worker) as executor:
+            futures = {
+                (name, i): executor.submit(
+                    _run_fold_job, models[name], fold_pths[i], y, tr, te
+                )
+                for name, i, tr, te in pending
+            }
+            for key, future in futures.items():
+                outputs[key] = future.result()
+    if store is not None:
+        for name, i, _, _ in pending:
+            store.save_fold(name, config, i, outputs[name, i])
+
+    results = {}
+    for name in models:
+        print(f"Model type: {name}")
+        folds = [outputs[name, i] for i in range(len(splits))]
+        for i, res in enumerate(folds):
+            print_fold(i, res)
+        results[name] = collect_folds(folds)
+    return results
 
 
 def train_and_eval_pytorch(
-    mskf: MultilabelStratifiedKFold, model: partial, model_name: str, ds: TfIdfDataset
+    mskf: MultilabelStratifiedKFold,
+    model: partial,
+    model_name: str,
+    ds: TfIdfDataset,
+    reducer: FeatureReducer = None,
+    store: ResultsStore = None,
+    config: dict = None,
 ) -> dict[str, float]:
     """Train and evaluate a model using MultilabelStratifiedKFold cross-validation.
 
+    With a store, folds it already holds are loaded instead of retrained, and new
+    folds are saved to it.
+
     :param mskf: MultilabelStratifiedKFold object
     :type mskf: MultilabelStratifiedKFold
     :param model: Class of the model to be trained
@@ -180,36 +443,41 @@ def train_and_eval_pytorch(
     :type model_name: str
     :param ds: TfIdfDataset object
     :type ds: TfIdfDataset
+    :param reducer: Reduction fitted on the training rows of each fold to train on
+        dense components instead of the tf-idf features, defaults to None
+    :type reducer: FeatureReducer, optional
+    :param store: Store of fold results, defaults to None
+    :type store: ResultsStore, optional
+    :param config: Configuration the store keys the results by and the checkpoints
+        of every fold are tied to, defaults to None
+    :type config: dict, optional
     :return: Dictionary of metrics
     :rtype: dict[str, float]
     """
     print(f"Model type: {model_name}")
-    # Initialize lists to store metrics
-    (
-        accs,
-        lraps,
-        f1s,
-        lrls,
-        precs,
-        recs,
-        specs,
-        cov_errs,
-        aurocs,
-        aps,
-        godbole_accs,
-        fill_rate_preds,
-    ) = ([], [], [], [], [], [], [], [], [], [], [], [])
-    y_preds, y_probs, y_tests = [], [], []
 
+    folds = []
     for i, (train_idx, test_idx) in enumerate(mskf.split(ds.X, ds.y)):
-        # Split the dataset into training and testing sets
-        train_ds = Subset(ds, train_idx)
-        test_ds = Subset(ds, test_idx)
-        train_dl = DataLoader(train_ds, batch_size=BATCH_SIZE, shuffle=True)
-        test_dl = DataLoader(test_ds, batch_size=BATCH_SIZE, shuffle=False)
+        if store is not None and store.has_fold(model_name, config, i):
+            res = store.load_fold(model_name, config, i)
+            print_fold(i, res)
+            folds.append(res)
+            continue
+
+        # Split the dataset into training and testing sets, collating whole batches
+        # as sparse tensors for the sparse-aware input layer unless reduced
+        ds.set_reduction(reducer, train_idx)
+        sparse = reducer is None
+        train_dl = batch_loader(ds, train_idx, BATCH_SIZE, shuffle=True, sparse=sparse)
+        test_dl = batch_loader(ds, test_idx, BATCH_SIZE, shuffle=False, sparse=sparse)
 
         # Initialize and fit the model to training data
         model_instance = model()
+        profiler = (
+            [ProfilerCallback(f"ckpts/{model_name}/fold_{i}/profile", (5, 10))]
+            if PROFILE
+            else []
+        )
         learner = Learner(
             model_instance,
             nn.BCEWithLogitsLoss(),
@@ -224,126 +492,65 @@ def train_and_eval_pytorch(
                     model_pth="model_best.pth",
                     metric="valid_loss",
                 ),
-                ModelProgressCallback(["accuracy", "f1"]),
+                ModelProgressCallback(["accuracy", "f1", "train_data_wait"]),
+                EarlyStoppingCallback(
+                    patience=PATIENCE,
+                    model=model_instance,
+                    restore_best_weights=True,
+                ),
+                *profiler,
             ],
             metrics=[
                 F1Callback(multilabel=True),
                 AccuracyCallback(threshold=THRESHOLD, multilabel=True),
             ],
+            compile_model=COMPILE,
+            autocast_dtype=AUTOCAST_DTYPE,
+            prefetch=PREFETCH,
+        )
+        learner.fit(
+            train_dl,
+            test_dl,
+            NUM_EPOCHS,
+            eval_every=EVAL_EVERY,
+            eval_subsample=EVAL_SUBSAMPLE,
+            checkpoint=CheckpointManager(
+                f"ckpts/{model_name}/fold_{i}/state",
+                keep_last=KEEP_CHECKPOINTS,
+                config=config,
+            ),
+            resume=RESUME,
         )
-        learner.fit(train_dl, test_dl, NUM_EPOCHS)
 
         # Retrieve the predicted probabilities and labels
         _, y_prob, y_test = learner.evaluate(test_dl)
-        best_thresh = 0
-        max_f1 = 0.0
-        for thresh in sorted(y_prob.flatten()):
-            y_pred = (y_prob > thresh).astype(int)
-            f1 = f1_score(y_test, y_pred, average="samples")
-            if f1 > max_f1:
-                max_f1 = f1
-                best_thresh = thresh
+        best_thresh, _ = best_threshold(y_test, y_prob)
         y_pred = (y_prob > best_thresh).astype(int)
         y_test = y_test.astype(int)
 
         # Calculate metrics
-        acc = accuracy_score(y_test, y_pred)
-        chance_level = y_test.sum() / y_test.size
-        godbole_acc = godbole_accuracy(y_test, y_pred, "macro")
-        cov_error = coverage_error(y_test, y_prob)
-        f1 = f1_score(y_test, y_pred, average="micro")
-        lrap = label_ranking_average_precision_score(y_test, y_prob)
-        lrl = label_ranking_loss(y_test, y_prob)
-        prec = precision_score(y_test, y_pred, average="micro")
-        rec = recall_score(y_test, y_pred, average="micro")
-        y_test_inv = 1 - y_test
-        y_pred_inv = 1 - y_pred
-        spec = recall_score(y_test_inv, y_pred_inv, average="micro")
-        mlm = multilabel_confusion_matrix(y_test, y_pred)
-        auroc = roc_auc_score(y_test, y_prob, average="micro")
-        ap = average_precision_score(y_test, y_prob, average="micro")
-
-        # Append metrics to lists
-        accs.append(acc)
-        godbole_accs.append(godbole_acc)
-        lraps.append(lrap)
-        f1s.append(f1)
-        lrls.append(lrl)
-        precs.append(prec)
-        recs.append(rec)
-        specs.append(spec)
-        cov_errs.append(cov_error)
-        y_preds.append(y_pred)
-        y_probs.append(y_prob)
-        y_tests.append(y_test)
-        aurocs.append(auroc)
-        aps.append(ap)
-        fill_rate = np.sum(y_test) / y_test.size
-        fill_rate_pred = np.sum(y_pred) / y_pred.size
-        fill_rate_preds.append(fill_rate_pred)
-
-        # Print metrics
-        print(f"Fold: {i + 1}")
-        print(
-            f"acc: {acc:.4f}",
-            f"jaccard_index: {godbole_acc:.4f} / {chance_level:.4f} (chance)",
-            f"lrap: {lrap:.4f} / {chance_level:.4f} (chance)",
-            f"f1: {f1:.4f}",
-            f"lrl: {lrl:.4f}",
-            f"rec: {rec:.4f}",
-            f"prec: {prec:.4f}",
-            f"spec: {spec: 4f}",
-            f"cov_err: {cov_error:.4f}",
-            f"auroc: {auroc:.4f}",
-            f"ap: {ap:.4f}",
-            f"fill_rate_pred: {fill_rate_pred:.4f} / {fill_rate:.4f} (true)",
-            sep="\n",
-            end="\n\n",
-        )
-
-    # Return metrics as a dictionary
-    return {
-        "acc": accs,
-        "jaccard_index": godbole_accs,
-        "f1": f1s,
-        "rec": recs,
-        "prec": precs,
-        "spec": specs,
-        "lrap": lraps,
-        "lrl": lrls,
-        "cov_err": cov_errs,
-        "auroc": aurocs,
-        "ap": aps,
-        "fill_rate_preds": fill_rate_preds,
-        "y_pred": y_preds,
-        "y": y_tests,
-        "y_prob": y_probs,
-        "mlm": mlm,
-    }
-
-
-def main():
-    """Run the main function to train and evaluate models on tf-idf features.
+        res = {
+            **multilabel_metrics(y_test, y_prob, y_pred).as_dict(),
+            "y_pred": y_pred,
+            "y": y_test,
+            "y_prob": y_prob,
+        }
+        if store is not None:
+            store.save_fold(model_name, config, i, res)
+        print_fold(i, res)
+        folds.append(res)
+    return collect_folds(folds)
+
+
+def print_summary(results: dict[str, dict[str, list]], y: np.ndarray) -> None:
+    """Print the mean and standard deviation of the metrics of every model.
+
+    :param results: Cross-validation results per model name
+    :type results: dict[str, dict[str, list]]
+    :param y: Dataset of target labels
+    :type y: np.ndarray
     """
-
-    # Load the dataset and vectorize the text
-    sns.set_theme("paper", "whitegrid")
-    df = load_data("multi_label_dataset.csv", "articles", False)
-    vectorizer = TfidfVectorizer(tokenizer=word_tokenize)
-    X = vectorizer.fit_transform(df["Text"])
-    y = df[df.columns[2:-1]].to_numpy()
-
-    # MultilabelStratifiedKFold cross-validation
-    mskf = MultilabelStratifiedKFold(
-        n_splits=NUM_FOLDS, shuffle=True, random_state=42)
-    results = {}
-    for model in [RandomForestClassifier, KNeighborsClassifier, DecisionTreeClassifier, MLPClassifier]:
-        res = train_and_eval(mskf, model, X, y)
-        results[model.__name__] = res
-
     chance_level = y.sum() / y.size
-
-    # Print metrics
     for model, res in results.items():
         print("\n")
         print("=" * 80)
@@ -355,7 +562,7 @@ def main():
             f"prec: {np.mean(res['prec']):.4f} +/- {np.std(res['prec']):.4f}",
             f"spec: {np.mean(res['spec']):.4f} +/- {np.std(res['spec']):.4f}",
             f"f1: {np.mean(res['f1']):.4f} +/- {np.std(res['f1']):.4f}",
-            f"lrap: {np.mean(res['lrap']):.4f} +/- {np.std(res["lrap"]):.4f} / {chance_level:.4f} (chance level)",
+            f"lrap: {np.mean(res['lrap']):.4f} +/- {np.std(res['lrap']):.4f} / {chance_level:.4f} (chance level)",
             f"lrl: {np.mean(res['lrl']):.4f} +/- {np.std(res['lrl']):.4f}",
             f"cov_err: {np.mean(res['cov_err']):.4f} +/- {np.std(res['cov_err']):.4f}",
             f"auroc: {np.mean(res['auroc']):.4f} +/- {np.std(res['auroc']):.4f}",
@@ -366,92 +573,164 @@ def main():
             end="\n",
         )
 
-    # Deep Learning training
-    ds = TfIdfDataset("multi_label_dataset.csv", "articles", False)
-    PADDED_SIZE = math.ceil(ds.X[0].shape[1] / NUM_HEADS) * NUM_HEADS
-    ds.set_padded_shape((0, PADDED_SIZE))
 
-    model_partial = partial(
-        TfIdfDense,
-        n_inputs=PADDED_SIZE,
-        n_outputs=len(ds.df.columns[2:-1]),
-        hidden_size=[32, 64, 32],
-        dropout=0.2
-    )
-    res = train_and_eval_pytorch(mskf, model_partial, "TfIdfDense", ds)
-    results["TfIdfDense"] = res
+def report(results: dict[str, dict[str, list]], y: np.ndarray) -> None:
+    """Print the summary table and plot the ROC and PRC curves of every model.
 
-    # Print metrics
-    for model, res in results.items():
-        print("\n")
-        print("=" * 80)
-        print(f"model: {model}")
-        print(
-            f"acc: {np.mean(res['acc']):.4f} +/- {np.std(res['acc']):.4f}",
-            f"jaccard_index: {np.mean(res['jaccard_index']):.4f} +/- {np.std(res['jaccard_index']):.4f} / {chance_level:.4f} (chance level)",
-            f"rec: {np.mean(res['rec']):.4f} +/- {np.std(res['rec']):.4f}",
-            f"prec: {np.mean(res['prec']):.4f} +/- {np.std(res['prec']):.4f}",
-            f"spec: {np.mean(res['spec']):.4f} +/- {np.std(res['spec']):.4f}",
-            f"f1: {np.mean(res['f1']):.4f} +/- {np.std(res['f1']):.4f}",
-            f"lrap: {np.mean(res['lrap']):.4f} +/- {np.std(res["lrap"]):.4f} / {chance_level:.4f} (chance level)",
-            f"lrl: {np.mean(res['lrl']):.4f} +/- {np.std(res['lrl']):.4f}",
-            f"cov_err: {np.mean(res['cov_err']):.4f} +/- {np.std(res['cov_err']):.4f}",
-            f"auroc: {np.mean(res['auroc']):.4f} +/- {np.std(res['auroc']):.4f}",
-            f"ap: {np.mean(res['ap']):.4f} +/- {np.std(res['ap']):.4f} / {chance_level:.4f} (chance level)",
-            f"fill_rate_pred: {np.mean(res['fill_rate_preds']):.4f} +/- {np.std(res['fill_rate_preds']):.4f} / {np.sum(y) / y.size:.4f} (true fill rate)",
-            "=" * 80,
-            sep="\n",
-            end="\n",
-        )
+    :param results: Cross-validation results per model name
+    :type results: dict[str, dict[str, list]]
+    :param y: Dataset of target labels
+    :type y: np.ndarray
+    """
+    print_summary(results, y)
 
     best_model = max(results.items(), key=lambda x: x[1]["f1"])
     print(f"Best model: {best_model[0]}, F1: {np.mean(best_model[1]['f1']):.4f}")
 
-    # Convert results to a DataFrame
-    results_for_df = {}
-    for model_name, result in results.items():
-        if "model" not in results_for_df:
-            results_for_df["model"] = []
-        results_for_df["model"].append(model_name)
-        for metric, values in result.items():
-            if metric in ["y_pred", "y", "y_prob", "mlm"]:
-                continue
-            mean = np.mean(values)
-            std = np.std(values)
-            if metric not in results_for_df:
-                results_for_df[metric] = []
-            results_for_df[metric].append(mean)
-            if f"{metric}_std" not in results_for_df:
-                results_for_df[f"{metric}_std"] = []
-            results_for_df[f"{metric}_std"].append(std)
-
-    results_df = pd.DataFrame.from_dict(results_for_df)
-
     # Display results
+    results_df = summary_frame(results)
     pd.set_option("display.max_columns", None)
     print(results_df)
 
     # Show ROC and PRC for each model over the folds.
-    model_outputs = []
     for model_name, result in results.items():
-        current_model_outputs = []
-        for i in range(NUM_FOLDS):
-            fold_results = {
-                "y_pred": result["y_pred"][i],
-                "y_prob": result["y_prob"][i],
-                "y": result["y"][i],
-            }
-            current_model_outputs.append(fold_results)
-        model_outputs.append(current_model_outputs)
-    for i, model_output in enumerate(model_outputs):
-        model_name = list(results.keys())[i]
         k_fold_roc_curve(
-            model_output,
+            fold_outputs(result),
             model_name,
-            len(df.columns[2:-1]),
+            y.shape[1],
             "weighted",
         )
 
 
+def main(from_store: bool = False):
+    """Run the main function to train and evaluate models on tf-idf features.
+
+    :param from_store: Report the results stored by a previous run instead of
+        training, defaults to False
+    :type from_store: bool, optional
+    """
+
+    # Load the dataset and vectorize the text
+    sns.set_theme("paper", "whitegrid")
+    df = load_data("multi_label_dataset.csv", "articles", False)
+    os.makedirs(FEATURE_CACHE_DIR, exist_ok=True)
+    features_pth = f"{FEATURE_CACHE_DIR}/tfidf_full.npz"
+    counts, artifact = None, None
+    if from_store:
+        # Reporting only needs the fingerprint the results are stored under
+        features_fingerprint = FeatureArtifact.corpus_fingerprint(df["Text"])
+        if FeatureArtifact.load_if_fresh(features_pth, features_fingerprint) is None:
+            raise FileNotFoundError(
+                f"No feature artifact of the current articles at {features_pth}, "
+                "train without --from-store first"
+            )
+    else:
+        # The corpus is tokenised once, every feature artifact derives from the counts
+        counts = TermCounts.from_texts(df["Text"], cache_dir=TOKEN_CACHE_DIR)
+        artifact = FeatureArtifact.build(
+            df["Text"], features_pth, counts, token_cache_dir=TOKEN_CACHE_DIR
+        )
+        features_fingerprint = artifact.fingerprint
+    y = LabelMatrix.from_dataframe(df, df.columns[2:-1]).matrix
+
+    # Results are stored per model, configuration and fold
+    store = ResultsStore(RESULTS_DIR)
+    config = {
+        "features": features_fingerprint,
+        "num_folds": NUM_FOLDS,
+        "per_fold_idf": PER_FOLD_IDF,
+        "reduction": REDUCTION,
+        "n_components": N_COMPONENTS if REDUCTION is not None else None,
+    }
+    dl_config = {
+        **config,
+        "num_epochs": NUM_EPOCHS,
+        "patience": PATIENCE,
+        "eval_every": EVAL_EVERY,
+        "eval_subsample": EVAL_SUBSAMPLE,
+        "batch_size": BATCH_SIZE,
+        "threshold": THRESHOLD,
+        "autocast_dtype": str(AUTOCAST_DTYPE),
+    }
+    # The cosine KNN finds the same neighbours as KNeighborsClassifier on the
+    # L2-normalised tf-idf rows, but not on the dense components of a reduction
+    models = {
+        "RandomForestClassifier": RandomForestClassifier,
+        "KNeighborsClassifier": (
+            SparseCosineKNN if REDUCTION is None else KNeighborsClassifier
+        ),
+        "DecisionTreeClassifier": DecisionTreeClassifier,
+        "MLPClassifier": MLPClassifier,
+    }
+    if from_store:
+        results = {name: store.load(name, config) for name in models}
+        results["TfIdfDense"] = store.load("TfIdfDense", dl_config)
+        report(results, y)
+        return
+
+    # MultilabelStratifiedKFold cross-validation
+    mskf = MultilabelStratifiedKFold(
+        n_splits=NUM_FOLDS, shuffle=True, random_state=42)
+    splits = list(mskf.split(np.zeros((len(y), 1)), y))
+    fold_features_pths = None
+    if PER_FOLD_IDF:
+        fold_features_pths = save_fold_features(
+            counts, features_fingerprint, splits, FEATURE_CACHE_DIR
+        )
+    reducer = None
+    if REDUCTION is not None:
+        # The workers train on the components of each fold, reduced once here
+        reducer = FeatureReducer(
+            REDUCTION, N_COMPONENTS, cache_dir=REDUCTION_CACHE_DIR)
+        fold_features_pths = save_fold_reductions(
+            reducer,
+            fold_features_pths or [features_pth] * len(splits),
+            splits,
+            REDUCTION_CACHE_DIR,
+        )
+    results = train_and_eval_parallel(
+        mskf,
+        models,
+        features_pth,
+        y,
+        N_JOBS,
+        fold_features_pths,
+        store,
+        config,
+    )
+    print_summary(results, y)
+
+    # Deep Learning training, on features selected from the full artifact
+    ds = TfIdfDataset(
+        "multi_label_dataset.csv",
+        "articles",
+        False,
+        counts=counts,
+        source=artifact,
+    )
+    n_inputs = N_COMPONENTS if reducer is not None else ds.X.shape[1]
+    PADDED_SIZE = math.ceil(n_inputs / NUM_HEADS) * NUM_HEADS
+    ds.set_padded_shape((0, PADDED_SIZE))
+
+    model_partial = partial(
+        TfIdfDense,
+        n_inputs=PADDED_SIZE,
+        n_outputs=len(ds.df.columns[2:-1]),
+        hidden_size=[32, 64, 32],
+        dropout=0.2
+    )
+    results["TfIdfDense"] = train_and_eval_pytorch(
+        mskf, model_partial, "TfIdfDense", ds, reducer, store, dl_config
+    )
+
+    report(results, y)
+
+
 if __name__ == "__main__":
-    main()
+    args = argparse.ArgumentParser()
+    args.add_argument(
+        "--from-store",
+        action="store_true",
+        help="Report the stored results of a previous run without training",
+    )
+    main(**vars(args.parse_args()))